@@ -3,21 +3,187 @@ import json
 import requests
 import datetime
 import time
+import asyncio
+
+# custom files
+import rate_limit_pipeline
+import transport_pipeline
+import weather_parser_pipeline
 
 # class that manages collecting and storing data from the Tomorrow.io weather API
 class process_api_data:
-    def __init__(self, coordinates, field_names, API_KEY):
+    def __init__(self, coordinates, field_names, API_KEY, rate_limiter=None, transport=None, async_transport=None, url="https://api.tomorrow.io/v4/timelines", max_history_hours=24, history_window_hours=24):
         self.coordinates = coordinates
         self.field_names = field_names
-        self.url = "https://api.tomorrow.io/v4/timelines"
+        self.url = url      # can point to a local stub server for testing and benchmarking
         self.API_KEY = API_KEY
+        self.rate_limiter = rate_limiter    # shared between every location so the global request budget is respected
+
+        # pooled connections shared between every location (a new pooled transport is used if none is given)
+        self.transport = transport if (transport is not None) else transport_pipeline.http_transport()
+        self.async_transport = async_transport
+
+        # how far back the API can return history and how many hours of history one request can cover
+        self.max_history_hours = max_history_hours
+        self.history_window_hours = history_window_hours
 
         pass
 
+    # parameters for the current and forecasted weather data
+    def weather_data_params(self):
+        params = {
+            "location": self.coordinates,
+            "fields": self.field_names,
+            "units": "imperial",
+            "timesteps": "1h",
+            "apikey": self.API_KEY
+        }
+        return params
+
+    # parameters for the weather data between two hours
+    def time_range_params(self, start_time, end_time):
+        time_range_params = {
+            "location": self.coordinates,
+            "fields": self.field_names,
+            "units": "imperial",
+            "timesteps": "1h",
+            "startTime": start_time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "endTime": end_time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "apikey": self.API_KEY
+        }
+        return time_range_params
+
+    # parameters for the historical observed weather data from the past 24 hours
+    def historically_observed_data_params(self):
+        # set the time range for the past 24 hours
+        current_hour = datetime.datetime.now(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+        return self.time_range_params(current_hour - datetime.timedelta(hours=24), current_hour - datetime.timedelta(hours=1))
+
+    # parameters for the past hours, the current hour, and the forecast in a single request
+    def combined_weather_data_params(self, history_start_time=None):
+        # start the time range 24 hours ago (unless told otherwise) and end it at the same 120 hour forecast horizon the API uses by default
+        current_hour = datetime.datetime.now(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+        if (history_start_time is None):
+            history_start_time = current_hour - datetime.timedelta(hours=24)
+        return self.time_range_params(history_start_time, current_hour + datetime.timedelta(hours=120))
+
+    # first hour of history that has not been recorded yet (limited to how far back the API can go)
+    def missing_history_start_time(self, latest_recorded):
+        current_hour = datetime.datetime.now(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+        earliest_time = current_hour - datetime.timedelta(hours=self.max_history_hours)
+        if (latest_recorded is None):
+            return earliest_time
+        return max(earliest_time, latest_recorded + datetime.timedelta(hours=1))
+
+    # splits a time range into windows that are no longer than one API request is allowed to cover
+    def history_windows(self, start_time, end_time):
+        windows = []
+        while (start_time <= end_time):
+            window_end_time = min(end_time, start_time + datetime.timedelta(hours=self.history_window_hours - 1))
+            windows.append((start_time, window_end_time))
+            start_time = window_end_time + datetime.timedelta(hours=1)
+        return windows
+
+    # first hour of a combined request, the history before it has to be collected with separate requests
+    def combined_start_time(self, history_start_time):
+        current_hour = datetime.datetime.now(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+        return min(current_hour, max(history_start_time, current_hour - datetime.timedelta(hours=self.history_window_hours)))
+
+    # split a combined response into the weather data and the historical weather data responses the parser expects
+    def split_combined_weather_data(self, combined_data):
+        current_hour = datetime.datetime.now(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+        timeline = combined_data['data']['timelines'][0]
+        weather_intervals = []
+        historical_intervals = []
+
+        # every hour before the current hour is history, the current hour and every hour after it are the observed and forecasted data
+        for interval in timeline['intervals']:
+            start_time = datetime.datetime.fromisoformat(interval.get('startTime', '').replace('Z', '+00:00'))
+            if (start_time < current_hour):
+                historical_intervals.append(interval)
+            else:
+                weather_intervals.append(interval)
+
+        weather_data = {'data': {'timelines': [dict(timeline, intervals=weather_intervals)]}}
+        historical_weather_data = {'data': {'timelines': [dict(timeline, intervals=historical_intervals)]}}
+        return weather_data, historical_weather_data
+
     # collect weather data from the API
     def collect_weather_data(self):
-        # make the API request while handling potential errors
+        # store the weather data
+        weather_data = self.request_timelines(self.weather_data_params())
+        #print(weather_data)
+
+        return weather_data
 
+    # collect historical observed weather data from the past 24 hours
+    def collect_historically_observed_data(self):
+        # store the historical weather data
+        historical_weather_data = self.request_timelines(self.historically_observed_data_params())
+        #print(historical_weather_data)
+
+        return historical_weather_data
+
+    # collect only the historical observed hours after the newest recorded hour, one API window at a time
+    def collect_missing_historically_observed_data(self, latest_recorded):
+        current_hour = datetime.datetime.now(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+        start_time = self.missing_history_start_time(latest_recorded)
+        return self.collect_history_windows(start_time, current_hour - datetime.timedelta(hours=1))
+
+    # collect the historical observed data between two hours, paging over ranges longer than one API window
+    def collect_history_windows(self, start_time, end_time):
+        intervals = []
+        for window_start_time, window_end_time in self.history_windows(start_time, end_time):
+            print(f"Collecting missing historically observed data from {window_start_time} to {window_end_time} for {self.coordinates}...\n")
+            historical_weather_data = self.request_timelines(self.time_range_params(window_start_time, window_end_time))
+            intervals.extend(historical_weather_data['data']['timelines'][0]['intervals'])
+
+        return {'data': {'timelines': [{'timestep': '1h', 'intervals': intervals}]}}
+
+    # collect the weather data and the historical weather data with one API request instead of two
+    def collect_combined_weather_data(self, latest_recorded=None, collect_older_history=True):
+        # only ask for the hours that have not been recorded yet (the whole history window if nothing is known)
+        history_start_time = self.missing_history_start_time(latest_recorded)
+        combined_start_time = self.combined_start_time(history_start_time)
+
+        combined_data = self.request_timelines(self.combined_weather_data_params(combined_start_time))
+        weather_data, historical_weather_data = self.split_combined_weather_data(combined_data)
+
+        # after an outage the gap can be longer than one request so the older hours are collected separately (unless they are streamed instead)
+        if (collect_older_history and (history_start_time < combined_start_time)):
+            older_weather_data = self.collect_history_windows(history_start_time, combined_start_time - datetime.timedelta(hours=1))
+            historical_intervals = historical_weather_data['data']['timelines'][0]['intervals']
+            historical_weather_data['data']['timelines'][0]['intervals'] = older_weather_data['data']['timelines'][0]['intervals'] + historical_intervals
+
+        return weather_data, historical_weather_data
+
+    # collect weather data from the API using the async transport
+    async def async_collect_weather_data(self):
+        return await self.async_request_timelines(self.weather_data_params())
+
+    # collect historical observed weather data from the past 24 hours using the async transport
+    async def async_collect_historically_observed_data(self):
+        return await self.async_request_timelines(self.historically_observed_data_params())
+
+    # collect the weather data and the historical weather data with one API request using the async transport
+    async def async_collect_combined_weather_data(self, latest_recorded=None):
+        history_start_time = self.missing_history_start_time(latest_recorded)
+        combined_start_time = self.combined_start_time(history_start_time)
+
+        combined_data = await self.async_request_timelines(self.combined_weather_data_params(combined_start_time))
+        weather_data, historical_weather_data = self.split_combined_weather_data(combined_data)
+
+        # after an outage the gap can be longer than one request so the older hours are collected separately
+        older_intervals = []
+        for window_start_time, window_end_time in self.history_windows(history_start_time, combined_start_time - datetime.timedelta(hours=1)):
+            older_weather_data = await self.async_request_timelines(self.time_range_params(window_start_time, window_end_time))
+            older_intervals.extend(older_weather_data['data']['timelines'][0]['intervals'])
+        historical_weather_data['data']['timelines'][0]['intervals'] = older_intervals + historical_weather_data['data']['timelines'][0]['intervals']
+
+        return weather_data, historical_weather_data
+
+    # make a request to the timelines endpoint while handling potential errors
+    def request_timelines(self, params):
         # initialize variables for retries
         max_retries = 3
         sleep_time = 10
@@ -26,68 +192,93 @@ class process_api_data:
         for attempt in range(1, max_retries + 1):
             # if everything goes right then perform this API request
             try:
-                # make the API request
-                params = {
-                    "location": self.coordinates,
-                    "fields": self.field_names,
-                    "units": "imperial",
-                    "timesteps": "1h",
-                    "apikey": self.API_KEY
-                }
-
-                query = requests.get(url=self.url, params=params, timeout=10)
-                query.raise_for_status()  # raise an error for bad status codes
-
-                ### FOR DEBUGGING PURPOSES ONLY. COMMENT OUT WHEN NOT IN PRODUCTION. ###
-                #print(f"API Status: {query.status_code}\n")
-                #print(f"API Response: {query.text}\n")
-
-                # store the weather data
-                weather_data = query.json()
-                #print(weather_data)
-
-                return weather_data
+                # wait for the shared request budget before calling the API
+                if (self.rate_limiter is not None):
+                    self.rate_limiter.acquire()
+
+                # make the API request over the pooled connection
+                query = self.transport.get(self.url, params, 10)
+                return self.handle_response(query)
             # handle HTTP errors
             except requests.exceptions.HTTPError as HTTPError:
-                # retrieve the status code
-                status = HTTPError.response.status_code
+                retry_time = self.handle_request_error(HTTPError, attempt, max_retries, sleep_time)
+            # handle other request exceptions
+            except requests.exceptions.RequestException as RequestException:
+                retry_time = self.handle_request_error(RequestException, attempt, max_retries, sleep_time)
 
-                print(f"Attempt {attempt} out of {max_retries} failed: HTTP {status}\n")
+            # delay before retrying
+            if (retry_time > 0):
+                time.sleep(retry_time)
+                sleep_time = sleep_time * 2     # increase the delay for the next retry
 
-                # handle specific HTTP errors
-                self.handle_http_errors(status, HTTPError)
+        pass
 
-                # if the error is not a specific fatal error then attempt to retry the request
-                if (attempt < max_retries):
-                    print(f"Error is not caught as fatal. Retrying in {sleep_time} seconds...\n")
+    # make a request to the timelines endpoint and return the response once it starts without an error (only the headers have been read)
+    def request_timelines_stream(self, params):
+        # initialize variables for retries
+        max_retries = 3
+        sleep_time = 10
 
-                    # delay before retrying
-                    time.sleep(sleep_time)
-                    sleep_time = sleep_time * 2     # increase the delay for the next retry
-                # if the maximum number of retries is reached then raise the error and exit
-                else:
-                    raise RuntimeError("Maximum retry attempts reached for API request. Please try again later.") from HTTPError
-                
+        # make the API request with retries
+        for attempt in range(1, max_retries + 1):
+            # if everything goes right then perform this API request
+            try:
+                # wait for the shared request budget before calling the API
+                if (self.rate_limiter is not None):
+                    self.rate_limiter.acquire()
+
+                # make the API request over the pooled connection without reading the body yet
+                query = self.transport.stream(self.url, params, 10)
+                try:
+                    self.check_response(query)
+                except Exception:
+                    query.close()
+                    raise
+                return query
+            # handle HTTP errors
+            except requests.exceptions.HTTPError as HTTPError:
+                retry_time = self.handle_request_error(HTTPError, attempt, max_retries, sleep_time)
             # handle other request exceptions
             except requests.exceptions.RequestException as RequestException:
-                print(f"Attempt {attempt} out of {max_retries} failed: {RequestException}\n")
-
-                # if the error is not a specific fatal error then attempt to retry the request
-                if (attempt < max_retries):
-                    print(f"Error is not caught as fatal. Retrying in {sleep_time} seconds...\n")
-
-                    # delay before retrying
-                    time.sleep(sleep_time)
-                    sleep_time = sleep_time * 2     # increase the delay for the next retry
-                # if the maximum number of retries is reached then raise the error and exit
-                else:
-                    raise RuntimeError("Maximum retry attempts reached for API request. Please try again later.") from RequestException
-                
+                retry_time = self.handle_request_error(RequestException, attempt, max_retries, sleep_time)
+
+            # delay before retrying
+            if (retry_time > 0):
+                time.sleep(retry_time)
+                sleep_time = sleep_time * 2     # increase the delay for the next retry
+
         pass
 
-    # collect historical observed weather data from the past 24 hours
-    def collect_historically_observed_data(self):
-        # make the API request while handling potential errors
+    # yield the intervals of a timelines request as they are read from the network
+    def stream_timeline_intervals(self, params, chunk_size=65536):
+        query = self.request_timelines_stream(params)
+        try:
+            yield from weather_parser_pipeline.iterate_timeline_intervals(query.iter_content(chunk_size=chunk_size))
+        finally:
+            query.close()
+
+    # yield the historical observed hours between two hours, one API window at a time, without holding more than one interval in memory
+    def stream_history_windows(self, start_time, end_time):
+        for window_start_time, window_end_time in self.history_windows(start_time, end_time):
+            print(f"Streaming historically observed data from {window_start_time} to {window_end_time} for {self.coordinates}...\n")
+            yield from self.stream_timeline_intervals(self.time_range_params(window_start_time, window_end_time))
+
+    # yield only the historical observed hours after the newest recorded hour (see collect_missing_historically_observed_data)
+    def stream_missing_historically_observed_data(self, latest_recorded, end_time=None):
+        current_hour = datetime.datetime.now(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+        if (end_time is None):
+            end_time = current_hour - datetime.timedelta(hours=1)
+        return self.stream_history_windows(self.missing_history_start_time(latest_recorded), end_time)
+
+    # yield the missing historical observed hours that are too old to fit in the combined request
+    def stream_older_historically_observed_data(self, latest_recorded):
+        combined_start_time = self.combined_start_time(self.missing_history_start_time(latest_recorded))
+        return self.stream_missing_historically_observed_data(latest_recorded, combined_start_time - datetime.timedelta(hours=1))
+
+    # make a request to the timelines endpoint with the async transport while handling potential errors
+    async def async_request_timelines(self, params):
+        if (self.async_transport is None):
+            raise RuntimeError("No async transport was given to process_api_data. Please pass an async_http_transport to use the async API requests.")
 
         # initialize variables for retries
         max_retries = 3
@@ -95,71 +286,89 @@ class process_api_data:
 
         # make the API request with retries
         for attempt in range(1, max_retries + 1):
-            # make the API request while handling potential errors
+            # if everything goes right then perform this API request
             try:
-                # set the time range for the past 24 hours
-                start_time = (datetime.datetime.now(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0) - datetime.timedelta(hours=24)).replace(minute=0, second=0, microsecond=0).strftime("%Y-%m-%dT%H:%M:%SZ")
-                end_time = (datetime.datetime.now(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0) - datetime.timedelta(hours=1)).replace(minute=0, second=0, microsecond=0).strftime("%Y-%m-%dT%H:%M:%SZ")
-
-                historical_params = {
-                    "location": self.coordinates,
-                    "fields": self.field_names,
-                    "units": "imperial",
-                    "timesteps": "1h",
-                    "startTime": start_time,
-                    "endTime": end_time,
-                    "apikey": self.API_KEY
-                }
-
-                # make the API request
-                query = requests.get(url=self.url, params=historical_params, timeout=10)
-                query.raise_for_status()  # raise an error for bad status codes
-
-                ### FOR DEBUGGING PURPOSES ONLY. COMMENT OUT WHEN NOT IN PRODUCTION. ###
-                #print(f"API Status: {query.status_code}\n")
-                #print(f"API Response: {query.text}\n")
-
-                # store the historical weather data
-                historical_weather_data = query.json()
-                #print(historical_weather_data)
-
-                return historical_weather_data
+                # wait for the shared request budget in a thread so the event loop is not blocked
+                if (self.rate_limiter is not None):
+                    await asyncio.to_thread(self.rate_limiter.acquire)
+
+                # make the API request over the pooled connection
+                query = await self.async_transport.get(self.url, params, 10)
+                return self.handle_response(query)
             # handle HTTP errors
             except requests.exceptions.HTTPError as HTTPError:
-                # retrieve the status code
-                status = HTTPError.response.status_code
+                retry_time = await asyncio.to_thread(self.handle_request_error, HTTPError, attempt, max_retries, sleep_time)
+            # handle other request exceptions
+            except requests.exceptions.RequestException as RequestException:
+                retry_time = await asyncio.to_thread(self.handle_request_error, RequestException, attempt, max_retries, sleep_time)
 
-                print(f"Attempt {attempt} out of {max_retries} failed: HTTP {status}\n")
+            # delay before retrying
+            if (retry_time > 0):
+                await asyncio.sleep(retry_time)
+                sleep_time = sleep_time * 2     # increase the delay for the next retry
 
-                # handle specific HTTP errors
-                self.handle_http_errors(status, HTTPError)
+        pass
 
-                # if the error is not a specific fatal error then attempt to retry the request
-                if (attempt < max_retries):
-                    print(f"Error is not caught as fatal. Retrying in {sleep_time} seconds...\n")
+    # check the API response and return the weather data
+    def handle_response(self, query):
+        self.check_response(query)
 
-                    # delay before retrying
-                    time.sleep(sleep_time)
-                    sleep_time = sleep_time * 2     # increase the delay for the next retry
-                # if the maximum number of retries is reached then raise the error and exit
-                else:
-                    raise RuntimeError("Maximum retry attempts reached for API request. Please try again later.") from HTTPError
-                
-            # handle other request exceptions
-            except requests.exceptions.RequestException as RequestException:
-                print(f"Attempt {attempt} out of {max_retries} failed: {RequestException}\n")
-
-                # if the error is not a specific fatal error then attempt to retry the request
-                if (attempt < max_retries):
-                    print(f"Error is not caught as fatal. Retrying in {sleep_time} seconds...\n")
-
-                    # delay before retrying
-                    time.sleep(sleep_time)
-                    sleep_time = sleep_time * 2     # increase the delay for the next retry
-                # if the maximum number of retries is reached then raise the error and exit
-                else:
-                    raise RuntimeError("Maximum retry attempts reached for API request. Please try again later.") from RequestException
-                
+        ### FOR DEBUGGING PURPOSES ONLY. COMMENT OUT WHEN NOT IN PRODUCTION. ###
+        #print(f"API Status: {query.status_code}\n")
+        #print(f"API Response: {query.text}\n")
+
+        return query.json()
+
+    # let the rate limiter correct itself and raise an error for bad status codes
+    def check_response(self, query):
+        # let the rate limiter correct itself with the limits reported by the API
+        if ((self.rate_limiter is not None) and (query.status_code != 429)):
+            self.rate_limiter.update_from_headers(query.headers)
+
+        query.raise_for_status()  # raise an error for bad status codes
+        pass
+
+    # decide what to do after a failed request and return how long to wait before retrying
+    def handle_request_error(self, error, attempt, max_retries, sleep_time):
+        # handle HTTP errors
+        if isinstance(error, requests.exceptions.HTTPError):
+            # retrieve the status code
+            status = error.response.status_code
+
+            print(f"Attempt {attempt} out of {max_retries} failed: HTTP {status}\n")
+
+            # handle specific HTTP errors
+            self.handle_http_errors(status, error)
+
+            # if the API is rate limiting us then only wait as long as the API asks for
+            if ((status == 429) and (attempt < max_retries)):
+                self.handle_rate_limit_error(error.response, sleep_time)
+                return 0
+        # handle other request exceptions
+        else:
+            print(f"Attempt {attempt} out of {max_retries} failed: {error}\n")
+
+        # if the maximum number of retries is reached then raise the error and exit
+        if (attempt >= max_retries):
+            raise RuntimeError("Maximum retry attempts reached for API request. Please try again later.") from error
+
+        # if the error is not a specific fatal error then attempt to retry the request
+        print(f"Error is not caught as fatal. Retrying in {sleep_time} seconds...\n")
+        return sleep_time
+
+    # handles HTTP 429 errors by waiting exactly as long as the API asks for before retrying
+    def handle_rate_limit_error(self, response, sleep_time):
+        # the shared rate limiter pauses every location until the API is ready again
+        if (self.rate_limiter is not None):
+            self.rate_limiter.back_off(response.headers)
+            return
+
+        # without a rate limiter only this request waits
+        retry_after = rate_limit_pipeline.parse_retry_after(response.headers)
+        if (retry_after is None):
+            retry_after = sleep_time
+        print(f"Too many requests. Retrying in {retry_after:.1f} seconds...\n")
+        time.sleep(retry_after)
         pass
 
     # handles HTTP errors when calling the API
@@ -180,8 +389,7 @@ class process_api_data:
             405: "Fatal HTTP Error 405: Method not allowed. Please check your API request method (e.g., DELETE or POST).",
             409: "Fatal HTTP Error 409: Conflict detected. Please avoid making conflicting requests simultaneously.",
             413: "Fatal HTTP Error 413: Payload too large. Please reduce the size of your API request parameters.",
-            414: "Fatal HTTP Error 414: URL too long. Please shorten your API request URL.",
-            429: "Fatal HTTP Error 429: Too many requests. Please reduce the frequency of your API requests."
+            414: "Fatal HTTP Error 414: URL too long. Please shorten your API request URL."
         }
 
         # What a bad request error (HTTP Error 400) might look like:
@@ -229,6 +437,7 @@ class process_api_data:
 
         # What a too many requests error (HTTP Error 429) might look like:
         # making too many API requests in a short period of time
+        # (not fatal: handle_rate_limit_error waits for the Retry-After time and the request is retried)
 
         # check if the status code is in the defined HTTP errors
         if (status in http_errors):
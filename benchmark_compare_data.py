@@ -0,0 +1,79 @@
+# libraries
+import time
+import calendar
+import io
+import contextlib
+
+# custom files
+import gs_storage_pipeline
+
+# the nested loop compare_data that was used before the stored keys were put in a set (kept here to compare against)
+def nested_loop_compare_data(gs_storage, weather_data, stored_data, sheet_name):
+    stored_data_temp = stored_data[1:]      # exclude header row
+
+    for weather_row in weather_data:
+        weather_flag = False
+        for stored_row in stored_data_temp:
+            if (weather_row[0] == stored_row[0] and weather_row[1] == stored_row[1]):
+                print(f"({weather_row[0]} {weather_row[1]}) data has already been recorded in the {sheet_name} Google Sheet for {gs_storage.location}. Ignoring entry...\n")
+                weather_flag = True
+        if (weather_flag == False):
+            stored_data.append(weather_row)
+    return stored_data
+
+# creates a sorted sheet of hourly rows (header row included) like get_all_values returns
+def synthetic_sheet(row_count, header_fields):
+    start_time = 1577836800     # 2020-01-01 00:00:00 UTC
+    sheet_data = [header_fields]
+    for j in range(row_count):
+        date_time = time.gmtime(start_time + j * 3600)
+        sheet_data.append([time.strftime("%Y-%m-%d", date_time), time.strftime("%H:%M:%S", date_time), "Phoenix", "33.4484, -112.0740", str(j % 100)])
+    return sheet_data
+
+# creates a 120 hour forecast where the first half is already stored in the sheet
+def synthetic_forecast(sheet_data):
+    forecast_data = [list(row) for row in sheet_data[-60:]]
+    last_time = calendar.timegm(time.strptime(f"{sheet_data[-1][0]} {sheet_data[-1][1]}", "%Y-%m-%d %H:%M:%S"))
+    for j in range(1, 61):
+        date_time = time.gmtime(last_time + j * 3600)
+        forecast_data.append([time.strftime("%Y-%m-%d", date_time), time.strftime("%H:%M:%S", date_time), "Phoenix", "33.4484, -112.0740", "0"])
+    return forecast_data
+
+# times a compare function without its printed output (best of several runs to reduce noise) and returns the rows it kept
+def time_compare(compare_function, forecast_data, sheet_data, repeats=5):
+    best_time = None
+    for j in range(repeats):
+        stored_data = [list(row) for row in sheet_data]
+        with contextlib.redirect_stdout(io.StringIO()):
+            start_time = time.perf_counter()
+            result = compare_function(forecast_data, stored_data, "Benchmark_Sheet")
+            elapsed_time = time.perf_counter() - start_time
+        if ((best_time is None) or (elapsed_time < best_time)):
+            best_time = elapsed_time
+    return best_time, result
+
+# function that runs the benchmark
+def main():
+    header_fields = ["Date (YYYY-MM-DD)", "Time (HH:MM:SS)", "Location", "Coordinates", "Temperature"]
+
+    # the Google sheets connection is not needed to compare rows so __init__ is skipped
+    gs_storage = gs_storage_pipeline.storing_into_google_sheets.__new__(gs_storage_pipeline.storing_into_google_sheets)
+    gs_storage.location = "Phoenix"
+
+    print(f"{'Rows':>8} {'Nested loop (s)':>16} {'Key set (s)':>12} {'Speed up':>10}")
+    for row_count in [1000, 10000, 100000]:
+        sheet_data = synthetic_sheet(row_count, header_fields)
+        forecast_data = synthetic_forecast(sheet_data)
+
+        nested_loop_time, nested_loop_rows = time_compare(lambda weather_data, stored_data, sheet_name: nested_loop_compare_data(gs_storage, weather_data, stored_data, sheet_name), forecast_data, sheet_data)
+        key_set_time, key_set_rows = time_compare(gs_storage.compare_data, forecast_data, sheet_data)
+
+        # both versions have to keep the same rows, with the same contents, in the same order
+        if (nested_loop_rows != key_set_rows):
+            differing_row = next((j for j in range(min(len(nested_loop_rows), len(key_set_rows))) if (nested_loop_rows[j] != key_set_rows[j])), min(len(nested_loop_rows), len(key_set_rows)))
+            raise RuntimeError(f"compare_data results differ for {row_count} rows: {len(nested_loop_rows)} and {len(key_set_rows)} rows kept, first difference at row {differing_row}")
+
+        print(f"{row_count:>8} {nested_loop_time:>16.4f} {key_set_time:>12.4f} {nested_loop_time / key_set_time:>9.0f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+# libraries
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# class that collects and stores weather data for several locations at the same time
+class concurrent_collection_engine:
+    def __init__(self, locations, max_workers):
+        self.locations = locations
+        self.max_workers = max(1, min(max_workers, len(locations)))
+        pass
+
+    # run the collection task for every location and return the results in the same order as the locations
+    # (progress_callback is called with the number of finished locations, the number of locations, the location, and whether it succeeded)
+    def run(self, collection_task, progress_callback=None):
+        start_time = time.monotonic()
+        results = [None] * len(self.locations)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="weather-collection") as executor:
+            futures = {executor.submit(collection_task, i): i for i in range(len(self.locations))}
+
+            # gather each location as soon as it finishes so one failed location does not stop the others
+            for finished_count, future in enumerate(as_completed(futures), start=1):
+                i = futures[future]
+                succeeded = False
+                try:
+                    results[i] = future.result()
+                    succeeded = True
+                    print(f"Successfully finished storing weather data for {self.locations[i]}...\n")
+                except Exception as error:
+                    print(f"Failed to store weather data for {self.locations[i]}: {error}\n")
+
+                if (progress_callback is not None):
+                    progress_callback(finished_count, len(self.locations), self.locations[i], succeeded)
+
+        elapsed_time = time.monotonic() - start_time
+        print(f"Finished collecting weather data for {len(self.locations)} locations in {elapsed_time:.1f} seconds...\n")
+        return results
+
+    pass
\ No newline at end of file
@@ -0,0 +1,194 @@
+# libraries
+import os
+import ast
+import threading
+
+# marks the variables that have to be set in variables.txt
+REQUIRED = object()
+
+# every variable the project understands: (allowed types, default value)
+CONFIG_SCHEMA = {
+    'API_KEY': ((str,), REQUIRED),
+    'API_URL': ((str,), "https://api.tomorrow.io/v4/timelines"),
+    'COORDINATES': ((list,), REQUIRED),
+    'LOCATIONS': ((list,), REQUIRED),
+    'FIELD_NAMES': ((list,), REQUIRED),
+    'HEADER_FIELDS': ((list,), REQUIRED),
+    'OBSERVED_CSV_FILES': ((list,), REQUIRED),
+    'FORECAST_CSV_FILES': ((list,), REQUIRED),
+    'OBSERVED_GOOGLE_SHEETS': ((list,), REQUIRED),
+    'FORECAST_GOOGLE_SHEETS': ((list,), REQUIRED),
+    'SPREADSHEET_ID': ((str,), ""),            # only needed when the Google Sheets backend is used
+    'SERVICE_ACCOUNT_FILE': ((str,), ""),
+    'DISCORD_TOKEN': ((str,), ""),
+    'DISCORD_CHANNEL_IDS': ((list,), []),
+    'REQUESTS_PER_SECOND': ((int, float), 3),
+    'REQUESTS_PER_HOUR': ((int, float), 25),
+    'REQUESTS_PER_DAY': ((int, float), 500),
+    'MAX_CONCURRENT_LOCATIONS': ((int,), 4),
+    'COMBINED_API_REQUEST': ((bool,), True),
+    'INCREMENTAL_HISTORY': ((bool,), True),
+    'MAX_HISTORY_HOURS': ((int,), 24),
+    'HISTORY_WINDOW_HOURS': ((int,), 24),
+    'STREAM_HISTORY': ((bool,), False),
+    'STREAM_BATCH_SIZE': ((int,), 500),
+    'CSV_FSYNC': ((bool,), False),
+    'SHEET_MIRROR_DIRECTORY': ((str,), "sheet_mirror"),
+    'WRITE_BEHIND': ((bool,), True),
+    'WRITE_BEHIND_QUEUE_SIZE': ((int,), 100),
+    'WRITE_BEHIND_SPILL_DIRECTORY': ((str,), "write_behind_spill"),
+    'STORAGE_BACKENDS': ((list,), ["CSV", "Google Sheets"]),
+    'PARQUET_DIRECTORY': ((str,), "parquet_data"),
+    'SQLITE_DATABASE': ((str,), "weather_data.db"),
+    'SQLITE_EXPORT_VIEWS': ((list,), ["CSV"]),
+    'WEATHER_CACHE_TTL_SECONDS': ((int, float), 7200),
+    'RAIN_PREDICTION': ((bool,), True),
+    'RAIN_PREDICTION_HOURS': ((int,), 1),
+    'RAIN_MODEL_DIRECTORY': ((str,), "rain_models"),
+}
+
+# lists that need one entry per location
+PER_LOCATION_VARIABLES = ['COORDINATES', 'OBSERVED_CSV_FILES', 'FORECAST_CSV_FILES', 'OBSERVED_GOOGLE_SHEETS', 'FORECAST_GOOGLE_SHEETS']
+
+# numbers that have to be above zero
+POSITIVE_VARIABLES = ['REQUESTS_PER_SECOND', 'REQUESTS_PER_HOUR', 'REQUESTS_PER_DAY', 'MAX_CONCURRENT_LOCATIONS', 'MAX_HISTORY_HOURS', 'HISTORY_WINDOW_HOURS', 'STREAM_BATCH_SIZE', 'WRITE_BEHIND_QUEUE_SIZE', 'WEATHER_CACHE_TTL_SECONDS', 'RAIN_PREDICTION_HOURS']
+
+# storage backends weather_data_storage knows how to create
+STORAGE_BACKENDS = ["CSV", "Google Sheets", "Parquet", "SQLite"]
+
+# whether any Google sheet is written (as a storage backend or as a view of the SQLite database)
+def uses_google_sheets(variables):
+    STORAGE_BACKENDS = variables.get('STORAGE_BACKENDS', ["CSV", "Google Sheets"])
+    return (("Google Sheets" in STORAGE_BACKENDS) or (("SQLite" in STORAGE_BACKENDS) and ("Google Sheets" in variables.get('SQLITE_EXPORT_VIEWS', ["CSV"]))))
+
+# read every name = value line of variables.txt (lists and numbers are parsed, anything else is kept as text)
+def read_variables_file(file_name):
+    variables = {}
+    with open(file_name, mode='r', newline='', encoding='utf-8') as file:
+        for line in file:
+            if (('=' in line) and not (line.startswith('#'))):
+                name, value = line.split('=', 1)
+                name = name.strip()
+                value = value.strip().strip("'").strip('"')
+
+                # Use ast.literal_eval to safely parse lists or strings
+                try:
+                    variables[name] = ast.literal_eval(value)
+                except (ValueError, SyntaxError):
+                    variables[name] = value
+    return variables
+
+# fill in the defaults, convert the values to their types, and collect every problem with the variables
+def validate_variables(variables):
+    variables = dict(variables)
+    problems = []
+    valid_names = set()
+
+    for name, (types, default) in CONFIG_SCHEMA.items():
+        if (name not in variables):
+            if (default is REQUIRED):
+                problems.append(f"{name} is not set")
+            else:
+                variables[name] = list(default) if isinstance(default, list) else default
+                valid_names.add(name)
+            continue
+
+        value = variables[name]
+        # true and false written without a capital letter are read as text
+        if ((bool in types) and isinstance(value, str) and (value.lower() in ("true", "false"))):
+            value = (value.lower() == "true")
+        # a single value is allowed where a list is expected
+        if ((list in types) and isinstance(value, (str, tuple))):
+            value = [value] if isinstance(value, str) else list(value)
+
+        if ((isinstance(value, bool) and (bool not in types)) or (isinstance(value, types) == False)):
+            problems.append(f"{name} should be {' or '.join(allowed_type.__name__ for allowed_type in types)} but is {value!r}")
+            continue
+        variables[name] = value
+        valid_names.add(name)
+
+    # every per location list has to line up with LOCATIONS
+    if ('LOCATIONS' in valid_names):
+        location_count = len(variables['LOCATIONS'])
+        if (location_count == 0):
+            problems.append("LOCATIONS is empty")
+        for name in PER_LOCATION_VARIABLES:
+            if ((name in valid_names) and (len(variables[name]) != location_count)):
+                problems.append(f"{name} has {len(variables[name])} entries but LOCATIONS has {location_count}")
+
+    # a row is the date, time, location, and coordinates followed by one column per field
+    if (('HEADER_FIELDS' in valid_names) and ('FIELD_NAMES' in valid_names) and (len(variables['HEADER_FIELDS']) != 4 + len(variables['FIELD_NAMES']))):
+        problems.append(f"HEADER_FIELDS has {len(variables['HEADER_FIELDS'])} columns but FIELD_NAMES needs {4 + len(variables['FIELD_NAMES'])}")
+
+    for name in POSITIVE_VARIABLES:
+        if ((name in valid_names) and (variables[name] <= 0)):
+            problems.append(f"{name} has to be above 0 but is {variables[name]}")
+
+    for name in ['STORAGE_BACKENDS', 'SQLITE_EXPORT_VIEWS']:
+        for backend in (variables[name] if (name in valid_names) else []):
+            if (backend not in STORAGE_BACKENDS):
+                problems.append(f"{name} has unknown storage backend {backend!r} (use {', '.join(STORAGE_BACKENDS)})")
+
+    # the spreadsheet and its credentials are only required when something is written into Google sheets
+    if (('STORAGE_BACKENDS' in valid_names) and ('SQLITE_EXPORT_VIEWS' in valid_names) and uses_google_sheets(variables)):
+        for name in ['SPREADSHEET_ID', 'SERVICE_ACCOUNT_FILE']:
+            if ((name in valid_names) and (variables[name] == "")):
+                problems.append(f"{name} is not set but the Google Sheets backend is used")
+
+    if (len(problems) > 0):
+        raise RuntimeError("Invalid variables.txt:\n  " + "\n  ".join(problems))
+    return variables
+
+# class that holds one validated version of variables.txt (never changed after it is created)
+class weather_config:
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.modified_time = os.stat(file_name).st_mtime_ns
+        self.variables = validate_variables(read_variables_file(file_name))
+        pass
+
+    pass
+
+# class that watches variables.txt and swaps in a new config when the file changes
+class config_watcher:
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.lock = threading.Lock()
+
+        # a broken variables.txt stops the project right away instead of partway through a pass
+        self.config = weather_config(file_name)
+        self.checked_time = self.config.modified_time     # modification time of the last version that was read, valid or not
+        pass
+
+    # returns the newest valid config (a broken edit is reported and the previous config is kept)
+    def current(self):
+        with self.lock:
+            try:
+                modified_time = os.stat(self.file_name).st_mtime_ns
+            except FileNotFoundError:
+                return self.config      # keep using the loaded config while the file is being replaced
+
+            if (modified_time != self.checked_time):
+                # only read each version of the file once, so a broken edit is reported once
+                self.checked_time = modified_time
+                try:
+                    self.config = weather_config(self.file_name)
+                    print(f"Loaded the changes to {self.file_name}...\n")
+                except (OSError, SyntaxError, RuntimeError) as error:
+                    print(f"Ignoring the changes to {self.file_name} and keeping the previous variables: {error}\n")
+            return self.config
+
+    pass
+
+# watchers shared by every caller, one per variables file
+CONFIG_WATCHERS = {}
+CONFIG_WATCHERS_LOCK = threading.Lock()
+
+# returns the newest valid config of a variables file, parsing it only when the file changed
+def get_config(file_name="variables.txt"):
+    with CONFIG_WATCHERS_LOCK:
+        watcher = CONFIG_WATCHERS.get(file_name)
+        if (watcher is None):
+            watcher = config_watcher(file_name)
+            CONFIG_WATCHERS[file_name] = watcher
+    return watcher.current()
\ No newline at end of file
@@ -1,7 +1,87 @@
 # libraries
 import os
 import csv
-import pandas as pd
+import datetime
+import threading
+import heapq
+
+# class that remembers every (date, time) already recorded in a CSV file so duplicates can be found without reading the file
+class csv_key_index:
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.keys = set()
+        self.latest_key = None      # newest (date, time) in the file
+        self.is_sorted = True       # whether the rows in the file are in date and time order
+        self.signature = None       # size and modification time of the file when the index was last in sync
+        self.lock = threading.Lock()
+        pass
+
+    # size and modification time of the CSV file
+    def file_signature(self):
+        if (os.path.exists(self.file_name) == False):
+            return None
+        file_stats = os.stat(self.file_name)
+        return (file_stats.st_size, file_stats.st_mtime_ns)
+
+    # rebuild the index if the CSV file was changed outside of the pipeline
+    def refresh(self):
+        signature = self.file_signature()
+        if (signature == self.signature):
+            return
+
+        keys = set()
+        latest_key = None
+        is_sorted = True
+        if (signature is not None):
+            with open(self.file_name, mode='r', newline='', encoding='utf-8') as file:
+                reader = csv.reader(file, delimiter=',', quotechar='"')
+                next(reader, None)      # skip the header row
+                for row in reader:
+                    if (len(row) < 2):
+                        continue
+                    key = (row[0], row[1])
+                    keys.add(key)
+
+                    # the dates and times are zero padded so comparing them as text keeps them in time order
+                    if ((latest_key is not None) and (key < latest_key)):
+                        is_sorted = False
+                    if ((latest_key is None) or (key > latest_key)):
+                        latest_key = key
+
+        self.keys = keys
+        self.latest_key = latest_key
+        self.is_sorted = is_sorted
+        self.signature = signature
+        pass
+
+    # check if a (date, time) has already been recorded
+    def contains(self, key):
+        return (key in self.keys)
+
+    # check if sorted keys can be appended to the end of the file without breaking the date and time order
+    def can_append(self, sorted_keys):
+        return (self.is_sorted and ((self.latest_key is None) or (sorted_keys[0] > self.latest_key)))
+
+    # remember the (date, time) keys that the pipeline just wrote and accept the new state of the file
+    def add(self, sorted_keys, is_sorted):
+        self.keys.update(sorted_keys)
+        if ((self.latest_key is None) or (sorted_keys[-1] > self.latest_key)):
+            self.latest_key = sorted_keys[-1]
+        self.is_sorted = is_sorted
+        self.signature = self.file_signature()
+        pass
+
+    # accept the new state of the file after the pipeline rewrote it in sorted order without changing which records it holds
+    def mark_in_sync(self):
+        self.is_sorted = True
+        self.signature = self.file_signature()
+        pass
+
+    pass
+
+# indexes shared by every data_management object so they last across locations and hourly passes
+CSV_KEY_INDEXES = {}
+CSV_KEY_INDEXES_LOCK = threading.Lock()
 
 # class that stores weather data into CSV files
 class data_management:
@@ -25,26 +105,117 @@ class data_management:
 
         pass
 
+    # returns the shared (date, time) index of the CSV file
+    def get_key_index(self, file_name):
+        with CSV_KEY_INDEXES_LOCK:
+            key_index = CSV_KEY_INDEXES.get(os.path.abspath(file_name))
+            if (key_index is None):
+                key_index = csv_key_index(file_name)
+                CSV_KEY_INDEXES[os.path.abspath(file_name)] = key_index
+        return key_index
+
     # add the data record into the CSV file
     def add_record_to_csv_file(self, file_name, data_record):
-        # check if the record already exists in the CSV file
+        self.add_records_to_csv_file(file_name, [data_record])
+        pass
+
+    # add many data records into the CSV file with a single write (records that are already recorded are skipped)
+    def add_records_to_csv_file(self, file_name, data_records, fsync=False):
+        key_index = self.get_key_index(file_name)
+        with key_index.lock:
+            key_index.refresh()
+
+            # keep the first copy of each (date, time)
+            new_records = []
+            new_keys = set()
+            for data_record in data_records:
+                key = (data_record[0], data_record[1])
+                if (key_index.contains(key) or (key in new_keys)):
+                    continue
+                new_keys.add(key)
+                new_records.append(data_record)
+
+            skipped_count = len(data_records) - len(new_records)
+            if (len(new_records) == 0):
+                print(f"All {len(data_records)} records have already been recorded in the {file_name} CSV file for {self.location}. Ignoring entries...\n")
+                return 0
+
+            # order the new records by date and time so the file stays sorted
+            new_records.sort(key=lambda record: (record[0], record[1]))
+            sorted_keys = [(record[0], record[1]) for record in new_records]
+
+            # records newer than everything in the file are appended, late records are merged into their place
+            if (key_index.can_append(sorted_keys)):
+                with open(file_name, mode='a', newline='', encoding='utf-8') as file:
+                    writer = csv.writer(file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+                    writer.writerows(new_records)
+
+                    # make sure the records are on disk before moving on (only when asked since it is slow)
+                    if (fsync):
+                        file.flush()
+                        os.fsync(file.fileno())
+                print(f"Successfully added {len(new_records)} records into the {file_name} CSV file for {self.location} ({skipped_count} already recorded)...\n")
+            else:
+                self.merge_records_into_csv_file(file_name, new_records, key_index.is_sorted, fsync)
+                print(f"Successfully merged {len(new_records)} records into the {file_name} CSV file for {self.location} ({skipped_count} already recorded)...\n")
+
+            key_index.add(sorted_keys, True)
+
+        return len(new_records)
+
+    # rewrite the CSV file with the sorted new records merged into the sorted existing records in a single pass
+    def merge_records_into_csv_file(self, file_name, sorted_records, is_sorted, fsync=False):
+        temp_file_name = file_name + ".tmp"
+
         with open(file_name, mode='r', newline='', encoding='utf-8') as file:
             reader = csv.reader(file, delimiter=',', quotechar='"')
-            for row in reader:
-                if (len(row) < 2):
-                    continue
-                if ((row[0] == data_record[0]) and (row[1] == data_record[1])):
-                    print(f"({data_record[0]} {data_record[1]}) data has already been recorded in the {file_name} CSV file for {self.location}. Ignoring entry...\n")
-                    return
-                
-        # add the record into the CSV file
-        with open(file_name, mode='a', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(data_record)
-            print(f"Successfully added ({data_record[0]} {data_record[1]}) data into the {file_name} CSV file for {self.location}...\n")
+            header_row = next(reader, self.header_fields)
+            stored_records = (row for row in reader if (len(row) >= 2))
+
+            # a file that was changed by hand may be out of order so it is fully sorted once
+            if (is_sorted == False):
+                stored_records = sorted(stored_records, key=lambda record: (record[0], record[1]))
+
+            with open(temp_file_name, mode='w', newline='', encoding='utf-8') as temp_file:
+                writer = csv.writer(temp_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+                writer.writerow(header_row)
+                writer.writerows(heapq.merge(stored_records, sorted_records, key=lambda record: (record[0], record[1])))
 
+                if (fsync):
+                    temp_file.flush()
+                    os.fsync(temp_file.fileno())
+
+        # replace the old file only after the merged file is completely written
+        os.replace(temp_file_name, file_name)
         pass
 
+    # finds the newest date and time recorded in the CSV file (None if nothing has been recorded yet)
+    def latest_recorded_datetime(self, file_name):
+        if (os.path.exists(file_name) == False):
+            return None
+
+        # the CSV file is kept sorted so only the end of the file needs to be read
+        with open(file_name, mode='rb') as file:
+            file.seek(0, os.SEEK_END)
+            file_size = file.tell()
+            read_start = max(0, file_size - 65536)
+            file.seek(read_start)
+            lines = file.read().decode('utf-8', errors='ignore').splitlines()
+
+        # skip the first line since it is either the header row or a partially read row
+        latest_recorded = None
+        for row in csv.reader(lines[1:], delimiter=',', quotechar='"'):
+            if (len(row) < 2):
+                continue
+            try:
+                recorded = datetime.datetime.strptime(f"{row[0]} {row[1]}", "%Y-%m-%d %H:%M:%S").replace(tzinfo=datetime.timezone.utc)
+            except ValueError:
+                continue
+            if ((latest_recorded is None) or (recorded > latest_recorded)):
+                latest_recorded = recorded
+
+        return latest_recorded
+
     # counts the number of rows from the CSV file
     def count_rows_csv_file(self, file_name):
         with open(file_name, mode='r', newline='', encoding='utf-8') as file:
@@ -52,36 +223,25 @@ class data_management:
             row_count = sum(1 for row in reader)
         return row_count
     
-    # bubble sort algorithm for sorting data in the CSV file
-    def bubble_sort(self, data_frame, column, file_row_count):
-        n = file_row_count - 1  # exclude header row
-
-        for i in range(n):
-            for j in range(0, n - i - 1):
-                if (data_frame.iloc[j][column] > data_frame.iloc[j + 1][column]):
-                    temp = data_frame.iloc[j]
-                    data_frame.iloc[j] = data_frame.iloc[j + 1]
-                    data_frame.iloc[j + 1] = temp
-        return data_frame
-
-    # sort the data in the CSV file by date and time
+    # sort the data in the CSV file by date and time (only rewrites the file when it is out of order)
     def sort_csv_file(self, file_name):
-        # read the CSV file into a pandas dataframe
-        df = pd.read_csv(file_name)
+        key_index = self.get_key_index(file_name)
+        with key_index.lock:
+            # new records are already kept in order, so the file only needs sorting if it was changed outside of the pipeline
+            key_index.refresh()
+            if (key_index.is_sorted):
+                print(f"The {file_name} CSV file for {self.location} is already sorted by date and time. Ignoring sorting...\n")
+                return
 
-        # check if there is enough data to sort
-        file_row_count = self.count_rows_csv_file(file_name)
-        if (file_row_count <= 2):
-            print(f"Not enough data in the {file_name} CSV file for {self.location} to sort. Ignoring sorting...\n")
-            return
+            # check if there is enough data to sort
+            file_row_count = self.count_rows_csv_file(file_name)
+            if (file_row_count <= 2):
+                print(f"Not enough data in the {file_name} CSV file for {self.location} to sort. Ignoring sorting...\n")
+                return
 
-        # convert the Date and Time columns into a single column and sort the data by that column
-        df['DateTime'] = pd.to_datetime(df['Date (YYYY-MM-DD)'] + ' ' + df['Time (HH:MM:SS)'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
-        
-        #df = df.sort_values(by=['DateTime'])
-        df = self.bubble_sort(df, 'DateTime', file_row_count)
-        df = df.drop(columns=['DateTime'])      # remove the temporary column
-        df.to_csv(file_name, index=False)
+            # sort every stored record once with the same single pass merge used for new records
+            self.merge_records_into_csv_file(file_name, [], False)
+            key_index.mark_in_sync()
 
         print(f"Successfully sorted the {file_name} CSV file for {self.location} by date and time...\n")
 
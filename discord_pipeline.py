@@ -1,10 +1,176 @@
 import discord
 from discord.ext import tasks, commands
 import datetime
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from zoneinfo import ZoneInfo
 
 # custom files
 import weather_predictor
+import config_pipeline
+import weather_cache_pipeline
+
+# longest message Discord accepts
+DISCORD_MESSAGE_LIMIT = 2000
+
+# class that sends reports to every Discord channel with as few messages as possible
+class discord_delivery:
+    def __init__(self, client, channel_ids, max_concurrent_channels=5):
+        self.client = client
+        self.channel_ids = [int(channel_id) for channel_id in channel_ids]
+        self.channels = {}      # channels that were already looked up, so they are only fetched once
+        self.semaphore = asyncio.Semaphore(max_concurrent_channels)
+        pass
+
+    # look up a channel, asking the Discord API only the first time
+    async def get_channel(self, channel_id):
+        channel = self.channels.get(channel_id)
+        if (channel is None):
+            channel = self.client.get_channel(channel_id) or await self.client.fetch_channel(channel_id)
+            self.channels[channel_id] = channel
+        return channel
+
+    # put each report in a code block and combine as many of them as fit in one message
+    def pack_messages(self, reports, limit=DISCORD_MESSAGE_LIMIT):
+        blocks = []
+        for report in reports:
+            # a report that is too long on its own is split between lines
+            block_limit = limit - len("```\n\n```")
+            lines = []
+            for line in report.rstrip("\n").split("\n"):
+                lines.extend(line[start:start + block_limit] for start in range(0, max(len(line), 1), block_limit))
+            block_lines = []
+            for line in lines:
+                if ((len(block_lines) > 0) and (len("\n".join(block_lines + [line])) > block_limit)):
+                    blocks.append("```\n" + "\n".join(block_lines) + "\n```")
+                    block_lines = []
+                block_lines.append(line)
+            blocks.append("```\n" + "\n".join(block_lines) + "\n```")
+
+        messages = []
+        for block in blocks:
+            if ((len(messages) > 0) and (len(messages[-1]) + 1 + len(block) <= limit)):
+                messages[-1] = messages[-1] + "\n" + block
+            else:
+                messages.append(block)
+        return messages
+
+    # send the messages in order to one channel
+    async def send_to_channel(self, channel_id, messages):
+        async with self.semaphore:
+            try:
+                channel = await self.get_channel(channel_id)
+                for message in messages:
+                    await channel.send(message)
+                return True
+            except Exception as error:
+                # the channel may have been deleted or the bot removed from it, so it is looked up again next time
+                self.channels.pop(channel_id, None)
+                print(f"Failed to send the Discord update to channel {channel_id}: {error}\n")
+                return False
+
+    # send the reports to every channel at the same time (discord.py waits on each channel's rate limit by itself)
+    async def deliver(self, reports):
+        messages = self.pack_messages(reports)
+        results = await asyncio.gather(*[self.send_to_channel(channel_id, messages) for channel_id in self.channel_ids])
+        print(f"Sent {len(reports)} reports as {len(messages)} messages to {sum(results)} out of {len(self.channel_ids)} Discord channels...\n")
+        return results
+
+    pass
+
+# fields shown for each hour of !forecast and !history, when they are collected
+SUMMARY_FIELDS = [("temperature", "°F"), ("humidity", "%"), ("precipitationProbability", "% precip"), ("windSpeed", " mph")]
+
+# class with the commands that answer from the latest collected weather data (no API requests are made)
+class weather_commands(commands.Cog):
+    def __init__(self, bot, cache=None):
+        self.bot = bot
+        self.cache = cache if (cache is not None) else weather_cache_pipeline.get_weather_cache()
+        pass
+
+    # one line describing an hour of weather data
+    def summarize_row(self, row, schema):
+        values = []
+        for field, unit in SUMMARY_FIELDS:
+            column = schema.column(field)
+            if (column is not None):
+                values.append(f"{row[column]}{unit}")
+        return f"{row[0]} {row[1][0:5]}  " + "  ".join(values)
+
+    # send a reply, split into as few messages as possible
+    async def reply(self, ctx, report):
+        for message in self.bot.delivery.pack_messages([report]):
+            await ctx.send(message)
+        pass
+
+    # latest data of a city, or an answer saying why there is none
+    async def find_city(self, ctx, city):
+        entry = self.cache.get(city)
+        if (entry is None):
+            locations = ", ".join(self.cache.locations()) or "none yet"
+            await ctx.send(f"No recent weather data for {city}. Cities with recent data: {locations}")
+        return entry
+
+    # !weather <city>: the latest observation of a city
+    @commands.command(name="weather")
+    async def weather(self, ctx, *, city: str):
+        entry = await self.find_city(ctx, city)
+        if (entry is not None):
+            await self.reply(ctx, entry.observed_message)
+        pass
+
+    # !forecast <city> [hours]: the next hours of the forecast of a city (12 hours unless told otherwise)
+    @commands.command(name="forecast")
+    async def forecast(self, ctx, *, arguments: str):
+        city, hours = arguments, 12
+        words = arguments.rsplit(" ", 1)
+        if ((len(words) == 2) and words[1].isdigit()):
+            city, hours = words[0], max(1, int(words[1]))
+
+        entry = await self.find_city(ctx, city)
+        if (entry is not None):
+            rows = entry.forecast_rows[0:hours]
+            lines = [f"Forecast for {entry.location} (next {len(rows)} hours, UTC):"] + [self.summarize_row(row, entry.schema) for row in rows]
+            await self.reply(ctx, "\n".join(lines))
+        pass
+
+    # !history [city] [hours]: the recent observed hours of a city, or the newest hour of every city
+    @commands.command(name="history")
+    async def history(self, ctx, *, arguments: str = ""):
+        if (arguments.strip() == ""):
+            entries = self.cache.all()
+            if (len(entries) == 0):
+                await ctx.send("No weather data has been collected yet.")
+                return
+            lines = ["Latest observed hour of every city (UTC):"] + [f"{entry.location}: " + self.summarize_row(entry.observed_row, entry.schema) for entry in entries]
+            await self.reply(ctx, "\n".join(lines))
+            return
+
+        city, hours = arguments, 24
+        words = arguments.rsplit(" ", 1)
+        if ((len(words) == 2) and words[1].isdigit()):
+            city, hours = words[0], max(1, int(words[1]))
+
+        entry = await self.find_city(ctx, city)
+        if (entry is not None):
+            rows = entry.history_rows[-hours:]
+            lines = [f"Observed weather for {entry.location} (last {len(rows)} hours, UTC):"] + [self.summarize_row(row, entry.schema) for row in rows]
+            await self.reply(ctx, "\n".join(lines))
+        pass
+
+    # !status: how far the running collection pass is, or when the last one finished
+    @commands.command(name="status")
+    async def status(self, ctx):
+        if (self.bot.collection_progress is not None):
+            finished_count, location_count, failed_count = self.bot.collection_progress
+            await ctx.send(f"Collecting weather data: {finished_count}/{location_count} locations finished ({failed_count} failed).")
+        elif (self.bot.last_collection_time is None):
+            await ctx.send("No weather data has been collected yet.")
+        else:
+            await ctx.send(f"No collection is running. The last pass finished at {self.bot.last_collection_time:%Y-%m-%d %H:%M} UTC with {len(self.bot.latest_observed_messages or [])} locations.")
+        pass
+
+    pass
 
 # class that configures the Discord bot
 class weather_predicting_bot(commands.Bot):
@@ -14,11 +180,22 @@ class weather_predicting_bot(commands.Bot):
         self.DISCORD_TOKEN = DISCORD_TOKEN
         self.DISCORD_CHANNELS = DISCORD_CHANNELS
         self.LOCATIONS = LOCATIONS
+
+        # the blocking collection runs on its own thread so the bot keeps answering the gateway and commands during a pass
+        self.collection_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="weather-storage")
+        self.collection_progress = None     # (finished locations, total locations, failed locations) of the running pass, shown by !status
+        self.last_collection_time = None
+        self.delivery = discord_delivery(self, DISCORD_CHANNELS)
         
         intents = discord.Intents.default()
         intents.message_content = True
         super().__init__(command_prefix='!', intents=intents)
 
+    # register the weather commands before the bot connects
+    async def setup_hook(self):
+        await self.add_cog(weather_commands(self))
+        pass
+
     # start the Discord bot
     async def on_ready(self):
         print(f'We have logged in as {self.user}')
@@ -36,10 +213,38 @@ class weather_predicting_bot(commands.Bot):
     async def hourly_weather_collection(self):
         print(f"Running hourly weather data collection...\n")
 
-        # collect latest weather data
-        self.latest_observed_messages = weather_predictor.weather_data_storage()
+        # progress is reported from the collection threads so it is handed back to the event loop before the bot uses it
+        loop = asyncio.get_running_loop()
+        def report_progress(finished_count, location_count, location, succeeded):
+            loop.call_soon_threadsafe(self.report_collection_progress, finished_count, location_count, location, succeeded)
+
+        # collect latest weather data without blocking the event loop
+        try:
+            # the pass shows up in !status right away, even while the rate limiter holds back the first location
+            # (the locations are counted from the current variables since they can change without restarting the bot)
+            self.collection_progress = (0, len(config_pipeline.get_config("variables.txt").variables['LOCATIONS']), 0)
+            self.latest_observed_messages = await loop.run_in_executor(self.collection_executor, weather_predictor.weather_data_storage, report_progress)
+            self.last_collection_time = datetime.datetime.now(datetime.timezone.utc)
+        except Exception as error:
+            # keep the previous messages and try again next hour instead of stopping the task
+            print(f"Hourly weather data collection failed: {error}\n")
+        finally:
+            self.collection_progress = None
+        pass
+
+    # keep track of how far the running collection pass is
+    def report_collection_progress(self, finished_count, location_count, location, succeeded):
+        failed_count = self.collection_progress[2] if (self.collection_progress is not None) else 0
+        self.collection_progress = (finished_count, location_count, failed_count + (0 if (succeeded) else 1))
+        status = "finished" if (succeeded) else "failed"
+        print(f"Hourly weather data collection {status} {location} ({finished_count}/{location_count} locations)...\n")
         pass
 
+    # stop the collection thread when the bot shuts down
+    async def close(self):
+        self.collection_executor.shutdown(wait=False, cancel_futures=True)
+        await super().close()
+
     # print weather data to Discord at 12:00 PM every day
     #@tasks.loop(minutes=10)
     @tasks.loop(time=datetime.time(hour=12, minute=0, second=0, tzinfo=ZoneInfo("America/Phoenix")))
@@ -49,34 +254,18 @@ class weather_predicting_bot(commands.Bot):
         if (self.last_sent_date == today):
             print(f"Discord daily update already sent today ({today}). Skipping...\n")
             return
+        elif (self.latest_observed_messages is None):
+            print(f"No weather data has been collected yet. Skipping the Discord daily update...\n")
+            return
         else:
             self.last_sent_date = today
 
         # prepare Discord message
         print(f"Preparing to send Discord daily update for {today}...\n")
-        discord_message = (
-            f"```\n"
-            f"Daily Weather Update at 12:00:00 hours:\n"
-            f"```\n"
-        )
-
-        # send Discord message to each channel
-        for discord_channel_id in self.DISCORD_CHANNELS:
-            discord_channel = self.get_channel(int(discord_channel_id)) or await self.fetch_channel(int(discord_channel_id))
-            await discord_channel.send(discord_message)
-        
-        # prepare weather data for each city
-        for message in self.latest_observed_messages:
-            discord_message = (
-                f"```\n"
-                f"{message}\n"
-                f"```"
-            )
-
-            # send Discord message to each channel
-            for discord_channel_id in self.DISCORD_CHANNELS:
-                discord_channel = self.get_channel(int(discord_channel_id)) or await self.fetch_channel(int(discord_channel_id))
-                await discord_channel.send(discord_message)
+
+        # the header and every city are packed into as few messages as possible and sent to every channel at once
+        reports = [f"Daily Weather Update at 12:00:00 hours:"] + list(self.latest_observed_messages)
+        await self.delivery.deliver(reports)
         pass
 
     pass
\ No newline at end of file
@@ -0,0 +1,212 @@
+# libraries
+import os
+import re
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use("Agg")   # the figures are only saved to files so no window is needed
+import matplotlib.pyplot as plt
+import seaborn as sns
+
+# class that adds up everything a Pearson correlation matrix needs one chunk at a time, so the whole file never has to be in memory
+# (like pandas, each pair of columns only uses the rows where both of them have a value)
+class running_correlation:
+    def __init__(self, column_count):
+        self.shift = None       # first values seen, subtracted from every value to keep the sums small and accurate
+        self.counts = np.zeros((column_count, column_count))
+        self.sums = np.zeros((column_count, column_count))             # sums[a, b] = sum of column a where a and b both have values
+        self.squared_sums = np.zeros((column_count, column_count))
+        self.product_sums = np.zeros((column_count, column_count))
+        pass
+
+    # add the rows of one chunk (NaN marks a missing value)
+    def add(self, values):
+        if (self.shift is None):
+            self.shift = np.nan_to_num(np.nanmean(values, axis=0)) if (len(values) > 0) else np.zeros(values.shape[1])
+
+        present = (np.isnan(values) == False).astype(np.float64)
+        centered = np.where(present > 0, values - self.shift, 0.0)
+        self.counts += present.T @ present
+        self.sums += centered.T @ present
+        self.squared_sums += (centered * centered).T @ present
+        self.product_sums += centered.T @ centered
+        pass
+
+    # the correlation matrix of every row added so far
+    def correlation(self):
+        counts = self.counts
+        with np.errstate(divide='ignore', invalid='ignore'):
+            covariance = counts * self.product_sums - self.sums * self.sums.T
+            variance = counts * self.squared_sums - self.sums * self.sums
+            matrix = covariance / np.sqrt(variance * variance.T)
+        matrix[(counts < 2) | (variance <= 0) | (variance.T <= 0)] = np.nan
+        return np.clip(matrix, -1.0, 1.0)
+
+    pass
+
+# class that analyzes the weather data stored in an observed CSV file
+class weather_data_analysis:
+    def __init__(self, file_name, location, chunk_size=50000, cache_directory="analysis_cache", output_directory="analysis_output"):
+        self.file_name = file_name
+        self.location = location
+        self.chunk_size = chunk_size
+        self.cache_directory = cache_directory
+        self.output_directory = output_directory
+        pass
+
+    # name of the location that is safe to use in a file name
+    def safe_name(self):
+        return re.sub(r'[^A-Za-z0-9_.-]', '_', self.location)
+
+    # the weather fields of the CSV file (every column after the date, time, location, and coordinates)
+    def field_columns(self):
+        header = pd.read_csv(self.file_name, nrows=0).columns.tolist()
+        return header[0:2], header[4:]
+
+    # read the CSV file in chunks holding only the given columns, with the weather fields as floats
+    def read_chunks(self, columns, field_columns):
+        return pd.read_csv(self.file_name, usecols=columns, dtype={column: np.float64 for column in field_columns}, chunksize=self.chunk_size)
+
+    # load the weather data as a typed DataFrame sorted by time, without duplicate hours or fields that were never filled in
+    def grab_and_handle_data(self):
+        date_columns, field_columns = self.field_columns()
+        chunks = [chunk for chunk in self.read_chunks(date_columns + field_columns, field_columns)]
+        df = pd.concat(chunks, ignore_index=True) if (len(chunks) > 0) else pd.DataFrame(columns=date_columns + field_columns)
+
+        df = df.drop_duplicates(subset=date_columns, keep='first')
+        df.insert(0, 'DateTime', pd.to_datetime(df[date_columns[0]] + ' ' + df[date_columns[1]], format='%Y-%m-%d %H:%M:%S', errors='coerce', utc=True))
+        df = df.drop(columns=date_columns).sort_values(by=['DateTime'], kind='stable').reset_index(drop=True)
+        df = df.dropna(axis=1, how='all')
+        print(f"Loaded {len(df)} hours of weather data for {self.location} from {self.file_name}...\n")
+        return df
+
+    # fingerprint of the CSV file contents
+    def content_hash(self):
+        file_hash = hashlib.blake2b(digest_size=16)
+        with open(self.file_name, mode='rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                file_hash.update(block)
+        return file_hash.hexdigest()
+
+    # where the correlation matrix of the CSV file is cached
+    def cache_file_name(self):
+        return os.path.join(self.cache_directory, f"{self.safe_name()}_correlation.json")
+
+    # the cached correlation matrix if the CSV file still has the same contents, otherwise None
+    def load_cached_correlation(self):
+        if (os.path.exists(self.cache_file_name()) == False):
+            return None
+        with open(self.cache_file_name(), mode='r', encoding='utf-8') as file:
+            cache = json.load(file)
+
+        file_stats = os.stat(self.file_name)
+        if ((cache['file_name'] != self.file_name) or (cache['size'] != file_stats.st_size)):
+            return None
+        # the contents are only hashed again when the file was touched since the matrix was cached
+        if (cache['mtime_ns'] != file_stats.st_mtime_ns):
+            if (cache['content_hash'] != self.content_hash()):
+                return None
+            cache['mtime_ns'] = file_stats.st_mtime_ns
+            self.save_cached_correlation(cache)
+
+        print(f"Using the cached correlation matrix of {cache['row_count']} rows for {self.location}...\n")
+        return pd.DataFrame(cache['matrix'], index=cache['columns'], columns=cache['columns'], dtype=np.float64)
+
+    # cache a correlation matrix along with what the CSV file looked like when it was computed
+    def save_cached_correlation(self, cache):
+        os.makedirs(self.cache_directory, exist_ok=True)
+        temporary_file_name = f"{self.cache_file_name()}.tmp"
+        with open(temporary_file_name, mode='w', encoding='utf-8') as file:
+            json.dump(cache, file)
+        os.replace(temporary_file_name, self.cache_file_name())
+        pass
+
+    # add up a DataFrame (or the chunks of the CSV file) and return the correlation matrix and the number of rows
+    def compute_correlation(self, chunks, field_columns):
+        sums = running_correlation(len(field_columns))
+        row_count = 0
+        for chunk in chunks:
+            sums.add(chunk[field_columns].to_numpy(dtype=np.float64))
+            row_count = row_count + len(chunk)
+        matrix = pd.DataFrame(sums.correlation(), index=field_columns, columns=field_columns)
+        return matrix, row_count
+
+    # correlation matrix of the whole CSV file, streamed in chunks and cached until the file changes
+    def correlation_matrix(self):
+        matrix = self.load_cached_correlation()
+        if (matrix is not None):
+            return matrix
+
+        file_stats = os.stat(self.file_name)
+        date_columns, field_columns = self.field_columns()
+        matrix, row_count = self.compute_correlation(self.read_chunks(field_columns, field_columns), field_columns)
+        print(f"Computed the correlation matrix of {row_count} rows for {self.location}...\n")
+
+        self.save_cached_correlation({
+            'file_name': self.file_name,
+            'size': file_stats.st_size,
+            'mtime_ns': file_stats.st_mtime_ns,
+            'content_hash': self.content_hash(),
+            'row_count': row_count,
+            'columns': field_columns,
+            'matrix': [[None if np.isnan(value) else value for value in row] for row in matrix.to_numpy().tolist()],
+        })
+        return matrix
+
+    # create and save the correlation matrix heatmap (from the given DataFrame, or from the whole CSV file using the cache)
+    def create_correlation_matrix(self, df=None):
+        if (df is None):
+            matrix = self.correlation_matrix()
+        else:
+            field_columns = [column for column in df.columns if (column != 'DateTime')]
+            matrix, row_count = self.compute_correlation((df.iloc[start:start + self.chunk_size] for start in range(0, len(df), self.chunk_size)), field_columns)
+
+        # fields that never change have no correlation so they are left out of the figure
+        matrix = matrix.dropna(axis=0, how='all').dropna(axis=1, how='all')
+
+        os.makedirs(self.output_directory, exist_ok=True)
+        matrix.to_csv(os.path.join(self.output_directory, f"{self.safe_name()}_correlation_matrix.csv"))
+
+        figure_size = max(8, 0.45 * len(matrix.columns))
+        figure, axis = plt.subplots(figsize=(figure_size, figure_size))
+        sns.heatmap(matrix, ax=axis, cmap='coolwarm', vmin=-1, vmax=1, center=0, square=True, annot=(len(matrix.columns) <= 20), fmt='.2f')
+        axis.set_title(f"Correlation Matrix of the Observed Weather in {self.location}")
+        figure.tight_layout()
+        figure.savefig(os.path.join(self.output_directory, f"{self.safe_name()}_correlation_matrix.png"))
+        plt.close(figure)
+
+        print(f"Saved the correlation matrix for {self.location} into {self.output_directory}...\n")
+        return matrix
+
+    pass
+
+# analyze one observed CSV file (a module level function so it can run in a separate process)
+def analyze_observed_file(file_name, location, chunk_size=50000, cache_directory="analysis_cache", output_directory="analysis_output"):
+    analysis = weather_data_analysis(file_name, location, chunk_size, cache_directory, output_directory)
+    return analysis.create_correlation_matrix()
+
+# analyze every observed CSV file at the same time and return the correlation matrix of each location
+def analyze_observed_files(file_names, locations, max_workers=None, chunk_size=50000, cache_directory="analysis_cache", output_directory="analysis_output"):
+    # locations without any data yet are skipped
+    jobs = [(file_name, location) for file_name, location in zip(file_names, locations) if os.path.exists(file_name)]
+    for file_name, location in zip(file_names, locations):
+        if (os.path.exists(file_name) == False):
+            print(f"Skipping the feature analysis for {location} since {file_name} does not exist yet...\n")
+
+    matrices = {}
+    if (len(jobs) == 0):
+        return matrices
+
+    # every file is analyzed in its own process since reading the CSV files and adding up the chunks is CPU bound
+    max_workers = min(len(jobs), max_workers if (max_workers is not None) else (os.cpu_count() or 1))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {location: executor.submit(analyze_observed_file, file_name, location, chunk_size, cache_directory, output_directory) for file_name, location in jobs}
+        for location, future in futures.items():
+            try:
+                matrices[location] = future.result()
+            except Exception as error:
+                print(f"Failed to analyze the weather data for {location}: {error}\n")
+    return matrices
\ No newline at end of file
@@ -1,34 +1,129 @@
 # libraries
 from google.oauth2.service_account import Credentials
 import gspread
+import bisect
+import heapq
+import csv
+import os
+import re
+import threading
+import datetime
 import pandas as pd
 
+# class that keeps a copy of a Google sheet on disk so the whole sheet does not have to be downloaded every hour
+class sheet_mirror:
+    def __init__(self, directory, spreadsheet_id, sheet_name):
+        safe_sheet_name = re.sub(r'[^A-Za-z0-9_.-]', '_', sheet_name)
+        self.file_name = os.path.join(directory, f"{spreadsheet_id}_{safe_sheet_name}.csv")
+        os.makedirs(directory, exist_ok=True)
+        pass
+
+    # read the mirrored rows (None if the sheet has not been mirrored yet)
+    def load(self):
+        if (os.path.exists(self.file_name) == False):
+            return None
+        with open(self.file_name, mode='r', newline='', encoding='utf-8') as file:
+            reader = csv.reader(file, delimiter=',', quotechar='"')
+            return [row for row in reader]
+
+    # replace the mirrored rows
+    def save(self, rows):
+        temp_file_name = self.file_name + ".tmp"
+        with open(temp_file_name, mode='w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerows(rows)
+        os.replace(temp_file_name, self.file_name)
+        pass
+
+    # check that the sheet still ends where the mirror ends by downloading only the last mirrored row and the row after it
+    def is_current(self, worksheet, rows):
+        if (len(rows) == 0):
+            return False
+        tail_rows = worksheet.get(f"A{len(rows)}:B{len(rows) + 1}")
+        return ((len(tail_rows) == 1) and (tail_rows[0][:2] == rows[-1][:2]))
+
+    pass
+
+# class that keeps one authorized Google sheets connection and remembers the worksheets so they are only listed once per pass
+class google_sheets_connection:
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self.worksheets = None      # worksheets by title, loaded the first time they are needed
+        self.lock = threading.Lock()
+        pass
+
+    # returns the worksheet with the given title (None if it does not exist)
+    def get_worksheet(self, sheet_name):
+        with self.lock:
+            if (self.worksheets is None):
+                self.worksheets = {sheet.title: sheet for sheet in self.workbook.worksheets()}
+            return self.worksheets.get(sheet_name)
+
+    # creates a worksheet and remembers it
+    def add_worksheet(self, sheet_name, rows, cols):
+        with self.lock:
+            worksheet = self.workbook.add_worksheet(title=sheet_name, rows=rows, cols=cols)
+            if (self.worksheets is not None):
+                self.worksheets[sheet_name] = worksheet
+            return worksheet
+
+    # forget the remembered worksheets so they are listed again (once per pass or after a worksheet went missing)
+    def invalidate(self):
+        with self.lock:
+            self.worksheets = None
+        pass
+
+    pass
+
+# connections shared by every storing_into_google_sheets object so they last across locations and hourly passes
+GOOGLE_SHEETS_CONNECTIONS = {}
+GOOGLE_SHEETS_CONNECTIONS_LOCK = threading.Lock()
+
+# returns the shared connection to a spreadsheet, authorizing only the first time it is needed
+def get_google_sheets_connection(SPREADSHEET_ID, SERVICE_ACCOUNT_FILE):
+    with GOOGLE_SHEETS_CONNECTIONS_LOCK:
+        connection = GOOGLE_SHEETS_CONNECTIONS.get((SPREADSHEET_ID, SERVICE_ACCOUNT_FILE))
+        if (connection is None):
+            # establish connection to Google sheets API
+            credentials = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=['https://www.googleapis.com/auth/spreadsheets'])
+            client = gspread.authorize(credentials)
+            connection = google_sheets_connection(client.open_by_key(SPREADSHEET_ID))
+            GOOGLE_SHEETS_CONNECTIONS[(SPREADSHEET_ID, SERVICE_ACCOUNT_FILE)] = connection
+    return connection
+
+# list the worksheets of a spreadsheet again next time they are needed (does nothing if the spreadsheet was never connected to)
+def invalidate_google_sheets_connection(SPREADSHEET_ID, SERVICE_ACCOUNT_FILE):
+    with GOOGLE_SHEETS_CONNECTIONS_LOCK:
+        connection = GOOGLE_SHEETS_CONNECTIONS.get((SPREADSHEET_ID, SERVICE_ACCOUNT_FILE))
+    if (connection is not None):
+        connection.invalidate()
+    pass
+
 # class that manages storing data into Google sheets
 class storing_into_google_sheets:
-    def __init__(self, location, coordinates, field_names, header_fields, SPREADSHEET_ID, SERVICE_ACCOUNT_FILE):
+    def __init__(self, location, coordinates, field_names, header_fields, SPREADSHEET_ID, SERVICE_ACCOUNT_FILE, mirror_directory=None):
         self.location = location
         self.coordinates = coordinates
         self.field_names = field_names
         self.header_fields = header_fields
         self.SPREADSHEET_ID = SPREADSHEET_ID
+        self.mirror_directory = mirror_directory    # local copies of the sheets are only kept when a directory is given
         self.SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 
-        # establish connection to Google sheets API
-        credentials = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=self.SCOPES)
-        client = gspread.authorize(credentials)
-        self.workbook = client.open_by_key(self.SPREADSHEET_ID)
+        # reuse the connection to Google sheets API that was authorized by an earlier location or pass
+        self.connection = get_google_sheets_connection(SPREADSHEET_ID, SERVICE_ACCOUNT_FILE)
+        self.workbook = self.connection.workbook
         pass
 
     # creates the Google sheet if it does not already exist
     def initialize_google_sheet(self, sheet_name):
         # check if the Google sheet for the location already exists
-        for sheet in self.workbook.worksheets():
-            if (sheet_name == sheet.title):
-                print(f"{sheet_name} Google spreadsheet for {self.location} already exists. Ignoring entry...\n")
-                return
+        if (self.connection.get_worksheet(sheet_name) is not None):
+            print(f"{sheet_name} Google spreadsheet for {self.location} already exists. Ignoring entry...\n")
+            return
             
         # create the Google sheet for the location
-        worksheet = self.workbook.add_worksheet(title=sheet_name, rows="25000", cols=len(self.header_fields))
+        worksheet = self.connection.add_worksheet(sheet_name, "25000", len(self.header_fields))
         worksheet.append_row(self.header_fields)
         print(f"Successfully created new {sheet_name} Google spreadsheet for {self.location}...\n")
         return
@@ -36,57 +131,198 @@ class storing_into_google_sheets:
     # grabs data from a Google sheet
     def all_data(self, sheet_name):
         # check if the Google sheet for the location already exists
-        sheet_data = None
-        for sheet in self.workbook.worksheets():
-            if (sheet_name == sheet.title):
-                sheet_data = self.workbook.worksheet(sheet_name).get_all_values()
+        sheet = self.connection.get_worksheet(sheet_name)
+        if (sheet is None):
+            return None
+
+        # use the local copy of the sheet when the sheet has not changed since it was mirrored
+        mirror = self.get_mirror(sheet_name)
+        if (mirror is not None):
+            mirrored_data = mirror.load()
+            if ((mirrored_data is not None) and mirror.is_current(sheet, mirrored_data)):
+                print(f"Using the local copy of the {sheet_name} Google Sheet for {self.location}...\n")
+                return mirrored_data
+
+        sheet_data = sheet.get_all_values()
+        if (mirror is not None):
+            mirror.save(sheet_data)
         #print(sheet_data)
         #print(type(sheet_data))    # list of lists
         return sheet_data
+
+    # newest date and time recorded in a Google sheet (None if nothing has been recorded yet), from the local copy when it is current
+    # or else by downloading only the date and time columns
+    def latest_recorded_datetime(self, sheet_name):
+        sheet = self.connection.get_worksheet(sheet_name)
+        if (sheet is None):
+            return None
+
+        mirror = self.get_mirror(sheet_name)
+        mirrored_data = mirror.load() if (mirror is not None) else None
+        if ((mirrored_data is not None) and mirror.is_current(sheet, mirrored_data)):
+            stored_rows = mirrored_data[1:]
+        else:
+            stored_rows = sheet.get("A2:B")
+
+        latest_recorded = None
+        for row in stored_rows:
+            if (len(row) < 2):
+                continue
+            try:
+                recorded = datetime.datetime.strptime(f"{row[0]} {row[1]}", "%Y-%m-%d %H:%M:%S").replace(tzinfo=datetime.timezone.utc)
+            except ValueError:
+                continue
+            if ((latest_recorded is None) or (recorded > latest_recorded)):
+                latest_recorded = recorded
+        return latest_recorded
+
+    # returns the local copy of a Google sheet (None if local copies are not kept)
+    def get_mirror(self, sheet_name):
+        if (self.mirror_directory is None):
+            return None
+        return sheet_mirror(self.mirror_directory, self.SPREADSHEET_ID, sheet_name)
+
+    # update the local copy of a Google sheet after the pipeline changed the sheet
+    def update_mirror(self, sheet_name, sheet_data):
+        mirror = self.get_mirror(sheet_name)
+        if (mirror is not None):
+            mirror.save(sheet_data)
+        pass
     
     # compare new data with existing data in the Google sheet
     def compare_data(self, weather_data, stored_data, sheet_name):
-        i = 0
-        stored_data_temp = stored_data[1:]      # exclude header row
+        # look up each (date, time) in a set of the stored keys instead of scanning every stored row
+        stored_keys = set((stored_row[0], stored_row[1]) for stored_row in stored_data[1:] if (len(stored_row) >= 2))     # exclude header row
+        duplicate_count = 0
 
+        # the stored row is kept when the same (date, time) is already recorded
         for weather_row in weather_data:
-            weather_flag = False
-            for stored_row in stored_data_temp:
-                if (weather_row[0] == stored_row[0] and weather_row[1] == stored_row[1]):
-                    print(f"({weather_row[0]} {weather_row[1]}) data has already been recorded in the {sheet_name} Google Sheet for {self.location}. Ignoring entry...\n")
-                    weather_flag = True
-            if (weather_flag == False):
+            if ((weather_row[0], weather_row[1]) in stored_keys):
+                duplicate_count = duplicate_count + 1
+            else:
                 stored_data.append(weather_row)
-            i = i + 1
+
+        if (duplicate_count > 0):
+            print(f"{duplicate_count} out of {len(weather_data)} rows have already been recorded in the {sheet_name} Google Sheet for {self.location}. Ignoring entries...\n")
         return stored_data
     
-    # bubble sort algorithm for sorting data in the Google sheet
-    def bubble_sort(self, data_frame, column, sheet_row_count):
-        n = sheet_row_count - 1  # exclude header row
-
-        for i in range(n):
-            for j in range(0, n - i - 1):
-                if (data_frame.iloc[j][column] > data_frame.iloc[j + 1][column]):
-                    temp = data_frame.iloc[j]
-                    data_frame.iloc[j] = data_frame.iloc[j + 1]
-                    data_frame.iloc[j + 1] = temp
-        return data_frame
-
-    # prepares to store multiple weather data records into a Google sheet at once
+    # check if the stored rows (header row excluded) are in date and time order
+    def is_sorted(self, stored_rows):
+        # the dates and times are zero padded so comparing them as text keeps them in time order
+        for j in range(1, len(stored_rows)):
+            if ((stored_rows[j][0], stored_rows[j][1]) < (stored_rows[j - 1][0], stored_rows[j - 1][1])):
+                return False
+        return True
+
+    # converts rows into strings to avoid JSON serialization errors (the same values the full re-sort uploads)
+    def rows_to_strings(self, rows):
+        return [[('' if ((value is None) or (value != value)) else str(value)) for value in row] for row in rows]
+
+    # stores only the new rows in the Google sheet at the position that keeps it in date and time order
+    def sync_records(self, sheet_name, sheet_data, stored_row_count):
+        stored_rows = sheet_data[1:stored_row_count]
+        new_rows = sorted(sheet_data[stored_row_count:], key=lambda row: (row[0], row[1]))
+
+        if (len(new_rows) == 0):
+            print(f"No new data for the {sheet_name} Google Sheet for {self.location}. Ignoring upload...\n")
+            return
+        new_rows = self.rows_to_strings(new_rows)
+
+        # a sheet that is out of order (for example edited by hand) is fully re-sorted once
+        if (self.is_sorted(stored_rows) == False):
+            print(f"The {sheet_name} Google Sheet for {self.location} is out of order. Re-sorting the whole sheet...\n")
+            self.sort_records(sheet_name, sheet_data)
+            return
+
+        worksheet = self.connection.get_worksheet(sheet_name)
+        stored_keys = [(row[0], row[1]) for row in stored_rows]
+
+        # group the new rows by the position of the stored row they have to be placed in front of
+        groups = []
+        for row in new_rows:
+            position = bisect.bisect_left(stored_keys, (row[0], row[1]))
+            if ((len(groups) > 0) and (groups[-1][0] == position)):
+                groups[-1][1].append(row)
+            else:
+                groups.append((position, [row]))
+
+        # rows newer than everything stored are written after the last stored row with a single append
+        if ((len(groups) > 0) and (groups[-1][0] == len(stored_keys))):
+            position, appended_rows = groups.pop()
+            worksheet.append_rows(appended_rows)
+
+        # the local copy now holds the stored rows with the new rows merged into their places
+        self.update_mirror(sheet_name, [sheet_data[0]] + list(heapq.merge(stored_rows, new_rows, key=lambda row: (row[0], row[1]))))
+
+        if (len(groups) == 0):
+            print(f"Successfully appended {len(new_rows)} rows into the {sheet_name} Google Sheet for {self.location}...\n")
+            return
+
+        # late rows are inserted in place: first make room for every group (from the bottom up so positions do not shift)
+        insert_requests = []
+        for position, rows in reversed(groups):
+            insert_requests.append({
+                "insertDimension": {
+                    "range": {"sheetId": worksheet.id, "dimension": "ROWS", "startIndex": position + 1, "endIndex": position + 1 + len(rows)},
+                    "inheritFromBefore": True
+                }
+            })
+        self.workbook.batch_update({"requests": insert_requests})
+
+        # then fill in every group with a single values update
+        value_ranges = []
+        inserted_count = 0
+        for position, rows in groups:
+            first_row = position + 2 + inserted_count    # sheet rows start at 1 and the header takes the first row
+            value_ranges.append({"range": f"A{first_row}", "values": rows})
+            inserted_count = inserted_count + len(rows)
+        worksheet.batch_update(value_ranges)
+
+        print(f"Successfully inserted {len(new_rows)} rows into the {sheet_name} Google Sheet for {self.location}...\n")
+        pass
+
+    # check that a Google sheet still holds the given number of rows (header row excluded) ending with the given date and time
+    def ends_with(self, sheet_name, row_count, last_row):
+        worksheet = self.connection.get_worksheet(sheet_name)
+        if ((worksheet is None) or (row_count == 0) or (last_row is None)):
+            return False
+        tail_rows = worksheet.get(f"A{row_count + 1}:B{row_count + 2}")
+        return ((len(tail_rows) == 1) and (tail_rows[0][:2] == last_row))
+
+    # replace every row after the first kept rows of a Google sheet (header row excluded) with the given rows
+    def replace_records_after(self, sheet_name, kept_row_count, stored_row_count, rows):
+        worksheet = self.connection.get_worksheet(sheet_name)
+        rows = self.rows_to_strings(rows)
+
+        # rows that are already in the sheet are overwritten in place and the rest are appended after them
+        overwritten_count = min(len(rows), max(0, stored_row_count - kept_row_count))
+        if (overwritten_count > 0):
+            worksheet.batch_update([{"range": f"A{kept_row_count + 2}", "values": rows[:overwritten_count]}])
+        if (overwritten_count < len(rows)):
+            worksheet.append_rows(rows[overwritten_count:])
+
+        # the local copy is only updated when it is there to update
+        mirror = self.get_mirror(sheet_name)
+        mirrored_data = mirror.load() if (mirror is not None) else None
+        if (mirrored_data is not None):
+            mirror.save(mirrored_data[:kept_row_count + 1] + rows)
+        pass
+
+    # re-sorts and re-uploads every row of the Google sheet
     def sort_records(self, sheet_name, sheet_data):
-        worksheet = self.workbook.worksheet(sheet_name)
-        sheet_row_count = len(sheet_data)
+        worksheet = self.connection.get_worksheet(sheet_name)
         worksheet.clear()
         sheet_data[0] = self.header_fields
 
         df = pd.DataFrame(sheet_data[1:], columns=sheet_data[0])
         df['DateTime'] = pd.to_datetime(df['Date (YYYY-MM-DD)'] + ' ' + df['Time (HH:MM:SS)'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
-        df = self.bubble_sort(df, 'DateTime', sheet_row_count)
+        df = df.sort_values(by=['DateTime'], kind='stable')
         df = df.drop(columns=['DateTime'])   # remove temporary column
         
         # replace NaN with empty string and convert all values to strings to avoid JSON serialization errors
         sheet_data = [df.columns.values.tolist()] + df.fillna('').astype(str).values.tolist()
         worksheet.append_rows(sheet_data)
+        self.update_mirror(sheet_name, sheet_data)
         pass
 
     pass
\ No newline at end of file
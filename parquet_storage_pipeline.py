@@ -0,0 +1,149 @@
+# libraries
+import os
+import re
+import glob
+import uuid
+import datetime
+import threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# class that stores weather data into compressed Parquet files split up by dataset, location, and month
+class parquet_storage:
+    def __init__(self, directory, header_fields, compression="zstd", max_parts=24):
+        self.directory = directory
+        self.header_fields = header_fields
+        self.compression = compression
+        self.max_parts = max_parts      # the small files appended to a month are merged once there are this many
+        self.partition_keys = {}        # (date, time) keys already stored in each month, loaded the first time they are needed
+        self.lock = threading.Lock()
+        pass
+
+    # name of a location that is safe to use as a folder name
+    def partition_name(self, location):
+        return re.sub(r'[^A-Za-z0-9_.-]', '_', location)
+
+    # folder that holds one month of data for one location
+    def partition_directory(self, dataset, location, month):
+        return os.path.join(self.directory, dataset, f"location={self.partition_name(location)}", f"month={month}")
+
+    # turns parsed rows into a typed table (numbers as floats, the date and time as a real timestamp)
+    def rows_to_data_frame(self, rows):
+        df = pd.DataFrame([list(row) for row in rows], columns=self.header_fields)
+        df[self.header_fields[0]] = df[self.header_fields[0]].astype(str)
+        df[self.header_fields[1]] = df[self.header_fields[1]].astype(str)
+        df[self.header_fields[2]] = df[self.header_fields[2]].astype(str)
+        df[self.header_fields[3]] = df[self.header_fields[3]].astype(str)
+        for column in self.header_fields[4:]:
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype('float64')
+        df['DateTime'] = pd.to_datetime(df[self.header_fields[0]] + ' ' + df[self.header_fields[1]], format='%Y-%m-%d %H:%M:%S', errors='coerce', utc=True)
+        return df
+
+    # gives a DataFrame from the bulk parser (see parse_intervals_to_data_frame) the column names of the stored tables
+    def parsed_data_frame(self, parsed_df):
+        return parsed_df.rename(columns=dict(zip(parsed_df.columns[0:len(self.header_fields)], self.header_fields)))
+
+    # (date, time) keys already stored in a month (only the date and time columns are read)
+    def stored_keys(self, partition_directory):
+        keys = self.partition_keys.get(partition_directory)
+        if (keys is None):
+            keys = set()
+            for part_file in glob.glob(os.path.join(partition_directory, "*.parquet")):
+                table = pq.read_table(part_file, columns=self.header_fields[0:2])
+                keys.update(zip(table.column(0).to_pylist(), table.column(1).to_pylist()))
+            self.partition_keys[partition_directory] = keys
+        return keys
+
+    # add the rows of one location to its monthly files (rows that are already stored are skipped)
+    def add_records(self, dataset, location, rows):
+        if (len(rows) == 0):
+            return 0
+        return self.add_data_frame(dataset, location, self.rows_to_data_frame(rows))
+
+    # add a typed table of one location (with the columns of rows_to_data_frame) to its monthly files
+    def add_data_frame(self, dataset, location, df):
+        if (len(df) == 0):
+            return 0
+
+        df = df.copy()
+        df['month'] = df[self.header_fields[0]].str.slice(0, 7)
+        added_count = 0
+
+        with self.lock:
+            for month, month_df in df.groupby('month', sort=True):
+                partition_directory = self.partition_directory(dataset, location, month)
+                keys = self.stored_keys(partition_directory)
+
+                # keep the first copy of each (date, time)
+                month_df = month_df.drop_duplicates(subset=self.header_fields[0:2], keep='first')
+                is_new = [((date, time) not in keys) for date, time in zip(month_df[self.header_fields[0]], month_df[self.header_fields[1]])]
+                month_df = month_df[is_new].drop(columns=['month']).sort_values(by=['DateTime'], kind='stable')
+                if (len(month_df) == 0):
+                    continue
+
+                # every batch is written as a new small file so nothing that is already stored has to be rewritten
+                os.makedirs(partition_directory, exist_ok=True)
+                part_file = os.path.join(partition_directory, f"part-{uuid.uuid4().hex}.parquet")
+                pq.write_table(pa.Table.from_pandas(month_df, preserve_index=False), part_file, compression=self.compression)
+                keys.update(zip(month_df[self.header_fields[0]], month_df[self.header_fields[1]]))
+                added_count = added_count + len(month_df)
+
+                self.compact_partition(partition_directory)
+
+        print(f"Successfully added {added_count} records into the {dataset} Parquet files for {location}...\n")
+        return added_count
+
+    # merge the small files of a month into one sorted file once there are too many of them
+    def compact_partition(self, partition_directory):
+        part_files = sorted(glob.glob(os.path.join(partition_directory, "*.parquet")))
+        if (len(part_files) < self.max_parts):
+            return
+
+        table = pa.concat_tables([pq.read_table(part_file) for part_file in part_files])
+        df = table.to_pandas().sort_values(by=['DateTime'], kind='stable')
+        compacted_file = os.path.join(partition_directory, f"part-{uuid.uuid4().hex}.parquet")
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), compacted_file, compression=self.compression)
+
+        # remove the small files only after the merged file is completely written
+        for part_file in part_files:
+            os.remove(part_file)
+        pass
+
+    # newest hour stored for a location (None if nothing has been stored yet), reading only the timestamps of its newest month
+    def latest_recorded_datetime(self, dataset, location):
+        location_directory = os.path.join(self.directory, dataset, f"location={self.partition_name(location)}")
+        if (os.path.exists(location_directory) == False):
+            return None
+
+        for month_directory in sorted(glob.glob(os.path.join(location_directory, "month=*")), reverse=True):
+            part_files = glob.glob(os.path.join(month_directory, "*.parquet"))
+            if (len(part_files) == 0):
+                continue
+            latest_recorded = max(pq.read_table(part_file, columns=['DateTime']).column(0).to_pandas().max() for part_file in part_files)
+            if (pd.notna(latest_recorded)):
+                return latest_recorded.to_pydatetime().astimezone(datetime.timezone.utc)
+        return None
+
+    # read some columns of some locations and months without reading anything else
+    def read(self, dataset, columns=None, locations=None, months=None):
+        dataset_directory = os.path.join(self.directory, dataset)
+        if (os.path.exists(dataset_directory) == False):
+            return pd.DataFrame(columns=columns)
+
+        partitioning = ds.partitioning(pa.schema([("location", pa.string()), ("month", pa.string())]), flavor="hive")
+        weather_dataset = ds.dataset(dataset_directory, format="parquet", partitioning=partitioning)
+
+        # only the folders of the requested locations and months are opened
+        partition_filter = None
+        if (locations is not None):
+            partition_filter = ds.field("location").isin([self.partition_name(location) for location in locations])
+        if (months is not None):
+            month_filter = ds.field("month").isin(list(months))
+            partition_filter = month_filter if (partition_filter is None) else (partition_filter & month_filter)
+
+        table = weather_dataset.to_table(columns=columns, filter=partition_filter)
+        return table.to_pandas()
+
+    pass
\ No newline at end of file
@@ -0,0 +1,535 @@
+# libraries
+import os
+import json
+import datetime
+import threading
+import numpy as np
+import pandas as pd
+
+# hours the lag features look back and hours the rolling window features cover
+LAG_HOURS = (1, 2, 3, 6)
+WINDOW_HOURS = (3, 6, 24)
+
+# observed hours a location needs before its newest hour can be scored (every lag and rolling window has to fit)
+HISTORY_HOURS = max(LAG_HOURS + WINDOW_HOURS)
+
+# precipitationType of rain (0 = No precipitation, 1 = Rain, 2 = Snow, 3 = Freezing rain, 4 = Ice pellets / sleet)
+RAIN_PRECIPITATION_TYPE = 1
+
+# read an observed CSV file as typed columns (the weather fields are named after FIELD_NAMES so every header works)
+def load_weather_csv(file_name, location, field_names):
+    header = pd.read_csv(file_name, nrows=0).columns.tolist()
+    field_columns = header[4:4 + len(field_names)]
+    df = pd.read_csv(file_name, usecols=header[0:2] + field_columns, dtype={column: np.float64 for column in field_columns})
+    df = df.rename(columns=dict(zip(field_columns, field_names)))
+
+    df.insert(0, 'DateTime', pd.to_datetime(df[header[0]] + ' ' + df[header[1]], format='%Y-%m-%d %H:%M:%S', errors='coerce', utc=True))
+    df.insert(0, 'location', location)
+    return df.drop(columns=header[0:2])
+
+# hours since 1970 of every timestamp (NaT becomes -1)
+def epoch_hours(date_times):
+    date_times = pd.DatetimeIndex(date_times)
+    hours = date_times.tz_convert('UTC').tz_localize(None).to_numpy(dtype='datetime64[h]').astype(np.int64)
+    hours[date_times.isna()] = -1
+    return hours
+
+# class that turns hourly observations into lag, rolling window, and time features
+# (forecasts are not used since the stored forecasts were made days ahead while the hourly passes only have fresh ones, so the model would be scored on different inputs than it was trained on)
+# every location is laid out on a complete hourly grid so "one hour ago" is always the previous hour even when hours are missing,
+# and every feature is computed for all locations at once with array operations instead of looping over the rows
+class rain_feature_builder:
+    def __init__(self, field_names, horizon=1, lag_hours=LAG_HOURS, window_hours=WINDOW_HOURS):
+        self.field_names = list(field_names)
+        self.horizon = horizon          # how many hours ahead rain is predicted
+        self.lag_hours = tuple(lag_hours)
+        self.window_hours = tuple(window_hours)
+        if (('rainIntensity' not in self.field_names) and ('precipitationType' not in self.field_names)):
+            raise RuntimeError("Rain prediction needs rainIntensity or precipitationType in FIELD_NAMES. Please add one of them.")
+        pass
+
+    # observed hours needed before the features of an hour can all be filled in
+    def history_hours(self):
+        return max(self.lag_hours + self.window_hours)
+
+    # names of every feature in the order they are built
+    def feature_names(self):
+        names = []
+        for field in self.field_names:
+            names.append(field)
+            names.extend(f"{field}_lag{lag}" for lag in self.lag_hours)
+            names.extend(f"{field}_mean{window}" for window in self.window_hours)
+            names.extend(f"{field}_std{window}" for window in self.window_hours)
+            names.append(f"{field}_change")
+        names.extend(['rain_now', 'hour_sin', 'hour_cos', 'day_sin', 'day_cos'])
+        return names
+
+    # 1 where it rained during an hour, 0 where it did not, NaN where the hour is unknown
+    def rain_indicator(self, values):
+        rain = np.full(len(values), np.nan)
+        for field, is_rain in [('rainIntensity', lambda column: column > 0), ('precipitationType', lambda column: column == RAIN_PRECIPITATION_TYPE)]:
+            if (field in self.field_names):
+                column = values[:, self.field_names.index(field)]
+                known = (np.isnan(column) == False)
+                rain = np.where(known, np.fmax(np.nan_to_num(rain), is_rain(column).astype(np.float64)), rain)
+        return rain
+
+    # lay every location out on a complete hourly grid (missing hours are NaN), sorted by location and hour
+    def hourly_grid(self, df):
+        df = df[df['DateTime'].notna()]
+        hours = epoch_hours(df['DateTime'])
+        codes, locations = pd.factorize(df['location'], sort=True)
+
+        # the same hour stored twice keeps the row that was stored last
+        order = np.lexsort((np.arange(len(df)), hours, codes))
+        codes, hours = codes[order], hours[order]
+        values = df[self.field_names].to_numpy(dtype=np.float64)[order]
+        last = np.ones(len(codes), dtype=bool)
+        last[:-1] = (codes[1:] != codes[:-1]) | (hours[1:] != hours[:-1])
+        codes, hours, values = codes[last], hours[last], values[last]
+
+        first_hours = np.full(len(locations), np.iinfo(np.int64).max)
+        last_hours = np.full(len(locations), -1)
+        np.minimum.at(first_hours, codes, hours)
+        np.maximum.at(last_hours, codes, hours)
+        lengths = np.where(last_hours >= 0, last_hours - first_hours + 1, 0)
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+        grid_codes = np.repeat(np.arange(len(locations)), lengths)
+        grid_starts = starts[grid_codes]
+        grid_hours = first_hours[grid_codes] + (np.arange(len(grid_codes)) - grid_starts)
+        grid_values = np.full((len(grid_codes), len(self.field_names)), np.nan)
+        grid_values[starts[codes] + hours - first_hours[codes]] = values
+        return locations, grid_codes, grid_hours, grid_starts, grid_starts + lengths[grid_codes], grid_values
+
+    # build the features of every hour and whether it rained horizon hours later (NaN when that hour is unknown)
+    # returns the location and hour of each row, a dict of feature name -> column, and the targets
+    def build(self, observed_df):
+        locations, grid_codes, grid_hours, grid_starts, grid_ends, values = self.hourly_grid(observed_df)
+        row_count = len(grid_codes)
+        positions = np.arange(row_count) - grid_starts
+        features = {}
+
+        # values are centered before they are added up so the rolling sums stay accurate over long files
+        centers = np.nan_to_num(np.nanmean(values, axis=0)) if (row_count > 0) else np.zeros(len(self.field_names))
+        centered = values - centers
+        present = (np.isnan(values) == False)
+        zero_row = np.zeros((1, len(self.field_names)))
+        running_sums = np.concatenate([zero_row, np.cumsum(np.where(present, centered, 0.0), axis=0)])
+        running_squares = np.concatenate([zero_row, np.cumsum(np.where(present, centered * centered, 0.0), axis=0)])
+        running_counts = np.concatenate([zero_row, np.cumsum(present, axis=0)])
+
+        lags = {}
+        for lag in self.lag_hours:
+            lagged = np.full(values.shape, np.nan)
+            lagged[lag:] = values[:-lag] if (lag > 0) else values
+            lagged[positions < lag] = np.nan        # never reach back into the previous location
+            lags[lag] = lagged
+
+        means, stds = {}, {}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for window in self.window_hours:
+                window_starts = np.maximum(np.arange(row_count) + 1 - window, grid_starts)
+                window_ends = np.arange(row_count) + 1
+                counts = running_counts[window_ends] - running_counts[window_starts]
+                mean = (running_sums[window_ends] - running_sums[window_starts]) / counts
+                variance = (running_squares[window_ends] - running_squares[window_starts]) / counts - mean * mean
+                means[window] = np.where(counts > 0, mean + centers, np.nan)
+                stds[window] = np.where(counts > 0, np.sqrt(np.maximum(variance, 0.0)), np.nan)
+
+        previous = lags[1] if (1 in lags) else np.where((positions >= 1)[:, None], np.concatenate([np.full((1, len(self.field_names)), np.nan), values[:-1]]), np.nan)
+        for k, field in enumerate(self.field_names):
+            features[field] = values[:, k]
+            for lag in self.lag_hours:
+                features[f"{field}_lag{lag}"] = lags[lag][:, k]
+            for window in self.window_hours:
+                features[f"{field}_mean{window}"] = means[window][:, k]
+            for window in self.window_hours:
+                features[f"{field}_std{window}"] = stds[window][:, k]
+            features[f"{field}_change"] = values[:, k] - previous[:, k]
+
+        rain = self.rain_indicator(values)
+        features['rain_now'] = rain
+        hour_of_day = (grid_hours % 24) * (2 * np.pi / 24)
+        day_of_year = pd.DatetimeIndex(grid_hours.astype('datetime64[h]')).dayofyear.to_numpy() * (2 * np.pi / 365.25)
+        features['hour_sin'], features['hour_cos'] = np.sin(hour_of_day), np.cos(hour_of_day)
+        features['day_sin'], features['day_cos'] = np.sin(day_of_year), np.cos(day_of_year)
+
+        # the target is whether it rained horizon hours later at the same location
+        targets = np.full(row_count, np.nan)
+        ahead = np.arange(row_count) + self.horizon
+        in_location = (ahead < grid_ends)
+        targets[in_location] = rain[ahead[in_location]]
+
+        keys = pd.DataFrame({'location': locations[grid_codes], 'DateTime': pd.DatetimeIndex(grid_hours.astype('datetime64[h]')).tz_localize('UTC'), 'last_hour': (np.arange(row_count) == grid_ends - 1)})
+        return keys, features, targets
+
+    # stack features into a matrix with the columns in the given order (features that were not built are NaN)
+    def feature_matrix(self, features, feature_names):
+        row_count = len(next(iter(features.values()))) if (len(features) > 0) else 0
+        missing = np.full(row_count, np.nan)
+        return np.column_stack([features.get(name, missing) for name in feature_names]) if (len(feature_names) > 0) else np.empty((row_count, 0))
+
+    pass
+
+# base class of the rain classifiers (features are standardized with the training means and missing values become the mean)
+class rain_classifier:
+    kind = None
+
+    def __init__(self, feature_names):
+        self.feature_names = list(feature_names)
+        self.means = np.zeros(len(self.feature_names))
+        self.stds = np.ones(len(self.feature_names))
+        pass
+
+    # learn the standardization from the training features
+    # (features that were never filled in get a mean of 0 and a spread of 1)
+    def fit_scaler(self, X):
+        present = (np.isnan(X) == False)
+        counts = present.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = np.where(present, X, 0.0).sum(axis=0) / counts
+            deviations = np.where(present, X - means, 0.0)
+            stds = np.sqrt((deviations * deviations).sum(axis=0) / counts)
+        self.means = np.where(counts > 0, means, 0.0)
+        self.stds = np.where((counts > 0) & (stds > 0), stds, 1.0)
+        pass
+
+    # standardized features with missing values at 0 (the training mean)
+    def standardize(self, X):
+        return np.nan_to_num((X - self.means) / self.stds, nan=0.0, posinf=0.0, neginf=0.0)
+
+    # values needed to rebuild the classifier (besides the standardization)
+    def parameters(self):
+        return {}
+
+    # rebuild the classifier from its saved values
+    def load_parameters(self, parameters):
+        pass
+
+    pass
+
+# baseline that predicts the chance of rain from whether it is raining now
+class persistence_classifier(rain_classifier):
+    kind = "persistence"
+
+    def __init__(self, feature_names):
+        super().__init__(feature_names)
+        self.rain_column = self.feature_names.index('rain_now')
+        self.probabilities = np.array([0.0, 0.0])      # chance of rain after a dry hour and after a rainy hour
+        pass
+
+    # chance of rain after dry and rainy hours in the training data (with one imagined hour of each so no chance is exactly 0 or 1)
+    def fit(self, X, y):
+        self.fit_scaler(X)
+        raining = (np.nan_to_num(X[:, self.rain_column]) > 0)
+        for state in [0, 1]:
+            matches = (raining == bool(state))
+            self.probabilities[state] = (y[matches].sum() + y.mean()) / (matches.sum() + 1) if (len(y) > 0) else 0.0
+        return self
+
+    # chance of rain of every row
+    def predict_proba(self, X):
+        return self.probabilities[(np.nan_to_num(X[:, self.rain_column]) > 0).astype(np.int64)]
+
+    def parameters(self):
+        return {'probabilities': self.probabilities.tolist()}
+
+    def load_parameters(self, parameters):
+        self.probabilities = np.array(parameters['probabilities'], dtype=np.float64)
+        pass
+
+    pass
+
+# logistic regression with an L2 penalty, fitted with Newton's method (a handful of steps since there are only a few hundred features)
+class logistic_regression_classifier(rain_classifier):
+    kind = "logistic_regression"
+
+    def __init__(self, feature_names, l2_penalty=1.0, max_iterations=25, tolerance=1e-6):
+        super().__init__(feature_names)
+        self.l2_penalty = l2_penalty
+        self.max_iterations = max_iterations
+        self.tolerance = tolerance
+        self.weights = np.zeros(len(self.feature_names) + 1)      # the last weight is the intercept
+        pass
+
+    # adds the column of ones the intercept is multiplied by
+    def design_matrix(self, X):
+        return np.column_stack([self.standardize(X), np.ones(len(X))])
+
+    # penalized negative log likelihood (log(1 + e^z) is computed without overflowing)
+    def loss(self, design, y, weights, penalty):
+        scores = design @ weights
+        return np.sum(np.logaddexp(0.0, scores) - y * scores) + 0.5 * np.sum(penalty * weights * weights)
+
+    # chance of rain from the scores (tanh does not overflow for large scores)
+    def sigmoid(self, scores):
+        return 0.5 * (1.0 + np.tanh(0.5 * scores))
+
+    def fit(self, X, y):
+        self.fit_scaler(X)
+        design = self.design_matrix(X)
+        penalty = np.full(design.shape[1], self.l2_penalty)
+        penalty[-1] = 0.0       # the intercept is not penalized
+
+        # start from the base rate so the first step is already close
+        base_rate = np.clip(y.mean(), 1e-6, 1 - 1e-6) if (len(y) > 0) else 0.5
+        weights = np.zeros(design.shape[1])
+        weights[-1] = np.log(base_rate / (1 - base_rate))
+        loss = self.loss(design, y, weights, penalty)
+        for iteration in range(self.max_iterations):
+            probabilities = self.sigmoid(design @ weights)
+            gradient = design.T @ (probabilities - y) + penalty * weights
+            curvature = probabilities * (1 - probabilities)
+            hessian = (design.T * curvature) @ design + np.diag(penalty + 1e-9)
+            step = np.linalg.solve(hessian, gradient)
+
+            # a full Newton step can overshoot when rain is rare, so the step is halved until the loss goes down
+            step_size = 1.0
+            new_loss = self.loss(design, y, weights - step, penalty)
+            while ((new_loss > loss) and (step_size > 1e-4)):
+                step_size = step_size / 2
+                new_loss = self.loss(design, y, weights - step_size * step, penalty)
+            if (new_loss > loss):
+                break
+            weights = weights - step_size * step
+            converged = (loss - new_loss < self.tolerance * max(abs(loss), 1.0))
+            loss = new_loss
+            if (converged):
+                break
+        self.weights = weights
+        return self
+
+    def predict_proba(self, X):
+        return self.sigmoid(self.design_matrix(X) @ self.weights)
+
+    def parameters(self):
+        return {'l2_penalty': self.l2_penalty, 'weights': self.weights.tolist()}
+
+    def load_parameters(self, parameters):
+        self.l2_penalty = parameters['l2_penalty']
+        self.weights = np.array(parameters['weights'], dtype=np.float64)
+        pass
+
+    pass
+
+# Gaussian naive Bayes (every feature is treated as an independent normal distribution per class)
+class gaussian_naive_bayes_classifier(rain_classifier):
+    kind = "gaussian_naive_bayes"
+
+    def __init__(self, feature_names, variance_smoothing=1e-3):
+        super().__init__(feature_names)
+        self.variance_smoothing = variance_smoothing
+        self.log_priors = np.log(np.array([0.5, 0.5]))
+        self.class_means = np.zeros((2, len(self.feature_names)))
+        self.class_variances = np.ones((2, len(self.feature_names)))
+        pass
+
+    def fit(self, X, y):
+        self.fit_scaler(X)
+        standardized = self.standardize(X)
+        for state in [0, 1]:
+            rows = standardized[y == state]
+            # a class that never happened keeps the overall distribution and a tiny prior
+            self.log_priors[state] = np.log(max(len(rows), 1) / max(len(y), 1))
+            self.class_means[state] = rows.mean(axis=0) if (len(rows) > 0) else 0.0
+            self.class_variances[state] = (rows.var(axis=0) if (len(rows) > 0) else 1.0) + self.variance_smoothing
+        return self
+
+    def predict_proba(self, X):
+        standardized = self.standardize(X)
+        log_likelihoods = []
+        for state in [0, 1]:
+            squared_distances = (standardized - self.class_means[state]) ** 2 / self.class_variances[state]
+            log_likelihoods.append(self.log_priors[state] - 0.5 * (squared_distances.sum(axis=1) + np.log(2 * np.pi * self.class_variances[state]).sum()))
+        return 1.0 / (1.0 + np.exp(np.clip(log_likelihoods[0] - log_likelihoods[1], -35, 35)))
+
+    def parameters(self):
+        return {'variance_smoothing': self.variance_smoothing, 'log_priors': self.log_priors.tolist(), 'class_means': self.class_means.tolist(), 'class_variances': self.class_variances.tolist()}
+
+    def load_parameters(self, parameters):
+        self.variance_smoothing = parameters['variance_smoothing']
+        self.log_priors = np.array(parameters['log_priors'], dtype=np.float64)
+        self.class_means = np.array(parameters['class_means'], dtype=np.float64)
+        self.class_variances = np.array(parameters['class_variances'], dtype=np.float64)
+        pass
+
+    pass
+
+# every classifier that is trained and compared
+RAIN_CLASSIFIERS = {classifier.kind: classifier for classifier in [persistence_classifier, logistic_regression_classifier, gaussian_naive_bayes_classifier]}
+
+# how well the predicted chances of rain match what happened
+def classification_metrics(probabilities, targets, threshold=0.5):
+    if (len(targets) == 0):
+        return {'rows': 0}
+    clipped = np.clip(probabilities, 1e-15, 1 - 1e-15)
+    predicted = (probabilities >= threshold)
+    actual = (targets > 0.5)
+    true_positives = int(np.sum(predicted & actual))
+    precision = true_positives / max(int(predicted.sum()), 1)
+    recall = true_positives / max(int(actual.sum()), 1)
+    return {
+        'rows': int(len(targets)),
+        'rain_rate': float(actual.mean()),
+        'log_loss': float(-np.mean(targets * np.log(clipped) + (1 - targets) * np.log(1 - clipped))),
+        'brier_score': float(np.mean((probabilities - targets) ** 2)),
+        'accuracy': float(np.mean(predicted == actual)),
+        'precision': float(precision),
+        'recall': float(recall),
+        'f1': float(2 * precision * recall / (precision + recall)) if (precision + recall > 0) else 0.0,
+    }
+
+# class that saves the fitted classifiers and remembers which one predicted best
+class rain_model_store:
+    def __init__(self, directory="rain_models"):
+        self.directory = directory
+        self.selection_file_name = os.path.join(directory, "rain_models.json")
+        pass
+
+    # file a classifier is saved in
+    def model_file_name(self, kind):
+        return os.path.join(self.directory, f"rain_model_{kind}.json")
+
+    # write a JSON file through a temporary file so a reader never sees half of it
+    def write_json(self, file_name, contents):
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_file_name = f"{file_name}.tmp"
+        with open(temporary_file_name, mode='w', encoding='utf-8') as file:
+            json.dump(contents, file)
+        os.replace(temporary_file_name, file_name)
+        pass
+
+    # save every classifier, then the selection so it only ever points at classifiers that are already saved
+    def save(self, models, builder, selection):
+        for kind, model in models.items():
+            self.write_json(self.model_file_name(kind), {
+                'kind': kind,
+                'field_names': builder.field_names,
+                'horizon': builder.horizon,
+                'lag_hours': list(builder.lag_hours),
+                'window_hours': list(builder.window_hours),
+                'feature_names': model.feature_names,
+                'means': model.means.tolist(),
+                'stds': model.stds.tolist(),
+                'parameters': model.parameters(),
+            })
+        self.write_json(self.selection_file_name, selection)
+        pass
+
+    # modification time of the selection (None when nothing was trained yet)
+    def modified_time(self):
+        try:
+            return os.stat(self.selection_file_name).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    # the best classifier and the feature builder it was trained with (None when nothing was trained yet)
+    def load_best(self):
+        if (self.modified_time() is None):
+            return None
+        with open(self.selection_file_name, mode='r', encoding='utf-8') as file:
+            selection = json.load(file)
+        with open(self.model_file_name(selection['best']), mode='r', encoding='utf-8') as file:
+            saved = json.load(file)
+
+        builder = rain_feature_builder(saved['field_names'], saved['horizon'], saved['lag_hours'], saved['window_hours'])
+        model = RAIN_CLASSIFIERS[saved['kind']](saved['feature_names'])
+        model.means = np.array(saved['means'], dtype=np.float64)
+        model.stds = np.array(saved['stds'], dtype=np.float64)
+        model.load_parameters(saved['parameters'])
+        return rain_predictor(model, builder, selection)
+
+    pass
+
+# train every classifier on the observed CSV files, compare them on the newest hours, and save them all
+def train_rain_models(observed_files, locations, field_names, model_directory="rain_models", horizon=1, validation_fraction=0.2):
+    if (('rainIntensity' not in field_names) and ('precipitationType' not in field_names)):
+        print(f"Skipping rain prediction training since FIELD_NAMES has neither rainIntensity nor precipitationType...\n")
+        return None
+
+    print(f"Training the rain prediction models for {horizon} hour(s) ahead...\n")
+    builder = rain_feature_builder(field_names, horizon)
+
+    observed_frames = []
+    for observed_file, location in zip(observed_files, locations):
+        if (os.path.exists(observed_file) == False):
+            print(f"Skipping {location} for rain prediction since {observed_file} does not exist yet...\n")
+            continue
+        observed_frames.append(load_weather_csv(observed_file, location, field_names))
+    if (len(observed_frames) == 0):
+        print(f"There is no observed weather data to train the rain prediction models with yet...\n")
+        return None
+
+    keys, features, targets = builder.build(pd.concat(observed_frames, ignore_index=True))
+    feature_names = builder.feature_names()
+    labeled = (np.isnan(targets) == False)
+    X, y = builder.feature_matrix(features, feature_names)[labeled], targets[labeled]
+    hours = epoch_hours(keys['DateTime'])[labeled]
+    if (len(y) < 10):
+        print(f"Only {len(y)} hours can be used to train the rain prediction models so training is skipped...\n")
+        return None
+
+    # the newest hours of every location are held back so the comparison scores predictions of hours the models have not seen
+    training = (hours <= np.quantile(hours, 1 - validation_fraction))
+    metrics = {}
+    for kind, classifier in RAIN_CLASSIFIERS.items():
+        model = classifier(feature_names).fit(X[training], y[training])
+        metrics[kind] = classification_metrics(model.predict_proba(X[training == False]), y[training == False])
+        print(f"{kind}: {json.dumps(metrics[kind])}\n")
+
+    # the classifier with the lowest log loss on the held back hours is used, every classifier is then refitted on all of the hours
+    best = min(metrics, key=lambda kind: metrics[kind].get('log_loss', np.inf))
+    models = {kind: classifier(feature_names).fit(X, y) for kind, classifier in RAIN_CLASSIFIERS.items()}
+    selection = {
+        'best': best,
+        'metrics': metrics,
+        'training_rows': int(len(y)),
+        'validation_rows': int(np.sum(training == False)),
+        'trained_at': datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    rain_model_store(model_directory).save(models, builder, selection)
+
+    print(f"Saved the rain prediction models into {model_directory}, {best} predicted best...\n")
+    return selection
+
+# class that scores the newest hour of every location with a saved classifier
+class rain_predictor:
+    def __init__(self, model, builder, selection):
+        self.model = model
+        self.builder = builder
+        self.selection = selection
+        pass
+
+    # chance of rain horizon hours after the newest observed hour of every location, scored with one call to the classifier
+    # (locations whose observed hours do not reach back over every lag and rolling window yet are left out,
+    # since their features would mostly be filled in with the training means)
+    def predict_latest(self, observed_df):
+        if (len(observed_df) == 0):
+            return {}
+        keys, features, targets = self.builder.build(observed_df)
+        latest = keys['last_hour'].to_numpy()
+
+        covered_hours = keys.groupby('location', sort=False)['DateTime'].transform('size').to_numpy()
+        for location in keys['location'].to_numpy()[latest & (covered_hours < self.builder.history_hours())]:
+            print(f"Skipping rain prediction for {location} since fewer than {self.builder.history_hours()} hours of its observed weather are known yet...\n")
+        latest = latest & (covered_hours >= self.builder.history_hours())
+        probabilities = self.model.predict_proba(self.builder.feature_matrix(features, self.model.feature_names)[latest])
+        return dict(zip(keys['location'].to_numpy()[latest], probabilities.tolist()))
+
+    pass
+
+# predictors shared by every hourly pass, one per model directory
+RAIN_PREDICTORS = {}
+RAIN_PREDICTORS_LOCK = threading.Lock()
+
+# returns the newest saved predictor of a model directory (loaded again only when the models were retrained), None if nothing was trained yet
+def get_rain_predictor(model_directory="rain_models"):
+    store = rain_model_store(model_directory)
+    modified_time = store.modified_time()
+    with RAIN_PREDICTORS_LOCK:
+        loaded_time, predictor = RAIN_PREDICTORS.get(model_directory, (None, None))
+        if (modified_time != loaded_time):
+            predictor = store.load_best() if (modified_time is not None) else None
+            RAIN_PREDICTORS[model_directory] = (modified_time, predictor)
+    return predictor
\ No newline at end of file
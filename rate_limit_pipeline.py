@@ -0,0 +1,159 @@
+# libraries
+import threading
+import time
+import datetime
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+# reads the number of seconds to wait from a Retry-After header (either a number of seconds or an HTTP date)
+def parse_retry_after(headers):
+    retry_after = headers.get('Retry-After') if (headers is not None) else None
+    if (retry_after is None):
+        return None
+
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+
+    try:
+        retry_date = parsedate_to_datetime(retry_after)
+        return max(0.0, (retry_date - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+# class that remembers when every request inside a time window was made, so no window of that length ever holds more than the limit
+class sliding_window:
+    def __init__(self, name, capacity, window_seconds):
+        self.name = name
+        self.capacity = capacity
+        self.window_seconds = window_seconds
+        self.request_times = deque()
+        pass
+
+    # forget requests that are no longer inside the window
+    def expire(self, now):
+        while (self.request_times and (now - self.request_times[0] >= self.window_seconds)):
+            self.request_times.popleft()
+        pass
+
+    # number of seconds until one more request fits inside the window
+    def time_until_available(self, now):
+        self.expire(now)
+        if (len(self.request_times) < self.capacity):
+            return 0
+        # the oldest request that has to leave the window before one more fits
+        oldest = self.request_times[int(len(self.request_times) - self.capacity)]
+        return self.window_seconds - (now - oldest)
+
+    # record one request
+    def take(self, now):
+        self.request_times.append(now)
+        pass
+
+    # requests made by other programs with the same API key are counted as if they were made now
+    def limit_remaining(self, now, remaining):
+        self.expire(now)
+        while (self.capacity - len(self.request_times) > max(remaining, 0)):
+            self.request_times.append(now)
+        pass
+
+    # change the limit when the API reports a different one than the one configured, or when variables.txt changed it
+    # (the requests already made stay in the window so they still count against the new limit)
+    def resize(self, capacity, source="the API"):
+        if ((capacity > 0) and (capacity != self.capacity)):
+            print(f"Adjusting the per-{self.name} request limit from {self.capacity} to {capacity} to match {source}...\n")
+            self.capacity = capacity
+        pass
+
+    pass
+
+# class that keeps every API request inside the per second, per hour, and per day limits of the API plan
+class rate_limiter:
+    def __init__(self, requests_per_second, requests_per_hour, requests_per_day=None):
+        self.buckets = {
+            "second": sliding_window("second", requests_per_second, 1),
+            "hour": sliding_window("hour", requests_per_hour, 3600),
+        }
+        if (requests_per_day is not None):
+            self.buckets["day"] = sliding_window("day", requests_per_day, 86400)
+
+        self.lock = threading.Lock()
+        self.paused_until = 0           # set when the API tells us to back off
+        self.backoff_time = 1           # used when a 429 does not say how long to wait
+        self.max_backoff_time = 300
+        pass
+
+    # use new limits from variables.txt without forgetting the requests that were already made
+    def set_limits(self, requests_per_second, requests_per_hour, requests_per_day=None):
+        with self.lock:
+            self.buckets["second"].resize(requests_per_second, "variables.txt")
+            self.buckets["hour"].resize(requests_per_hour, "variables.txt")
+            if (requests_per_day is None):
+                self.buckets.pop("day", None)
+            elif ("day" not in self.buckets):
+                self.buckets["day"] = sliding_window("day", requests_per_day, 86400)
+            else:
+                self.buckets["day"].resize(requests_per_day, "variables.txt")
+        pass
+
+    # block the caller until one more API request fits inside every limit
+    def acquire(self):
+        while (True):
+            with self.lock:
+                now = time.monotonic()
+
+                # work out how long the caller has to wait for a free slot in every window
+                wait_time = self.paused_until - now
+                for bucket in self.buckets.values():
+                    wait_time = max(wait_time, bucket.time_until_available(now))
+
+                # claim a slot in every window if all of them have one
+                if (wait_time <= 0):
+                    for bucket in self.buckets.values():
+                        bucket.take(now)
+                    return
+
+            # wait outside of the lock so other threads are not blocked
+            time.sleep(wait_time)
+
+    # use the rate limit headers from the API to correct the local buckets
+    def update_from_headers(self, headers):
+        with self.lock:
+            now = time.monotonic()
+            for name, bucket in self.buckets.items():
+                limit = headers.get(f"X-RateLimit-Limit-{name.capitalize()}")
+                remaining = headers.get(f"X-RateLimit-Remaining-{name.capitalize()}")
+
+                try:
+                    if (limit is not None):
+                        bucket.resize(int(limit))
+                    if (remaining is not None):
+                        # the API is the source of truth since other programs may share the same API key
+                        bucket.limit_remaining(now, float(remaining))
+                except ValueError:
+                    continue
+
+            # a successful response means the previous back off worked
+            self.backoff_time = 1
+        pass
+
+    # pause every caller after the API answered with HTTP 429
+    def back_off(self, headers):
+        with self.lock:
+            now = time.monotonic()
+            retry_after = parse_retry_after(headers)
+
+            # fall back to an exponential delay when the API does not say how long to wait
+            if (retry_after is None):
+                retry_after = self.backoff_time
+                self.backoff_time = min(self.backoff_time * 2, self.max_backoff_time)
+
+            # fill the per second window so the requests do not resume as a burst
+            self.buckets["second"].limit_remaining(now, 0)
+
+            self.paused_until = max(self.paused_until, now + retry_after)
+            print(f"API rate limit reached. Pausing API requests for {retry_after:.1f} seconds...\n")
+        pass
+
+    pass
\ No newline at end of file
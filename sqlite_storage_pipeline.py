@@ -0,0 +1,256 @@
+# libraries
+import os
+import csv
+import datetime
+import sqlite3
+import threading
+
+# tables the rows are stored in (one per kind of data so forecasts never replace observations)
+DATASETS = ("observed", "forecast")
+
+# class that stores weather data in an embedded SQLite database keyed by location and hour
+class sqlite_storage:
+    def __init__(self, database_file, field_names, header_fields):
+        self.database_file = database_file
+        self.field_names = field_names
+        self.header_fields = header_fields
+        self.lock = threading.Lock()
+        self.exports = {}       # what each CSV file and Google sheet view looked like after it was last exported
+
+        # one connection is shared by the storage threads, the lock makes sure only one of them uses it at a time
+        self.connection = sqlite3.connect(database_file, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.initialize_database()
+        pass
+
+    # name of a table, making sure only the known tables are ever put into a query
+    def table_name(self, dataset):
+        if (dataset not in DATASETS):
+            raise RuntimeError(f"Unknown dataset {dataset}. Please use one of {', '.join(DATASETS)}.")
+        return dataset
+
+    # create the tables and indexes if they do not exist yet
+    def initialize_database(self):
+        field_columns = ", ".join(f'"{field}" NUMERIC' for field in self.field_names)
+        with self.lock, self.connection:
+            for dataset in DATASETS:
+                table = self.table_name(dataset)
+                self.connection.execute(
+                    f'CREATE TABLE IF NOT EXISTS {table} ('
+                    f'location TEXT NOT NULL, datetime TEXT NOT NULL, coordinates TEXT, {field_columns}, updated_at TEXT NOT NULL, '
+                    f'PRIMARY KEY (location, datetime)) WITHOUT ROWID'
+                )
+                # fields added to FIELD_NAMES after the table was created get their own columns (older rows leave them NULL)
+                stored_columns = set(column[1] for column in self.connection.execute(f'PRAGMA table_info({table})').fetchall())
+                for field in self.field_names:
+                    if (field not in stored_columns):
+                        self.connection.execute(f'ALTER TABLE {table} ADD COLUMN "{field}" NUMERIC')
+                # the primary key already covers time ranges of one location, this index covers time ranges across every location
+                self.connection.execute(f'CREATE INDEX IF NOT EXISTS {table}_datetime ON {table} (datetime)')
+                # finds the rows of a location that changed since the views were last exported
+                self.connection.execute(f'CREATE INDEX IF NOT EXISTS {table}_updated_at ON {table} (location, updated_at)')
+        pass
+
+    # turns a parsed row into the values of one database row (missing values are stored as NULL)
+    def row_to_values(self, row, updated_at):
+        values = [row[2], f"{row[0]} {row[1]}", row[3]]
+        for value in row[4:4 + len(self.field_names)]:
+            values.append(None if (value == '') else value)
+        values.append(updated_at)
+        return values
+
+    # turns a database row back into the same layout the parser creates
+    def values_to_row(self, values):
+        location, recorded_datetime, coordinates = values[0:3]
+        row = [recorded_datetime[0:10], recorded_datetime[11:19], location, coordinates]
+        for value in values[3:]:
+            row.append('' if (value is None) else value)
+        return row
+
+    # add or replace rows (a row for an hour that is already stored replaces it so newer forecasts win)
+    def add_records(self, dataset, rows):
+        if (len(rows) == 0):
+            return 0
+
+        table = self.table_name(dataset)
+        columns = ["location", "datetime", "coordinates"] + self.field_names + ["updated_at"]
+        column_list = ", ".join(f'"{column}"' for column in columns)
+        placeholders = ", ".join("?" for column in columns)
+        updates = ", ".join(f'"{column}" = excluded."{column}"' for column in columns[2:])
+        # a row that is stored again with the same values keeps its updated_at so the views do not export it again
+        changes = " OR ".join(f'"{column}" IS NOT excluded."{column}"' for column in columns[2:-1])
+        query = f'INSERT INTO {table} ({column_list}) VALUES ({placeholders}) ON CONFLICT (location, datetime) DO UPDATE SET {updates} WHERE {changes}'
+
+        updated_at = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        with self.lock, self.connection:
+            self.connection.executemany(query, [self.row_to_values(row, updated_at) for row in rows])
+
+        print(f"Successfully upserted {len(rows)} records into the {table} SQLite table...\n")
+        return len(rows)
+
+    # newest hour stored for a location, read straight from the primary key
+    def latest_recorded_datetime(self, dataset, location):
+        table = self.table_name(dataset)
+        with self.lock:
+            result = self.connection.execute(f'SELECT MAX(datetime) FROM {table} WHERE location = ?', (location,)).fetchone()
+        if ((result is None) or (result[0] is None)):
+            return None
+        return datetime.datetime.strptime(result[0], "%Y-%m-%d %H:%M:%S").replace(tzinfo=datetime.timezone.utc)
+
+    # rows of one location between two hours (both included), in date and time order
+    def read_records(self, dataset, location, start_time=None, end_time=None):
+        table = self.table_name(dataset)
+        columns = ", ".join(["location", "datetime", "coordinates"] + [f'"{field}"' for field in self.field_names])
+        query = f'SELECT {columns} FROM {table} WHERE location = ?'
+        parameters = [location]
+        if (start_time is not None):
+            query = query + ' AND datetime >= ?'
+            parameters.append(start_time.strftime("%Y-%m-%d %H:%M:%S"))
+        if (end_time is not None):
+            query = query + ' AND datetime <= ?'
+            parameters.append(end_time.strftime("%Y-%m-%d %H:%M:%S"))
+        query = query + ' ORDER BY datetime'
+
+        with self.lock:
+            results = self.connection.execute(query, parameters).fetchall()
+        return [self.values_to_row(values) for values in results]
+
+    # current time in the same format as the updated_at column
+    def current_updated_at(self):
+        return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+    # earliest hour of a location with a row added or replaced since the given updated_at (None if nothing changed)
+    def earliest_changed_datetime(self, dataset, location, updated_at):
+        table = self.table_name(dataset)
+        with self.lock:
+            result = self.connection.execute(f'SELECT MIN(datetime) FROM {table} WHERE location = ? AND updated_at >= ?', (location, updated_at)).fetchone()
+        if ((result is None) or (result[0] is None)):
+            return None
+        return datetime.datetime.strptime(result[0], "%Y-%m-%d %H:%M:%S").replace(tzinfo=datetime.timezone.utc)
+
+    # number of rows of a location before an hour
+    def count_records_before(self, dataset, location, end_time):
+        table = self.table_name(dataset)
+        with self.lock:
+            result = self.connection.execute(f'SELECT COUNT(*) FROM {table} WHERE location = ? AND datetime < ?', (location, end_time.strftime("%Y-%m-%d %H:%M:%S"))).fetchone()
+        return result[0]
+
+    # size and modification time of a file (None if it does not exist)
+    def file_signature(self, file_name):
+        if (os.path.exists(file_name) == False):
+            return None
+        file_stats = os.stat(file_name)
+        return (file_stats.st_size, file_stats.st_mtime_ns)
+
+    # byte offset of the first row of a CSV view at or after an hour, found by reading the file backwards from the end
+    def csv_tail_offset(self, file_name, start_time):
+        start_key = start_time.strftime("%Y-%m-%d,%H:%M:%S").encode('utf-8')
+        with open(file_name, mode='rb') as file:
+            file_size = file.seek(0, os.SEEK_END)
+            block_size = 1 << 16
+            while True:
+                block_start = max(0, file_size - block_size)
+                file.seek(block_start)
+                block = file.read(file_size - block_start)
+
+                # walk the complete lines of the block from the last one up (the first line is cut off unless the block starts the file)
+                line_end = len(block)
+                while True:
+                    line_start = block.rfind(b'\n', 0, max(0, line_end - 1)) + 1
+                    if ((line_start == 0) and (block_start > 0)):
+                        break
+                    # the header and the rows before the start hour stay in the file
+                    if ((line_start == 0) or (block[line_start:line_start + len(start_key)] < start_key)):
+                        return block_start + line_end
+                    line_end = line_start
+
+                block_size = block_size * 2
+        pass
+
+    # bring a CSV file up to date with the rows of a location in the database
+    # (only the rows from the earliest changed hour on are rewritten, the whole file only if it was never exported or changed since)
+    def export_csv_file(self, dataset, location, file_name):
+        export_key = ("CSV", dataset, location, file_name)
+        updated_at = self.current_updated_at()
+        previous_export = self.exports.get(export_key)
+
+        if ((previous_export is not None) and (previous_export['signature'] == self.file_signature(file_name))):
+            start_time = self.earliest_changed_datetime(dataset, location, previous_export['updated_at'])
+            if (start_time is None):
+                print(f"No {dataset} records changed since the last export into the {file_name} CSV file for {location}. Ignoring export...\n")
+                return
+            rows = self.read_records(dataset, location, start_time)
+
+            # cut the file at the first changed hour and append the rows from there on
+            with open(file_name, mode='r+b') as file:
+                file.truncate(self.csv_tail_offset(file_name, start_time))
+            with open(file_name, mode='a', newline='', encoding='utf-8') as file:
+                writer = csv.writer(file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+                writer.writerows(rows)
+            print(f"Successfully exported {len(rows)} changed {dataset} records into the {file_name} CSV file for {location}...\n")
+        else:
+            rows = self.read_records(dataset, location)
+
+            # write to a temporary file first so the CSV file is never left half written
+            temporary_file_name = f"{file_name}.tmp"
+            with open(temporary_file_name, mode='w', newline='', encoding='utf-8') as file:
+                writer = csv.writer(file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+                writer.writerow(self.header_fields)
+                writer.writerows(rows)
+            os.replace(temporary_file_name, file_name)
+            print(f"Successfully exported {len(rows)} {dataset} records into the {file_name} CSV file for {location}...\n")
+
+        # rows replaced during the same second are exported again next time since updated_at only has seconds
+        self.exports[export_key] = {'updated_at': updated_at, 'signature': self.file_signature(file_name)}
+        pass
+
+    # bring a Google sheet up to date with the rows of a location in the database
+    # (only the rows from the earliest changed hour on are uploaded, the whole sheet only if it was never exported or changed since)
+    def export_google_sheet(self, dataset, location, sheet_name, gs_storage):
+        export_key = ("Google Sheets", gs_storage.SPREADSHEET_ID, dataset, location, sheet_name)
+        updated_at = self.current_updated_at()
+        previous_export = self.exports.get(export_key)
+
+        if ((previous_export is not None) and gs_storage.ends_with(sheet_name, previous_export['row_count'], previous_export['last_row'])):
+            start_time = self.earliest_changed_datetime(dataset, location, previous_export['updated_at'])
+            if (start_time is None):
+                print(f"No {dataset} records changed since the last export into the {sheet_name} Google Sheet for {location}. Ignoring export...\n")
+                return
+            kept_row_count = self.count_records_before(dataset, location, start_time)
+            rows = self.read_records(dataset, location, start_time)
+            gs_storage.replace_records_after(sheet_name, kept_row_count, previous_export['row_count'], rows)
+            row_count = kept_row_count + len(rows)
+            print(f"Successfully exported {len(rows)} changed {dataset} records into the {sheet_name} Google Sheet for {location}...\n")
+        else:
+            rows = self.read_records(dataset, location)
+            gs_storage.initialize_google_sheet(sheet_name)
+            gs_storage.sort_records(sheet_name, [self.header_fields] + rows)
+            row_count = len(rows)
+            print(f"Successfully exported {len(rows)} {dataset} records into the {sheet_name} Google Sheet for {location}...\n")
+
+        last_row = [str(value) for value in rows[-1][0:2]] if (len(rows) > 0) else None
+        self.exports[export_key] = {'updated_at': updated_at, 'row_count': row_count, 'last_row': last_row}
+        pass
+
+    # close the database connection
+    def close(self):
+        with self.lock:
+            self.connection.close()
+        pass
+
+    pass
+
+# databases shared by the storage sink, the exporter, and the collection threads so each file has one connection
+SQLITE_STORAGES = {}
+SQLITE_STORAGES_LOCK = threading.Lock()
+
+# returns the shared storage for a database file, opening it the first time it is needed and again when the fields changed
+# (the storage that was replaced after a reload of variables.txt closes its connection once nothing uses it anymore)
+def get_sqlite_storage(database_file, field_names, header_fields):
+    with SQLITE_STORAGES_LOCK:
+        storage = SQLITE_STORAGES.get(database_file)
+        if ((storage is None) or (list(storage.field_names) != list(field_names)) or (list(storage.header_fields) != list(header_fields))):
+            storage = sqlite_storage(database_file, field_names, header_fields)
+            SQLITE_STORAGES[database_file] = storage
+    return storage
\ No newline at end of file
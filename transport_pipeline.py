@@ -0,0 +1,125 @@
+# libraries
+import json
+import asyncio
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+import aiohttp
+
+# response returned by the async transport that behaves like a requests response
+class transport_response:
+    def __init__(self, status_code, headers, content, url):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.url = url
+        pass
+
+    # decode the JSON body of the response
+    def json(self):
+        return json.loads(self.content)
+
+    # raise the same error as requests so process_api_data can handle both transports the same way
+    def raise_for_status(self):
+        if (400 <= self.status_code < 600):
+            raise requests.exceptions.HTTPError(f"HTTP {self.status_code} for url: {self.url}", response=self)
+        pass
+
+    pass
+
+# class that keeps a pool of open connections to the API so each request does not need a new TCP and TLS handshake
+class http_transport:
+    def __init__(self, pool_size=10):
+        self.session = requests.Session()
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+        self.pool_size = None
+        self.adapter = None
+        self.resize_pool(pool_size)
+        pass
+
+    # keep one connection per worker thread alive between requests (called again when MAX_CONCURRENT_LOCATIONS changes between passes)
+    def resize_pool(self, pool_size):
+        if (pool_size == self.pool_size):
+            return
+        if (self.pool_size is not None):
+            print(f"Resizing the API connection pool from {self.pool_size} to {pool_size} connections...\n")
+
+        previous_adapter = self.adapter
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.pool_size = pool_size
+        if (previous_adapter is not None):
+            previous_adapter.close()
+        pass
+
+    # make a GET request through the shared session
+    def get(self, url, params, timeout):
+        return self.session.get(url=url, params=params, timeout=timeout)
+
+    # make a GET request that only reads the body when it is iterated over (the response has to be closed afterwards)
+    def stream(self, url, params, timeout):
+        return self.session.get(url=url, params=params, timeout=timeout, stream=True)
+
+    # close every pooled connection
+    def close(self):
+        self.session.close()
+        pass
+
+    pass
+
+# class that makes API requests with aiohttp so many requests can wait on the network at once
+class async_http_transport:
+    def __init__(self, pool_size=10):
+        self.pool_size = pool_size
+        self.session = None
+        pass
+
+    # create the aiohttp session the first time it is needed since it must be created inside an event loop
+    def get_session(self):
+        if ((self.session is None) or (self.session.closed)):
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector, headers={"Accept-Encoding": "gzip, deflate"})
+        return self.session
+
+    # make a GET request through the shared session
+    async def get(self, url, params, timeout):
+        # aiohttp only accepts strings in the query so lists are repeated the same way requests sends them
+        query_params = []
+        for name, value in params.items():
+            if isinstance(value, (list, tuple)):
+                query_params.extend((name, str(item)) for item in value)
+            else:
+                query_params.append((name, str(value)))
+
+        try:
+            async with self.get_session().get(url, params=query_params, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                content = await response.read()
+                return transport_response(response.status, response.headers, content, str(response.url))
+        # report network errors the same way requests does so the same retry logic can be used
+        except asyncio.TimeoutError as TimeoutException:
+            raise requests.exceptions.Timeout(f"Request to {url} timed out") from TimeoutException
+        except aiohttp.ClientError as ClientError:
+            raise requests.exceptions.ConnectionError(f"Request to {url} failed: {ClientError}") from ClientError
+
+    # close every pooled connection
+    async def close(self):
+        if ((self.session is not None) and (not self.session.closed)):
+            await self.session.close()
+        pass
+
+    pass
+
+# shared transport used by every location so connections are reused across cities and passes
+SHARED_TRANSPORT = None
+SHARED_TRANSPORT_LOCK = threading.Lock()
+
+# returns the shared transport, creating it the first time it is needed and resizing its pool when pool_size changed
+def get_shared_transport(pool_size=10):
+    global SHARED_TRANSPORT
+    with SHARED_TRANSPORT_LOCK:
+        if (SHARED_TRANSPORT is None):
+            SHARED_TRANSPORT = http_transport(pool_size)
+        else:
+            SHARED_TRANSPORT.resize_pool(pool_size)
+    return SHARED_TRANSPORT
\ No newline at end of file
@@ -0,0 +1,88 @@
+# libraries
+import time
+import threading
+import pandas as pd
+
+# latest parsed weather data of one location
+class cached_weather:
+    def __init__(self, location, observed_row, observed_message, forecast_rows, history_rows, schema, history_frame=None):
+        self.location = location
+        self.observed_row = observed_row
+        self.observed_message = observed_message
+        self.forecast_rows = forecast_rows
+        self.history_rows = history_rows
+        self.schema = schema        # field_schema used to find the columns of the rows
+        self.history_frame = history_frame      # the history as typed columns from the bulk parser (None if not parsed)
+        self.updated_at = time.monotonic()
+        pass
+
+    pass
+
+# class that keeps the latest observation, forecast, and history of every location in memory so the bot can answer without the API
+class weather_cache:
+    def __init__(self, ttl_seconds=7200, history_hours=24):
+        self.ttl_seconds = ttl_seconds          # entries older than this are treated as missing (the collection is hourly)
+        self.history_hours = history_hours      # how many of the newest observed hours are kept per location
+        self.entries = {}
+        self.lock = threading.Lock()
+        pass
+
+    # replace the data of a location with the rows of the latest pass
+    # (history_frame holds the observed hour and the history of the pass as typed columns, see parse_intervals_to_data_frame)
+    def update(self, location, observed_row, observed_message, forecast_rows, history_rows, schema, history_frame=None):
+        with self.lock:
+            # the hours of earlier passes are kept since an incremental pass only collects the hours that were missing
+            # (a newer row of the same hour replaces the older one), then only the newest hours are kept, oldest first
+            previous = self.entries.get(location.lower())
+            if ((previous is None) or (previous.schema is not schema)):
+                previous = None
+            previous_rows = previous.history_rows if (previous is not None) else []
+            rows_by_hour = {(row[0], row[1]): row for row in previous_rows + history_rows + [observed_row]}
+            history_rows = [rows_by_hour[hour] for hour in sorted(rows_by_hour)][-self.history_hours:]
+
+            if ((history_frame is not None) and (previous is not None) and (previous.history_frame is not None)):
+                history_frame = pd.concat([previous.history_frame, history_frame], ignore_index=True)
+            if (history_frame is not None):
+                history_frame = history_frame.drop_duplicates(subset=['DateTime'], keep='last').sort_values(by=['DateTime'], kind='stable').tail(self.history_hours).reset_index(drop=True)
+
+            self.entries[location.lower()] = cached_weather(location, observed_row, observed_message, forecast_rows, history_rows, schema, history_frame)
+        pass
+
+    # check if the typed history of a location is already cached (with the same fields)
+    def has_history_frame(self, location, schema):
+        with self.lock:
+            entry = self.entries.get(location.lower())
+        return ((entry is not None) and (entry.schema is schema) and (entry.history_frame is not None))
+
+    # latest data of a location (matched ignoring case, by its start if the name is not complete), None if missing or too old
+    def get(self, location):
+        query = location.strip().lower()
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(query)
+            if (entry is None):
+                matches = [entry for name, entry in self.entries.items() if name.startswith(query)]
+                entry = matches[0] if (len(matches) == 1) else None
+
+        if ((entry is None) or (now - entry.updated_at > self.ttl_seconds)):
+            return None
+        return entry
+
+    # latest data of every location that is not too old
+    def all(self):
+        now = time.monotonic()
+        with self.lock:
+            return [entry for entry in self.entries.values() if (now - entry.updated_at <= self.ttl_seconds)]
+
+    # names of every location that can be asked about
+    def locations(self):
+        return [entry.location for entry in self.all()]
+
+    pass
+
+# cache shared by the collection threads and the Discord bot
+WEATHER_CACHE = weather_cache()
+
+# returns the shared cache
+def get_weather_cache():
+    return WEATHER_CACHE
\ No newline at end of file
@@ -1,112 +1,262 @@
 # libraries
+import json
+import codecs
+import operator
+import numpy as np
+import pandas as pd
+
+# decodes the intervals of a timelines response one at a time from chunks of the response body so the whole document is never held in memory
+# (only the objects inside each "intervals" array are decoded, everything around them is skipped)
+def iterate_timeline_intervals(chunks):
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ""
+    position = 0
+    in_intervals = False
+    finished_reading = False
+
+    while (True):
+        # drop everything that was already decoded so the buffer only ever holds about one interval
+        if (position > 0):
+            buffer = buffer[position:]
+            position = 0
+
+        if (in_intervals == False):
+            key_position = buffer.find('"intervals"')
+            if (key_position >= 0):
+                # skip past the key, the colon, and the opening bracket once all of them have arrived
+                separator = buffer[key_position + len('"intervals"'):].lstrip()
+                if (separator.startswith(':')):
+                    separator = separator[1:].lstrip()
+                    if (separator.startswith('[')):
+                        position = len(buffer) - len(separator) + 1
+                        in_intervals = True
+                        continue
+                    if (separator != ""):
+                        position = key_position + len('"intervals"')     # "intervals" holds something other than a list so it is skipped
+                        continue
+                elif (separator != ""):
+                    position = key_position + len('"intervals"')         # the text was not a key so it is skipped
+                    continue
+                buffer = buffer[key_position:]
+            elif (finished_reading):
+                return
+            else:
+                # keep the end of the buffer in case the key is split between two chunks
+                buffer = buffer[-(len('"intervals"') - 1):]
+        else:
+            # skip the whitespace and commas between intervals
+            while ((position < len(buffer)) and (buffer[position] in ' \t\r\n,')):
+                position = position + 1
+
+            if ((position < len(buffer)) and (buffer[position] == ']')):
+                position = position + 1
+                in_intervals = False
+                continue
+
+            if (position < len(buffer)):
+                try:
+                    interval, position = decoder.raw_decode(buffer, position)
+                    yield interval
+                    continue
+                except json.JSONDecodeError as JSONDecodeError:
+                    # the interval is cut off at the end of the chunk so more of the body is needed
+                    if (finished_reading):
+                        raise ValueError("The timelines response ended in the middle of an interval.") from JSONDecodeError
+
+        if (finished_reading):
+            raise ValueError("The timelines response ended in the middle of the intervals.")
+
+        chunk = next(chunks, None)
+        if (chunk is None):
+            buffer = buffer + text_decoder.decode(b'', final=True)
+            finished_reading = True
+        else:
+            buffer = buffer + text_decoder.decode(chunk)
+
+# label and unit of every field the Discord message knows how to describe
+FIELD_DETAILS = {
+    "temperature": ("Temperature", " °F"),
+    "temperatureApparent": ("Temperature Apparent", " °F"),
+    "dewPoint": ("Dew Point", " °F"),
+    "humidity": ("Humidity", "%"),
+    "windSpeed": ("Wind Speed", " mph"),
+    "windDirection": ("Wind Direction", "°"),
+    "windGust": ("Wind Gust", " mph"),
+    "pressureSurfaceLevel": ("Pressure at Surface Level", " inHg"),
+    "pressureSeaLevel": ("Pressure at Sea Level", " inHg"),
+    "precipitationIntensity": ("Precipitation Intensity", " in/hr"),
+    "rainIntensity": ("Rain Intensity", " in/hr"),
+    "freezingRainIntensity": ("Freezing Rain Intensity", " in/hr"),
+    "snowIntensity": ("Snow Intensity", " in/hr"),
+    "sleetIntensity": ("Sleet Intensity", " in/hr"),
+    "precipitationProbability": ("Precipitation Probability", "%"),
+    "precipitationType": ("Precipitation Type", " (0 = No precipitation, 1 = Rain, 2 = Snow, 3 = Freezing rain, 4 = Ice pellets / sleet)"),
+    "rainAccumulation": ("Rain Accumulation", " in"),
+    "snowAccumulation": ("Snow Accumulation", " in"),
+    "snowAccumulationLwe": ("Snow Accumulation LWE", " in of LWE"),
+    "snowDepth": ("Snow Depth", " in"),
+    "sleetAccumulation": ("Sleet Accumulation", " in"),
+    "sleetAccumulationLwe": ("Sleet Accumulation LWE", " in of LWE"),
+    "iceAccumulation": ("Ice Accumulation", " in"),
+    "iceAccumulationLwe": ("Ice Accumulation LWE", " in of LWE"),
+    "visibility": ("Visibility", " mi"),
+    "cloudCover": ("Cloud Cover", "%"),
+    "cloudBase": ("Cloud Base", " mi"),
+    "cloudCeiling": ("Cloud Ceiling", " mi"),
+    "uvIndex": ("UV Index", " (0-2: Low, 3-5: Moderate, 6-7: High, 8-10: Very High, 11+: Extreme)"),
+    "uvHealthConcern": ("UV Health Concern", " (0-2: Low, 3-5: Moderate, 6-7: High, 8-10: Very High, 11+: Extreme)"),
+    "evapotranspiration": ("Evapotranspiration", " in"),
+    "thunderstormProbability": ("Thunderstorm Probability", "%"),
+    "ezHeatStressIndex": ("EZ Heat Stress Index", " (0-22: No Heat Stress 22-24: Mild Heat Stress 24-26: Moderate Heat Stress 26-28: Medium Heat Stress 28-30: Severe Heat Stress 30+: Extreme Heat Stress)"),
+}
+
+# class that works out once where every field is in a row and how it is described, so rows and messages follow FIELD_NAMES
+class field_schema:
+    def __init__(self, field_names, header_fields=None):
+        # a row is the date, time, location, and coordinates followed by one column per field
+        if ((header_fields is not None) and (len(header_fields) != 4 + len(field_names))):
+            raise RuntimeError(f"HEADER_FIELDS has {len(header_fields)} columns but FIELD_NAMES needs {4 + len(field_names)} (date, time, location, coordinates, and one per field). Please make them match.")
+
+        self.field_names = list(field_names)
+        self.columns = {field: 4 + k for k, field in enumerate(self.field_names)}
+
+        # fields without a known label are described with their column header (or their API name)
+        self.message_lines = []
+        for field, column in self.columns.items():
+            default_label = header_fields[column] if (header_fields is not None) else field
+            label, unit = FIELD_DETAILS.get(field, (default_label, ""))
+            self.message_lines.append((column, f"{label}: ", f"{unit}\n"))
+        pass
+
+    # column of a field in a parsed row (None if the field is not collected)
+    def column(self, field):
+        return self.columns.get(field)
+
+    # the Discord message describing a parsed row
+    def message(self, parsed_data):
+        lines = [f"Here is {parsed_data[2]} weather data for ({parsed_data[0]}) at ({parsed_data[1]}) hours:\n"]
+        for column, prefix, suffix in self.message_lines:
+            lines.append(f"{prefix}{parsed_data[column]}{suffix}")
+        return "".join(lines)
+
+    pass
+
+# schemas shared by every location and pass, one per set of fields
+FIELD_SCHEMAS = {}
+
+# returns the schema for a set of fields, building it only the first time it is needed
+def get_field_schema(field_names, header_fields=None):
+    schema_key = (tuple(field_names), None if (header_fields is None) else tuple(header_fields))
+    schema = FIELD_SCHEMAS.get(schema_key)
+    if (schema is None):
+        schema = field_schema(field_names, header_fields)
+        FIELD_SCHEMAS[schema_key] = schema
+    return schema
 
 # class that parses weather data from the API
 class parse_weather_data:
-    def __init__(self, location, coordinates, field_names):
+    def __init__(self, location, coordinates, field_names, header_fields=None):
         self.location = location
         self.coordinates = coordinates
         self.field_names = field_names
+        self.schema = get_field_schema(field_names, header_fields)     # built once per set of fields and shared by every location
         pass
 
     # collect the observed weather data
     def parse_observed_weather_data(self, observed_data):
-        # initialize variables
         interval = observed_data['data']['timelines'][0]['intervals'][0]
-        start_time = interval.get('startTime', '')
-        date = start_time[0:10]
-        time = start_time[11:19]
-        weather_values = interval.get('values', {})
-        parsed_data = [date, time, self.location, self.coordinates]
-
-        # go through each field and collect the corresponding data
-        for field in self.field_names:
-            value = weather_values.get(field, '')
-            parsed_data.append(value)
+        parsed_data = self.parse_interval(interval)
 
         #print(parsed_data)
-        message = (
-            f"Here is {parsed_data[2]} weather data for ({parsed_data[0]}) at ({parsed_data[1]}) hours:\n"
-            f"Temperature: {parsed_data[4]} °F\n"
-            f"Temperature Apparent: {parsed_data[5]} °F\n"
-            f"Dew Point: {parsed_data[6]} °F\n"
-            f"Humidity: {parsed_data[7]}%\n"
-            f"Wind Speed: {parsed_data[8]} mph\n"
-            f"Wind Direction: {parsed_data[9]}°\n"
-            f"Wind Gust: {parsed_data[10]} mph\n"
-            f"Pressure at Surface Level: {parsed_data[11]} inHg\n"
-            f"Pressure at Sea Level: {parsed_data[12]} inHg\n"
-            f"Precipitation Intensity: {parsed_data[13]} in/hr\n"
-            f"Rain Intensity: {parsed_data[14]} in/hr\n"
-            f"Freezing Rain Intensity: {parsed_data[15]} in/hr\n"
-            f"Snow Intensity: {parsed_data[16]} in/hr\n"
-            f"Sleet Intensity: {parsed_data[17]} in/hr\n"
-            f"Precipitation Probability: {parsed_data[18]}%\n"
-            f"Precipitation Type: {parsed_data[19]} (0 = No precipitation, 1 = Rain, 2 = Snow, 3 = Freezing rain, 4 = Ice pellets / sleet)\n"
-            f"Rain Accumulation: {parsed_data[20]} in\n"
-            f"Snow Accumulation: {parsed_data[21]} in\n"
-            f"Snow Accumulation LWE: {parsed_data[22]} in of LWE\n"
-            f"Snow Depth: {parsed_data[23]} in\n"
-            f"Sleet Accumulation: {parsed_data[24]} in\n"
-            f"Sleet Accumulation LWE: {parsed_data[25]} in of LWE\n"
-            f"Ice Accumulation: {parsed_data[26]} in\n"
-            f"Ice Accumulation LWE: {parsed_data[27]} in of LWE\n"
-            f"Visibility: {parsed_data[28]} mi\n"
-            f"Cloud Cover: {parsed_data[29]}%\n"
-            f"Cloud Base: {parsed_data[30]} mi\n"
-            f"Cloud Ceiling: {parsed_data[31]} mi\n"
-            f"UV Index: {parsed_data[32]} (0-2: Low, 3-5: Moderate, 6-7: High, 8-10: Very High, 11+: Extreme)\n"
-            f"UV Health Concern: {parsed_data[33]} (0-2: Low, 3-5: Moderate, 6-7: High, 8-10: Very High, 11+: Extreme)\n"
-            f"Evapotranspiration: {parsed_data[34]} in\n"
-            f"Thunderstorm Probability: {parsed_data[35]}%\n"
-            f"EZ Heat Stress Index: {parsed_data[36]} (0-22: No Heat Stress 22-24: Mild Heat Stress 24-26: Moderate Heat Stress 26-28: Medium Heat Stress 28-30: Severe Heat Stress 30+: Extreme Heat Stress)\n"
-        )
+        message = self.schema.message(parsed_data)
         return parsed_data, message
     
     # collect the historically observed weather data
     def parse_historically_observed_weather_data(self, historical_data):
-        # initialize variables
         intervals = historical_data['data']['timelines'][0]['intervals']
-        parsed_data = []
-        historically_observed_data = []
-
-        # go through each hour and collect the data
-        for hour in intervals:
-            start_time = hour.get('startTime', '')
-            date = start_time[0:10]
-            time = start_time[11:19]
-            weather_values = hour.get('values', {})
-            parsed_data = [date, time, self.location, self.coordinates]
-
-            # go through each field and collect the corresponding data
-            for field in self.field_names:
-                value = weather_values.get(field, '')
-                parsed_data.append(value)
-
-            historically_observed_data.append(parsed_data)
-        
-        return historically_observed_data
+        return [self.parse_interval(hour) for hour in intervals]
     
     # collect the forecasted weather data
     def parse_forecasted_weather_data(self, forecasted_data):
-        # initialize variables
         intervals = forecasted_data['data']['timelines'][0]['intervals']
-        parsed_forecasted_data = []
+        return [self.parse_interval(hour) for hour in intervals]
+
+    # turns one hour of a timeline into a row
+    def parse_interval(self, hour):
+        start_time = hour.get('startTime', '')
+        weather_values = hour.get('values', {})
+        return [start_time[0:10], start_time[11:19], self.location, self.coordinates] + [weather_values.get(field, '') for field in self.field_names]
 
-        # go through each hour and collect the data
+    # collect rows as the intervals arrive from a streamed response (see iterate_timeline_intervals)
+    def parse_streamed_weather_data(self, intervals):
         for hour in intervals:
-            start_time = hour.get('startTime', '')
-            date = start_time[0:10]
-            time = start_time[11:19]
-            weather_values = hour.get('values', {})
-            parsed_data = [date, time, self.location, self.coordinates]
+            yield self.parse_interval(hour)
+
+    # turns every hour of a timeline into typed columns in one pass (numbers as floats, the start time as a UTC timestamp)
+    def parse_intervals_to_data_frame(self, intervals):
+        hour_count = len(intervals)
+        start_times = [hour.get('startTime', '') for hour in intervals]
+        weather_values = [hour.get('values', {}) for hour in intervals]
+
+        # numpy reads the ISO start times much faster than pandas, pandas is only used when one of them is malformed
+        # (nanoseconds like everywhere else, so frames from both parsers can be combined and stored in the same Parquet files)
+        try:
+            date_times = pd.DatetimeIndex(np.array([start_time[0:19] for start_time in start_times], dtype='datetime64[s]')).tz_localize('UTC').as_unit('ns')
+        except ValueError:
+            date_times = pd.DatetimeIndex(pd.to_datetime(pd.Series(start_times, dtype='object'), format='ISO8601', errors='coerce', utc=True))
+
+        # the text columns are given their type so an empty timeline still has text columns
+        columns = {
+            'date': pd.Series([start_time[0:10] for start_time in start_times], dtype='string'),
+            'time': pd.Series([start_time[11:19] for start_time in start_times], dtype='string'),
+            'location': pd.Series([self.location] * hour_count, dtype='string'),
+            'coordinates': pd.Series([self.coordinates] * hour_count, dtype='string'),
+        }
+
+        # every field of every hour is read into one float array, fetching all fields of an hour with a single call when none are missing
+        try:
+            field_getter = operator.itemgetter(*self.field_names)
+            field_values = [field_getter(values) for values in weather_values]
+            if (len(self.field_names) == 1):
+                field_values = [[value] for value in field_values]      # itemgetter returns a single value instead of a tuple for one field
+        except KeyError:
+            field_values = [[values.get(field) for field in self.field_names] for values in weather_values]
+
+        try:
+            field_array = np.array(field_values, dtype=np.float64).reshape(hour_count, len(self.field_names))     # null values become NaN
+        except (TypeError, ValueError):
+            # the API sent text for a field so the slower conversion that turns it into NaN is used
+            field_array = pd.DataFrame(field_values, columns=self.field_names).apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+
+        df = pd.concat([pd.DataFrame(columns), pd.DataFrame(field_array, columns=self.field_names)], axis=1)
+        df['DateTime'] = date_times
+        return df
+
+    # collect the observed weather data as a DataFrame with one row
+    def parse_observed_weather_data_frame(self, observed_data):
+        return self.parse_intervals_to_data_frame(observed_data['data']['timelines'][0]['intervals'][0:1])
+
+    # collect the historically observed weather data as a DataFrame
+    def parse_historically_observed_weather_data_frame(self, historical_data):
+        return self.parse_intervals_to_data_frame(historical_data['data']['timelines'][0]['intervals'])
+
+    # collect the forecasted weather data as a DataFrame
+    def parse_forecasted_weather_data_frame(self, forecasted_data):
+        return self.parse_intervals_to_data_frame(forecasted_data['data']['timelines'][0]['intervals'])
 
-            # go through each field and collect the corresponding data
-            for field in self.field_names:
-                value = weather_values.get(field, '')
-                parsed_data.append(value)
+    # turns stored weather data (parsed rows, or a table with the stored columns in the same order) into the typed columns of parse_intervals_to_data_frame
+    def stored_data_frame(self, stored_data):
+        if (len(stored_data) == 0):
+            return self.parse_intervals_to_data_frame([])
+        stored_df = pd.DataFrame(stored_data).iloc[:, 0:4 + len(self.field_names)].reset_index(drop=True)
+        stored_df.columns = ['date', 'time', 'location', 'coordinates'] + list(self.field_names)
 
-            parsed_forecasted_data.append(parsed_data)
+        columns = {column: stored_df[column].astype('string') for column in ['date', 'time', 'location', 'coordinates']}
+        field_array = stored_df[list(self.field_names)].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)     # empty values become NaN
+        df = pd.concat([pd.DataFrame(columns), pd.DataFrame(field_array, columns=self.field_names)], axis=1)
+        df['DateTime'] = pd.to_datetime(df['date'] + ' ' + df['time'], format='%Y-%m-%d %H:%M:%S', errors='coerce', utc=True)
+        return df
 
-        return parsed_forecasted_data
-                
     pass
\ No newline at end of file
@@ -2,8 +2,9 @@
 import os
 import json
 import datetime
-import ast
 import time
+import itertools
+import threading
 #import discord
 from discord.ext import tasks, commands
 import logging
@@ -14,148 +15,326 @@ import numpy as np
 import api_pipeline
 import weather_parser_pipeline
 import csv_storage_pipeline
+import collection_pipeline
+import rate_limit_pipeline
+import transport_pipeline
+import write_behind_pipeline
+import config_pipeline
+import weather_cache_pipeline
+import sqlite_storage_pipeline
+import parquet_storage_pipeline
 import gs_storage_pipeline
 import discord_pipeline
 import feature_analysis_pipeline
+import rain_prediction_pipeline
+
+# shared API request budget that lasts across hourly passes so the hourly limit is respected
+API_RATE_LIMITER = None
+
+# returns the shared API request budget, creating it the first time it is needed and using the newest limits of variables.txt
+def get_rate_limiter(variables):
+    global API_RATE_LIMITER
+    REQUESTS_PER_SECOND = variables.get('REQUESTS_PER_SECOND', 3)
+    REQUESTS_PER_HOUR = variables.get('REQUESTS_PER_HOUR', 25)
+    REQUESTS_PER_DAY = variables.get('REQUESTS_PER_DAY', 500)
+    if (API_RATE_LIMITER is None):
+        API_RATE_LIMITER = rate_limit_pipeline.rate_limiter(REQUESTS_PER_SECOND, REQUESTS_PER_HOUR, REQUESTS_PER_DAY)
+    else:
+        API_RATE_LIMITER.set_limits(REQUESTS_PER_SECOND, REQUESTS_PER_HOUR, REQUESTS_PER_DAY)
+    return API_RATE_LIMITER
+
+# creates the storage sinks listed in STORAGE_BACKENDS (CSV files and Google sheets unless told otherwise)
+def create_storage_sinks(variables):
+    STORAGE_BACKENDS = variables.get('STORAGE_BACKENDS', ["CSV", "Google Sheets"])
+    sinks = {}
+    for backend in STORAGE_BACKENDS:
+        if (backend == "CSV"):
+            sinks[backend] = write_behind_pipeline.csv_storage_sink(variables['FIELD_NAMES'], variables['HEADER_FIELDS'], variables.get('CSV_FSYNC', False))
+        elif (backend == "Google Sheets"):
+            sinks[backend] = write_behind_pipeline.google_sheets_storage_sink(variables['FIELD_NAMES'], variables['HEADER_FIELDS'], variables['SPREADSHEET_ID'], variables['SERVICE_ACCOUNT_FILE'], variables.get('SHEET_MIRROR_DIRECTORY', "sheet_mirror"))
+        elif (backend == "Parquet"):
+            sinks[backend] = write_behind_pipeline.parquet_storage_sink(variables.get('PARQUET_DIRECTORY', "parquet_data"), variables['HEADER_FIELDS'])
+        elif (backend == "SQLite"):
+            sinks[backend] = write_behind_pipeline.sqlite_storage_sink(variables.get('SQLITE_DATABASE', "weather_data.db"), variables['FIELD_NAMES'], variables['HEADER_FIELDS'])
+        else:
+            raise RuntimeError(f"Unknown storage backend {backend} in STORAGE_BACKENDS. Please use CSV, Google Sheets, Parquet, or SQLite.")
+    return sinks
+
+# everything one city needs during an hourly pass, built once and reused until variables.txt changes
+class city_pipeline:
+    def __init__(self, i, variables, rate_limiter, transport):
+        self.location = variables['LOCATIONS'][i]
+        self.coordinates = variables['COORDINATES'][i]
+        self.observed_csv_file = variables['OBSERVED_CSV_FILES'][i]
+        self.forecast_csv_file = variables['FORECAST_CSV_FILES'][i]
+        self.observed_google_sheet = variables['OBSERVED_GOOGLE_SHEETS'][i]
+        self.forecast_google_sheet = variables['FORECAST_GOOGLE_SHEETS'][i]
+
+        self.weather_api = api_pipeline.process_api_data(self.coordinates, variables['FIELD_NAMES'], variables['API_KEY'], rate_limiter, transport, url=variables.get('API_URL', "https://api.tomorrow.io/v4/timelines"), max_history_hours=variables.get('MAX_HISTORY_HOURS', 24), history_window_hours=variables.get('HISTORY_WINDOW_HOURS', 24))
+        self.weather_parser = weather_parser_pipeline.parse_weather_data(self.location, self.coordinates, variables['FIELD_NAMES'], variables['HEADER_FIELDS'])
+        self.csv_storage = csv_storage_pipeline.data_management(self.location, self.coordinates, variables['FIELD_NAMES'], variables['HEADER_FIELDS'])
+        pass
+
+    pass
+
+# class that holds the validated variables, the shared clients, the storage, and every city between hourly passes
+class pipeline_context:
+    def __init__(self, config):
+        self.config = config
+        self.variables = config.variables
+        MAX_CONCURRENT_LOCATIONS = self.variables.get('MAX_CONCURRENT_LOCATIONS', 4)
+
+        # the request budget is kept across reloads so editing variables.txt does not reset the hourly and daily counts
+        # (only its limits and the size of the connection pool change)
+        self.rate_limiter = get_rate_limiter(self.variables)
+        self.transport = transport_pipeline.get_shared_transport(MAX_CONCURRENT_LOCATIONS)
+
+        # the rows are stored in the background by the write-behind queue unless WRITE_BEHIND is turned off
+        self.storage_sinks = create_storage_sinks(self.variables)
+        self.write_queue = None
+        if (self.variables.get('WRITE_BEHIND', True)):
+            self.write_queue = write_behind_pipeline.write_behind_queue(self.storage_sinks, self.variables.get('WRITE_BEHIND_QUEUE_SIZE', 100), spill_directory=self.variables.get('WRITE_BEHIND_SPILL_DIRECTORY', "write_behind_spill"))
+
+        weather_cache_pipeline.get_weather_cache().ttl_seconds = self.variables.get('WEATHER_CACHE_TTL_SECONDS', 7200)
+        weather_cache_pipeline.get_weather_cache().history_hours = max(weather_cache_pipeline.get_weather_cache().history_hours, rain_prediction_pipeline.HISTORY_HOURS)   # enough hours to score the chance of rain
+        self.cities = [city_pipeline(i, self.variables, self.rate_limiter, self.transport) for i in range(len(self.variables['LOCATIONS']))]
+        pass
+
+    # finish storing the queued rows before the context is replaced
+    def close(self):
+        if (self.write_queue is not None):
+            self.write_queue.shutdown()
+        pass
+
+    pass
+
+# context shared by every hourly pass
+PIPELINE_CONTEXT = None
+PIPELINE_CONTEXT_LOCK = threading.Lock()
+
+# returns the shared context, building it the first time and again only when a valid change to variables.txt was loaded
+def get_pipeline_context(variables_file="variables.txt"):
+    global PIPELINE_CONTEXT
+    config = config_pipeline.get_config(variables_file)
+    with PIPELINE_CONTEXT_LOCK:
+        if ((PIPELINE_CONTEXT is not None) and (PIPELINE_CONTEXT.config is not config)):
+            print(f"{variables_file} was changed. Rebuilding every city with the new variables...\n")
+            PIPELINE_CONTEXT.close()
+            PIPELINE_CONTEXT = None
+        if (PIPELINE_CONTEXT is None):
+            PIPELINE_CONTEXT = pipeline_context(config)
+    return PIPELINE_CONTEXT
+
+# newest observed hour of a city, read from the cheapest storage backend that is used
+# (an index lookup in SQLite, the newest month of the Parquet files, the end of the CSV file, and only then the Google sheet)
+def latest_recorded_datetime(city, variables):
+    STORAGE_BACKENDS = variables.get('STORAGE_BACKENDS', ["CSV", "Google Sheets"])
+    if ("SQLite" in STORAGE_BACKENDS):
+        sqlite_storage = sqlite_storage_pipeline.get_sqlite_storage(variables.get('SQLITE_DATABASE', "weather_data.db"), variables['FIELD_NAMES'], variables['HEADER_FIELDS'])
+        return sqlite_storage.latest_recorded_datetime("observed", city.location)
+    if ("Parquet" in STORAGE_BACKENDS):
+        parquet_storage = parquet_storage_pipeline.parquet_storage(variables.get('PARQUET_DIRECTORY', "parquet_data"), variables['HEADER_FIELDS'])
+        return parquet_storage.latest_recorded_datetime("observed", city.location)
+    if ("CSV" in STORAGE_BACKENDS):
+        return city.csv_storage.latest_recorded_datetime(city.observed_csv_file)
+    if ("Google Sheets" in STORAGE_BACKENDS):
+        gs_storage = gs_storage_pipeline.storing_into_google_sheets(city.location, city.coordinates, variables['FIELD_NAMES'], variables['HEADER_FIELDS'], variables['SPREADSHEET_ID'], variables['SERVICE_ACCOUNT_FILE'], variables.get('SHEET_MIRROR_DIRECTORY', "sheet_mirror"))
+        return gs_storage.latest_recorded_datetime(city.observed_google_sheet)
+
+    print(f"None of the storage backends {STORAGE_BACKENDS} can tell the newest recorded hour of {city.location}. Collecting the whole history window again...\n")
+    return None
+
+# observed hours of a city from start_time on, read back as typed columns from the first storage backend that can give them (None if none of them can)
+def stored_observed_frame(city, variables, start_time):
+    STORAGE_BACKENDS = variables.get('STORAGE_BACKENDS', ["CSV", "Google Sheets"])
+    HEADER_FIELDS = variables['HEADER_FIELDS']
+    weather_parser = city.weather_parser
+    start_key = start_time.strftime("%Y-%m-%d %H:%M:%S")
 
-# extract variables from variables.txt
-def extract_txt_variables(file_name):
-    variables = {}
-    with open(file_name, mode='r', newline='', encoding='utf-8') as file:
-        for line in file:
-            if (('=' in line) and not (line.startswith('#'))):
-                name, value = line.split('=', 1)
-                name = name.strip()
-                value = value.strip().strip("'").strip('"')
-
-                # Use ast.literal_eval to safely parse lists or strings
-                try:
-                    variables[name] = ast.literal_eval(value)
-                except (ValueError, SyntaxError):
-                    variables[name] = value
-
-    """"
-    print(variables['API_KEY'])
-    print("\n")
-    print(variables['COORDINATES'])
-    print("\n")
-    print(variables['DISCORD_CHANNEL_IDS'])
-    print("\n")
-    print(variables['DISCORD_TOKEN'])
-    print("\n")
-    print(variables['FIELD_NAMES'])
-    print("\n")
-    print(variables['FORECAST_CSV_FILES'])
-    print("\n")
-    print(variables['FORECAST_GOOGLE_SHEETS'])
-    print("\n")
-    print(variables['HEADER_FIELDS'])
-    print("\n")
-    print(variables['LOCATIONS'])
-    print("\n")
-    print(variables['OBSERVED_CSV_FILES'])
-    print("\n")
-    print(variables['OBSERVED_GOOGLE_SHEETS'])
-    print("\n")
-    print(variables['SERVICE_ACCOUNT_FILE'])
-    print("\n")
-    print(variables['SPREADSHEET_ID'])
-    print("\n")
-    """
-    return variables
+    if ("SQLite" in STORAGE_BACKENDS):
+        sqlite_storage = sqlite_storage_pipeline.get_sqlite_storage(variables.get('SQLITE_DATABASE', "weather_data.db"), variables['FIELD_NAMES'], HEADER_FIELDS)
+        return weather_parser.stored_data_frame(sqlite_storage.read_records("observed", city.location, start_time))
 
-# store the weather data from various locations into CSV files and Google sheets
-def weather_data_storage():
-    print(f"Starting to store weather data into CSV files and Google sheets...\n")
+    # only the monthly Parquet files of the hours that are needed are opened
+    if ("Parquet" in STORAGE_BACKENDS):
+        parquet_storage = parquet_storage_pipeline.parquet_storage(variables.get('PARQUET_DIRECTORY', "parquet_data"), HEADER_FIELDS)
+        months = [str(month) for month in pd.period_range(start_time.strftime("%Y-%m"), datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m"), freq='M')]
+        df = parquet_storage.read("observed", HEADER_FIELDS, [city.location], months)
+        return weather_parser.stored_data_frame(df[(df[HEADER_FIELDS[0]] + ' ' + df[HEADER_FIELDS[1]]) >= start_key])
+
+    # the CSV file is read in chunks so only the hours that are needed are kept
+    if (("CSV" in STORAGE_BACKENDS) and os.path.exists(city.observed_csv_file)):
+        chunks = [chunk[(chunk.iloc[:, 0] + ' ' + chunk.iloc[:, 1]) >= start_key] for chunk in pd.read_csv(city.observed_csv_file, dtype=str, keep_default_na=False, chunksize=50000)]
+        return weather_parser.stored_data_frame(pd.concat(chunks, ignore_index=True) if (len(chunks) > 0) else [])
+
+    return None
 
-    # load in the variables before doing anything else
-    variables = extract_txt_variables("variables.txt")
-    API_KEY = variables['API_KEY']
+# bring the CSV files and Google sheets up to date with the SQLite database so they show the newest forecasts (only the changed rows are rewritten)
+def export_sqlite_views(variables):
     COORDINATES = variables['COORDINATES']
-    DISCORD_CHANNELS = variables['DISCORD_CHANNEL_IDS']
-    DISCORD_TOKEN = variables['DISCORD_TOKEN']
     FIELD_NAMES = variables['FIELD_NAMES']
-    FORECAST_CSV_FILES = variables['FORECAST_CSV_FILES']
-    FORECAST_GOOGLE_SHEETS = variables['FORECAST_GOOGLE_SHEETS']
     HEADER_FIELDS = variables['HEADER_FIELDS']
     LOCATIONS = variables['LOCATIONS']
-    OBSERVED_CSV_FILES = variables['OBSERVED_CSV_FILES']
-    OBSERVED_GOOGLE_SHEETS = variables['OBSERVED_GOOGLE_SHEETS']
-    SERVICE_ACCOUNT_FILE = variables['SERVICE_ACCOUNT_FILE']
-    SPREADSHEET_ID = variables['SPREADSHEET_ID']
+    SQLITE_EXPORT_VIEWS = variables.get('SQLITE_EXPORT_VIEWS', ["CSV"])
+    sqlite_storage = sqlite_storage_pipeline.get_sqlite_storage(variables.get('SQLITE_DATABASE', "weather_data.db"), FIELD_NAMES, HEADER_FIELDS)
 
-    observed_messages = []
-    
-    # collect data from the API and store it
-    
-    # loop through each location
+    csv_files = {"observed": variables['OBSERVED_CSV_FILES'], "forecast": variables['FORECAST_CSV_FILES']}
+    google_sheets = {"observed": variables['OBSERVED_GOOGLE_SHEETS'], "forecast": variables['FORECAST_GOOGLE_SHEETS']}
     for i in range(len(LOCATIONS)):
-        print(f"Collecting data from tomorrow.io weather API for {LOCATIONS[i]}...\n")
-        weather_api = api_pipeline.process_api_data(COORDINATES[i], FIELD_NAMES, API_KEY)
-        weather_data = weather_api.collect_weather_data()
-
-        print(f"Collecting historically observed data from the past 24 hours from tomorrow.io weather API for {LOCATIONS[i]}...\n")
-        historical_weather_data = weather_api.collect_historically_observed_data()
-
-
-        # parsing the weather data before storing it
-        print(f"Parsing observed, historically observed, and forecasted weather data for {LOCATIONS[i]}...\n")
-        weather_parser = weather_parser_pipeline.parse_weather_data(LOCATIONS[i], COORDINATES[i], FIELD_NAMES)
-        observed_data, observed_message = weather_parser.parse_observed_weather_data(weather_data)
-        historical_data = weather_parser.parse_historically_observed_weather_data(historical_weather_data)
-        forecasted_data = weather_parser.parse_forecasted_weather_data(weather_data)
-        observed_messages.append(observed_message)
-
-
-        # store the data into the CSV files
-        print(f"Storing and sorting the observed, historically observed, and forecasted weather data into CSV files for {LOCATIONS[i]}...\n")
-
-        # store the observed data and historically observed data into a CSV file
-        csv_storage = csv_storage_pipeline.data_management(LOCATIONS[i], COORDINATES[i], FIELD_NAMES, HEADER_FIELDS)
-        csv_storage.initialize_csv_file(OBSERVED_CSV_FILES[i])
-        csv_storage.add_record_to_csv_file(OBSERVED_CSV_FILES[i], observed_data)
-
-        for row in historical_data:
-            csv_storage.add_record_to_csv_file(OBSERVED_CSV_FILES[i], row)
-
-        csv_storage.sort_csv_file(OBSERVED_CSV_FILES[i])
-
-        
-        # store the forecasted data into a CSV file
-        csv_storage.initialize_csv_file(FORECAST_CSV_FILES[i])
-
-        for row in forecasted_data:
-            csv_storage.add_record_to_csv_file(FORECAST_CSV_FILES[i], row)
-
-        csv_storage.sort_csv_file(FORECAST_CSV_FILES[i])
-
-
-        # store the data into the Google sheets
-        print(f"Storing the observed, historically observed, and forecasted weather data into Google Sheets for {LOCATIONS[i]}...\n")
-
-        # store the observed data and historically observed data into a Google sheet
-        gs_storage = gs_storage_pipeline.storing_into_google_sheets(LOCATIONS[i], COORDINATES[i], FIELD_NAMES, HEADER_FIELDS, SPREADSHEET_ID, SERVICE_ACCOUNT_FILE)
-        gs_storage.initialize_google_sheet(OBSERVED_GOOGLE_SHEETS[i])
-
-        observed_data = [observed_data]
-        stored_observed_data = gs_storage.all_data(OBSERVED_GOOGLE_SHEETS[i])
-        
-        stored_observed_data = gs_storage.compare_data(observed_data, stored_observed_data, OBSERVED_GOOGLE_SHEETS[i])
-        stored_observed_data = gs_storage.compare_data(historical_data, stored_observed_data, OBSERVED_GOOGLE_SHEETS[i])
-        gs_storage.sort_records(OBSERVED_GOOGLE_SHEETS[i], stored_observed_data)
+        for dataset in sqlite_storage_pipeline.DATASETS:
+            if ("CSV" in SQLITE_EXPORT_VIEWS):
+                sqlite_storage.export_csv_file(dataset, LOCATIONS[i], csv_files[dataset][i])
+            if ("Google Sheets" in SQLITE_EXPORT_VIEWS):
+                gs_storage = gs_storage_pipeline.storing_into_google_sheets(LOCATIONS[i], COORDINATES[i], FIELD_NAMES, HEADER_FIELDS, variables['SPREADSHEET_ID'], variables['SERVICE_ACCOUNT_FILE'], variables.get('SHEET_MIRROR_DIRECTORY', "sheet_mirror"))
+                sqlite_storage.export_google_sheet(dataset, LOCATIONS[i], google_sheets[dataset][i], gs_storage)
+    pass
+
+# chance of rain of every location that was collected, scored with the saved model in one batch from the rows in the weather cache
+def predict_rain(variables):
+    RAIN_MODEL_DIRECTORY = variables.get('RAIN_MODEL_DIRECTORY', "rain_models")
+    predictor = rain_prediction_pipeline.get_rain_predictor(RAIN_MODEL_DIRECTORY)
+    if (predictor is None):
+        print(f"Skipping rain prediction since no model has been trained into {RAIN_MODEL_DIRECTORY} yet...\n")
+        return {}
+
+    # the typed columns the bulk parser produced are stacked as they are, without turning any rows into DataFrames
+    entries = [entry for entry in weather_cache_pipeline.get_weather_cache().all() if (entry.history_frame is not None)]
+    if (len(entries) == 0):
+        return {}
+    observed_df = pd.concat([entry.history_frame for entry in entries], ignore_index=True)
+    return predictor.predict_latest(observed_df)
+
+# store the weather data from a single city into CSV files and Google sheets
+def store_location_weather_data(city, context):
+    variables = context.variables
+    write_queue = context.write_queue
+    COMBINED_API_REQUEST = variables.get('COMBINED_API_REQUEST', True)
+    INCREMENTAL_HISTORY = variables.get('INCREMENTAL_HISTORY', True)
+    STREAM_BATCH_SIZE = variables.get('STREAM_BATCH_SIZE', 500)
+    STREAM_HISTORY = variables.get('STREAM_HISTORY', False)
+
+    # only the hours after the newest recorded hour are requested so gaps after downtime are filled on their own
+    latest_recorded = None
+    if (INCREMENTAL_HISTORY):
+        latest_recorded = latest_recorded_datetime(city, variables)
 
+    # collect data from the API and store it
+    print(f"Collecting data from tomorrow.io weather API for {city.location}...\n")
+    weather_api = city.weather_api
+
+    # long backfills can be streamed so only a batch of hours is held in memory at once, no matter how long the gap is
+    streamed_history = iter(())
+
+    # the current, forecasted, and missing historical data can be collected with one API request to halve the API usage
+    if (COMBINED_API_REQUEST):
+        print(f"Collecting current, forecasted, and missing historically observed data in one request for {city.location}...\n")
+        weather_data, historical_weather_data = weather_api.collect_combined_weather_data(latest_recorded, STREAM_HISTORY == False)
+        if (STREAM_HISTORY):
+            streamed_history = weather_api.stream_older_historically_observed_data(latest_recorded)
+    else:
+        weather_data = weather_api.collect_weather_data()
 
-        # store the forecasted data into a Google sheet
-        gs_storage.initialize_google_sheet(FORECAST_GOOGLE_SHEETS[i])
-        stored_forecasted_data = gs_storage.all_data(FORECAST_GOOGLE_SHEETS[i])
-        stored_forecasted_data = gs_storage.compare_data(forecasted_data, stored_forecasted_data, FORECAST_GOOGLE_SHEETS[i])
-        gs_storage.sort_records(FORECAST_GOOGLE_SHEETS[i], stored_forecasted_data)
+        print(f"Collecting missing historically observed data from tomorrow.io weather API for {city.location}...\n")
+        if (STREAM_HISTORY):
+            historical_weather_data = {'data': {'timelines': [{'timestep': '1h', 'intervals': []}]}}
+            streamed_history = weather_api.stream_missing_historically_observed_data(latest_recorded)
+        else:
+            historical_weather_data = weather_api.collect_missing_historically_observed_data(latest_recorded)
+
+
+    # parsing the weather data before storing it
+    print(f"Parsing observed, historically observed, and forecasted weather data for {city.location}...\n")
+    weather_parser = city.weather_parser
+    observed_data, observed_message = weather_parser.parse_observed_weather_data(weather_data)
+    historical_data = weather_parser.parse_historically_observed_weather_data(historical_weather_data)
+    forecasted_data = weather_parser.parse_forecasted_weather_data(weather_data)
+
+    # the same hours as typed columns for the Parquet files and the rain prediction, so they never have to turn the rows back into DataFrames
+    observed_frame = pd.concat([weather_parser.parse_observed_weather_data_frame(weather_data), weather_parser.parse_historically_observed_weather_data_frame(historical_weather_data)], ignore_index=True)
+    forecasted_frame = weather_parser.parse_forecasted_weather_data_frame(weather_data)
+
+    # after a restart the cache only holds the hours of this pass (an incremental pass only collects the missing hours),
+    # so the hours the rain prediction looks back over are read back from storage once
+    weather_cache = weather_cache_pipeline.get_weather_cache()
+    cached_frame = observed_frame
+    if (variables.get('RAIN_PREDICTION', True) and (weather_cache.has_history_frame(city.location, weather_parser.schema) == False)):
+        stored_frame = stored_observed_frame(city, variables, datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=weather_cache.history_hours))
+        if (stored_frame is None):
+            print(f"None of the storage backends can give back the observed history of {city.location}. Its chance of rain is only predicted once enough hours were collected...\n")
+        else:
+            print(f"Loaded {len(stored_frame)} stored observed hours of {city.location} into the weather cache...\n")
+            cached_frame = pd.concat([stored_frame, observed_frame], ignore_index=True)
+
+    # the bot commands answer from the newest rows in memory instead of calling the API
+    weather_cache.update(city.location, observed_data, observed_message, forecasted_data, historical_data, weather_parser.schema, cached_frame)
+
+
+    # store the observed data and historically observed data in the observed CSV file and Google sheet, and the forecasted data in the forecast ones
+    storage_jobs = [
+        write_behind_pipeline.storage_job(city.location, city.coordinates, city.observed_csv_file, city.observed_google_sheet, [observed_data] + historical_data, "observed", observed_frame),
+        write_behind_pipeline.storage_job(city.location, city.coordinates, city.forecast_csv_file, city.forecast_google_sheet, forecasted_data, "forecast", forecasted_frame)
+    ]
+
+    # the rows are stored in the background so a slow Google sheets upload does not hold up the next location
+    if (write_queue is not None):
+        print(f"Queueing the observed, historically observed, and forecasted weather data to be stored for {city.location}...\n")
+        for storage_job in storage_jobs:
+            write_queue.submit(storage_job)
+    else:
+        print(f"Storing the observed, historically observed, and forecasted weather data into CSV files and Google Sheets for {city.location}...\n")
+        for sink in context.storage_sinks.values():
+            sink.write(storage_jobs)
+
+    # store the streamed history one batch at a time while the rest of it is still being read from the API
+    streamed_rows = weather_parser.parse_streamed_weather_data(streamed_history)
+    for batch in iter(lambda: list(itertools.islice(streamed_rows, STREAM_BATCH_SIZE)), []):
+        print(f"Storing a batch of {len(batch)} streamed historically observed hours for {city.location}...\n")
+        storage_job = write_behind_pipeline.storage_job(city.location, city.coordinates, city.observed_csv_file, city.observed_google_sheet, batch, "observed")
+        if (write_queue is not None):
+            write_queue.submit(storage_job)
+        else:
+            for sink in context.storage_sinks.values():
+                sink.write([storage_job])
+
+    return observed_message
 
+# store the weather data from various locations into CSV files and Google sheets
+# (progress_callback is called from the collection threads every time a location finishes, see concurrent_collection_engine.run)
+def weather_data_storage(progress_callback=None):
+    print(f"Starting to store weather data into CSV files and Google sheets...\n")
 
-        # pause the loop for 1 minute before moving on to the next location to prevent API request error
-        print(f"Successfully finished storing weather data for {LOCATIONS[i]}...\n")
-        print(f"Waiting 1 minute before storing data for the next location (if any)...\n")
-        time.sleep(60)
+    # the variables, clients, and cities are only rebuilt when variables.txt changed since the last pass
+    context = get_pipeline_context("variables.txt")
+    variables = context.variables
+    LOCATIONS = variables['LOCATIONS']
+    MAX_CONCURRENT_LOCATIONS = variables.get('MAX_CONCURRENT_LOCATIONS', 4)
+    write_queue = context.write_queue
+
+    # list the worksheets again once per pass in case sheets were added or removed by hand
+    # (only when Google sheets are used, and without connecting if nothing was stored into them yet)
+    if (config_pipeline.uses_google_sheets(variables)):
+        gs_storage_pipeline.invalidate_google_sheets_connection(variables['SPREADSHEET_ID'], variables['SERVICE_ACCOUNT_FILE'])
+
+    # collect and store several locations at once while the shared rate limiter keeps the API requests within the plan limits
+    # every location shares the same pooled connections so each request does not need a new handshake
+    collection_engine = collection_pipeline.concurrent_collection_engine(LOCATIONS, MAX_CONCURRENT_LOCATIONS)
+    observed_messages = collection_engine.run(lambda i: store_location_weather_data(context.cities[i], context), progress_callback)
+
+    # the CSV files and Google sheets are only views of the SQLite database when it is the main storage
+    if ("SQLite" in variables.get('STORAGE_BACKENDS', ["CSV", "Google Sheets"]) and variables.get('SQLITE_EXPORT_VIEWS', ["CSV"])):
+        # only the SQLite rows have to be stored first, a slow or failing Google sheets sink does not hold up the export
+        if (write_queue is not None):
+            write_queue.flush_sink("SQLite")
+        export_sqlite_views(variables)
+
+    # the chance of rain of every location is added to its message
+    if (variables.get('RAIN_PREDICTION', True)):
+        RAIN_PREDICTION_HOURS = variables.get('RAIN_PREDICTION_HOURS', 1)
+        rain_probabilities = predict_rain(variables)
+        observed_messages = [message if ((message is None) or (location not in rain_probabilities)) else f"{message}Chance of Rain in {RAIN_PREDICTION_HOURS} Hour(s): {rain_probabilities[location]:.0%}\n" for location, message in zip(LOCATIONS, observed_messages)]
+
+    # skip the locations that failed during this pass
+    observed_messages = [message for message in observed_messages if (message is not None)]
 
     print(f"Successfully finished storing weather data into CSV files and Google sheets...\n")
     
@@ -171,7 +350,7 @@ def main():
     
     # starting up the Discord bot
     print(f"Starting the Discord bot...\n")
-    variables = extract_txt_variables("variables.txt")
+    variables = get_pipeline_context("variables.txt").variables
     DISCORD_CHANNELS = variables['DISCORD_CHANNEL_IDS']
     DISCORD_TOKEN = variables['DISCORD_TOKEN']
     LOCATIONS = variables['LOCATIONS']
@@ -194,15 +373,12 @@ def main():
     #discord_bot.run(DISCORD_TOKEN, log_handler=handler, log_level=logging.DEBUG)
 
 
-    # feature analysis:
-    i = 0
-    #for i in range(len(LOCATIONS)):
-    #    ow_analysis = feature_analysis_pipeline.weather_data_analysis(OBSERVED_CSV_FILES[i], LOCATIONS[i])
-    #    observed_weather_df = ow_analysis.grab_data()
-    #    ow_analysis.create_correlation_matrix(observed_weather_df)
-    ow_analysis = feature_analysis_pipeline.weather_data_analysis(OBSERVED_CSV_FILES[i], LOCATIONS[i])
-    observed_weather_df = ow_analysis.grab_and_handle_data()
-    ow_analysis.create_correlation_matrix(observed_weather_df)
+    # feature analysis of every location at the same time (a correlation matrix is only recomputed when its CSV file changed)
+    feature_analysis_pipeline.analyze_observed_files(OBSERVED_CSV_FILES, LOCATIONS)
+
+    # train and compare the rain prediction models, the hourly passes score every location with the best one
+    if (variables.get('RAIN_PREDICTION', True)):
+        rain_prediction_pipeline.train_rain_models(OBSERVED_CSV_FILES, LOCATIONS, variables['FIELD_NAMES'], variables.get('RAIN_MODEL_DIRECTORY', "rain_models"), variables.get('RAIN_PREDICTION_HOURS', 1))
 
 
 if __name__ == "__main__":
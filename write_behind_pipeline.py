@@ -0,0 +1,442 @@
+# libraries
+import atexit
+import os
+import re
+import glob
+import pickle
+import queue
+from collections import deque
+import threading
+import time
+import pandas as pd
+
+# custom files
+import csv_storage_pipeline
+import gs_storage_pipeline
+import parquet_storage_pipeline
+import sqlite_storage_pipeline
+
+# rows of one location that still have to be stored, along with where they have to be stored
+class storage_job:
+    def __init__(self, location, coordinates, csv_file_name, sheet_name, rows, dataset="observed", data_frame=None):
+        self.location = location
+        self.coordinates = coordinates
+        self.csv_file_name = csv_file_name
+        self.sheet_name = sheet_name
+        self.rows = rows
+        self.dataset = dataset      # "observed" or "forecast"
+        self.data_frame = data_frame        # the same rows from the bulk parser, used by sinks that store typed columns (None if not parsed)
+        self.storage_key = (dataset, location)
+        pass
+
+    pass
+
+# combines the jobs that store into the same place so each file or sheet is written once per batch
+# (keep_last keeps the copy of each (date, time) from the newest job instead of the first, for storage where newer rows replace older ones)
+def group_jobs(jobs, target, keep_last=False):
+    groups = {}
+    for job in jobs:
+        target_name = getattr(job, target)
+        if (target_name not in groups):
+            groups[target_name] = (job, {})
+        first_job, rows = groups[target_name]
+
+        # keep the first copy of each (date, time) like the storage classes do, unless the newest copy has to win
+        for row in job.rows:
+            if (keep_last or ((row[0], row[1]) not in rows)):
+                rows[(row[0], row[1])] = row
+
+    return [(target_name, first_job, list(rows.values())) for target_name, (first_job, rows) in groups.items()]
+
+# interface every storage backend follows so weather_data_storage can store into any combination of them
+class storage_sink:
+    # store a batch of jobs (has to be safe to repeat since failed batches are retried)
+    def write(self, jobs):
+        raise NotImplementedError("Storage backends have to implement write(jobs).")
+
+    pass
+
+# class that stores batches of jobs into the CSV files
+class csv_storage_sink(storage_sink):
+    def __init__(self, field_names, header_fields, fsync=False):
+        self.field_names = field_names
+        self.header_fields = header_fields
+        self.fsync = fsync
+        self.storages = {}      # one data_management per location, reused by every batch
+        pass
+
+    # returns the storage of a location, creating it the first time the location is stored
+    def get_storage(self, job):
+        if (job.location not in self.storages):
+            self.storages[job.location] = csv_storage_pipeline.data_management(job.location, job.coordinates, self.field_names, self.header_fields)
+        return self.storages[job.location]
+
+    # store every job, one write per CSV file
+    def write(self, jobs):
+        for file_name, job, rows in group_jobs(jobs, "csv_file_name"):
+            print(f"Storing {len(rows)} rows into the {file_name} CSV file for {job.location}...\n")
+            csv_storage = self.get_storage(job)
+            csv_storage.initialize_csv_file(file_name)
+            csv_storage.add_records_to_csv_file(file_name, rows, self.fsync)
+            csv_storage.sort_csv_file(file_name)
+        pass
+
+    pass
+
+# class that stores batches of jobs into the Google sheets
+class google_sheets_storage_sink(storage_sink):
+    def __init__(self, field_names, header_fields, SPREADSHEET_ID, SERVICE_ACCOUNT_FILE, mirror_directory=None):
+        self.field_names = field_names
+        self.header_fields = header_fields
+        self.SPREADSHEET_ID = SPREADSHEET_ID
+        self.SERVICE_ACCOUNT_FILE = SERVICE_ACCOUNT_FILE
+        self.mirror_directory = mirror_directory
+        self.storages = {}      # one storing_into_google_sheets per location, reused by every batch
+        pass
+
+    # returns the storage of a location, creating it the first time the location is stored
+    def get_storage(self, job):
+        if (job.location not in self.storages):
+            self.storages[job.location] = gs_storage_pipeline.storing_into_google_sheets(job.location, job.coordinates, self.field_names, self.header_fields, self.SPREADSHEET_ID, self.SERVICE_ACCOUNT_FILE, self.mirror_directory)
+        return self.storages[job.location]
+
+    # store every job, one upload per Google sheet
+    def write(self, jobs):
+        try:
+            for sheet_name, job, rows in group_jobs(jobs, "sheet_name"):
+                print(f"Storing {len(rows)} rows into the {sheet_name} Google Sheet for {job.location}...\n")
+                gs_storage = self.get_storage(job)
+                gs_storage.initialize_google_sheet(sheet_name)
+
+                # only the new rows are uploaded, in the position that keeps the sheet sorted
+                stored_data = gs_storage.all_data(sheet_name)
+                stored_row_count = len(stored_data)
+                stored_data = gs_storage.compare_data(rows, stored_data, sheet_name)
+                gs_storage.sync_records(sheet_name, stored_data, stored_row_count)
+        except Exception:
+            # the remembered worksheets may be out of date so they are listed again before the retry
+            gs_storage_pipeline.get_google_sheets_connection(self.SPREADSHEET_ID, self.SERVICE_ACCOUNT_FILE).invalidate()
+            raise
+        pass
+
+    pass
+
+# class that stores batches of jobs into typed and compressed Parquet files split up by location and month
+class parquet_storage_sink(storage_sink):
+    def __init__(self, directory, header_fields):
+        self.storage = parquet_storage_pipeline.parquet_storage(directory, header_fields)
+        pass
+
+    # store every job, one new file per location and month (the typed columns of the bulk parser are used as they are)
+    def write(self, jobs):
+        groups = {}
+        for job in jobs:
+            groups.setdefault(job.storage_key, []).append(job)
+
+        for (dataset, location), location_jobs in groups.items():
+            frames = [self.storage.parsed_data_frame(job.data_frame) if (job.data_frame is not None) else self.storage.rows_to_data_frame(job.rows) for job in location_jobs]
+            self.storage.add_data_frame(dataset, location, pd.concat(frames, ignore_index=True))
+        pass
+
+    pass
+
+# class that stores batches of jobs into the SQLite database, replacing hours that are already stored
+class sqlite_storage_sink(storage_sink):
+    def __init__(self, database_file, field_names, header_fields):
+        self.storage = sqlite_storage_pipeline.get_sqlite_storage(database_file, field_names, header_fields)
+        pass
+
+    # store every job, one transaction per location (the rows of newer jobs replace older ones, so a newer forecast wins within a batch too)
+    def write(self, jobs):
+        for storage_key, job, rows in group_jobs(jobs, "storage_key", keep_last=True):
+            self.storage.add_records(job.dataset, rows)
+        pass
+
+    pass
+
+# class that holds the jobs a sink could not take yet, oldest first, keeping only max_jobs of them in memory and writing the rest to disk
+# (the jobs on disk are always newer than the ones in memory, and the ones a shut down worker could not store are found again by the next run)
+class job_spill:
+    def __init__(self, name, max_jobs, directory=None):
+        self.name = name
+        self.max_jobs = max_jobs
+        self.directory = os.path.join(directory, re.sub(r'[^A-Za-z0-9_.-]', '_', name)) if (directory is not None) else None
+        self.jobs = deque()
+        self.job_files = deque()
+
+        # numbers of the job files, counting down for jobs put in front of the others and up for newer jobs
+        self.first_number = 10 ** 15
+        self.last_number = 10 ** 15 - 1
+        if (self.directory is not None):
+            os.makedirs(self.directory, exist_ok=True)
+            self.job_files = deque(sorted(glob.glob(os.path.join(self.directory, "*.pickle"))))
+            if (len(self.job_files) > 0):
+                self.first_number = int(os.path.basename(self.job_files[0]).split(".")[0])
+                self.last_number = int(os.path.basename(self.job_files[-1]).split(".")[0])
+                print(f"Found {len(self.job_files)} jobs for {name} that were not stored by an earlier run. Storing them first...\n")
+        pass
+
+    # number of jobs held in memory and on disk
+    def __len__(self):
+        return len(self.jobs) + len(self.job_files)
+
+    # number of jobs that can be taken (the jobs on disk are left for the next run while shutting down)
+    def available(self, stopping):
+        return len(self.jobs) if (stopping) else len(self)
+
+    # write a job to disk, in front of the other jobs on disk or after them (False if it could not be written)
+    def write_job_file(self, job, in_front):
+        if (self.directory is None):
+            return False
+        if (in_front):
+            self.first_number = self.first_number - 1
+            number = self.first_number
+        else:
+            self.last_number = self.last_number + 1
+            number = self.last_number
+        job_file = os.path.join(self.directory, f"{number:016d}.pickle")
+        try:
+            with open(f"{job_file}.tmp", mode='wb') as file:
+                pickle.dump(job, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f"{job_file}.tmp", job_file)
+        except (OSError, pickle.PicklingError) as error:
+            print(f"Could not write a job for {self.name} to disk: {error}\n")
+            return False
+        if (in_front):
+            self.job_files.appendleft(job_file)
+        else:
+            self.job_files.append(job_file)
+        return True
+
+    # log a job that could neither be kept in memory nor written to disk
+    def drop(self, job):
+        print(f"Dropped {len(job.rows)} {job.dataset} rows of {job.location} for {self.name} since {self.max_jobs} jobs are already waiting in memory. Their rows are missing from {self.name}...\n")
+        pass
+
+    # add the newest job
+    def append(self, job):
+        if ((len(self.job_files) == 0) and (len(self.jobs) < self.max_jobs)):
+            self.jobs.append(job)
+        elif (self.write_job_file(job, False) == False):
+            self.drop(job)
+        pass
+
+    # put jobs in front of every other job (in the given order), moving the newest jobs in memory to disk when there are more than max_jobs
+    def extend_front(self, jobs, max_jobs=None):
+        max_jobs = self.max_jobs if (max_jobs is None) else max_jobs
+        self.jobs = deque(list(jobs) + list(self.jobs))
+        while (len(self.jobs) > max_jobs):
+            job = self.jobs.pop()
+            if (self.write_job_file(job, True) == False):
+                self.drop(job)
+        pass
+
+    # take up to count of the oldest jobs (from disk only when memory is empty and the worker is not shutting down)
+    def take(self, count, stopping):
+        if ((len(self.jobs) > 0) or stopping):
+            return [self.jobs.popleft() for i in range(min(count, len(self.jobs)))]
+
+        jobs = []
+        while ((len(jobs) < count) and (len(self.job_files) > 0)):
+            job_file = self.job_files.popleft()
+            try:
+                with open(job_file, mode='rb') as file:
+                    jobs.append(pickle.load(file))
+                os.remove(job_file)
+            except (OSError, pickle.UnpicklingError, EOFError) as error:
+                print(f"Could not read the {job_file} job for {self.name} back from disk. Its rows are missing from {self.name}: {error}\n")
+        return jobs
+
+    pass
+
+# class that drains its own queue into one sink so a slow or failing sink does not hold up the others
+class storage_sink_worker:
+    def __init__(self, name, sink, max_queue_size, batch_size, max_retries, retry_interval=60, spill_directory=None):
+        self.name = name
+        self.sink = sink
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval    # seconds to wait before trying jobs again after every retry failed
+
+        # jobs that did not fit into the queue or could not be stored yet, oldest first, with at most max_queue_size of them in memory
+        # (once a job is spilled every newer job is spilled behind it so the jobs are always stored in the order they were submitted)
+        self.spilled = job_spill(name, max_queue_size, spill_directory)
+        self.spilled_in_progress = 0
+        self.retry_time = 0
+        self.stopping = False
+        self.stop_received = False
+        self.condition = threading.Condition()
+
+        self.thread = threading.Thread(target=self.run, name=f"{name}-writer", daemon=True)
+        self.thread.start()
+        pass
+
+    # hand a job to the worker without ever waiting, spilling it when the queue is full so the other sinks still get it right away
+    # (past the memory limit the spilled jobs are written to disk, see job_spill)
+    def submit(self, job):
+        with self.condition:
+            if (len(self.spilled) == 0):
+                try:
+                    self.queue.put_nowait(job)
+                    return
+                except queue.Full:
+                    print(f"The {self.name} queue is full. Holding the newest jobs until {self.name} catches up...\n")
+            self.spilled.append(job)
+            self.condition.notify_all()
+        pass
+
+    # the next jobs to store, oldest first, how many of them came from the queue, and whether the worker has to stop
+    def next_batch(self):
+        with self.condition:
+            # the queued jobs are always older than the spilled ones, so the spilled ones are only stored once the queue is empty
+            while ((self.spilled.available(self.stopping) > 0) and self.queue.empty()):
+                wait_time = self.retry_time - time.monotonic()
+                if ((wait_time <= 0) or self.stopping):
+                    jobs = self.spilled.take(self.batch_size, self.stopping)
+                    self.spilled_in_progress = len(jobs)
+                    return jobs, 0, False
+                self.condition.wait(wait_time)
+            if (self.stop_received and self.queue.empty()):
+                return [], 0, True
+
+        # take the next job and whatever else is already waiting so it is stored with a single write
+        # (the stop signal is the newest item, the worker only stops once the spilled jobs before it are stored too)
+        jobs = []
+        queued_count = 0
+        while (len(jobs) < self.batch_size):
+            try:
+                job = self.queue.get() if (queued_count == 0) else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            queued_count = queued_count + 1
+            if (job is None):
+                self.stop_received = True
+                break
+            jobs.append(job)
+        return jobs, queued_count, False
+
+    # take jobs off the queue in batches until the worker is told to stop
+    def run(self):
+        stopping = False
+        while (stopping == False):
+            jobs, queued_count, stopping = self.next_batch()
+
+            # only one attempt is made while shutting down so the program does not hang on a sink that is down
+            if ((len(jobs) > 0) and (self.write_with_retries(jobs, 1 if self.stopping else self.max_retries) == False)):
+                self.keep_failed_jobs(jobs)
+
+            with self.condition:
+                self.spilled_in_progress = 0
+                self.condition.notify_all()
+            for i in range(queued_count):
+                self.queue.task_done()
+        pass
+
+    # store a batch, retrying with an increasing delay since a failed write can safely be repeated (returns whether it was stored)
+    def write_with_retries(self, jobs, max_retries):
+        sleep_time = 5
+        for attempt in range(1, max_retries + 1):
+            try:
+                self.sink.write(jobs)
+                return True
+            except Exception as error:
+                print(f"{self.name} write attempt {attempt} out of {max_retries} failed: {error}\n")
+                if (attempt < max_retries):
+                    print(f"Retrying the {self.name} write in {sleep_time} seconds...\n")
+                    time.sleep(sleep_time)
+                    sleep_time = sleep_time * 2     # increase the delay for the next retry
+        return False
+
+    # keep jobs that could not be stored so they are tried again later instead of being lost
+    def keep_failed_jobs(self, jobs):
+        with self.condition:
+            # the jobs still in the queue are newer than the failed ones and older than the spilled ones, so they move in between
+            waiting_jobs = []
+            while (True):
+                try:
+                    waiting_jobs.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+                self.queue.task_done()
+            # while shutting down the sink is not tried again, every job still waiting is left on disk for the next run instead
+            if (self.stopping):
+                print(f"Could not store {len(jobs)} jobs into {self.name} before shutting down. Leaving every waiting job for the next run...\n")
+                self.spilled.extend_front(jobs + [job for job in waiting_jobs if (job is not None)], 0)
+            else:
+                self.spilled.extend_front(jobs + [job for job in waiting_jobs if (job is not None)])
+            if (None in waiting_jobs):
+                self.queue.put_nowait(None)     # the queue was just emptied so the stop signal fits back in
+            if (self.stopping):
+                return
+
+            self.retry_time = time.monotonic() + self.retry_interval
+            print(f"Keeping {len(self.spilled)} jobs for {self.name} and trying them again in {self.retry_interval} seconds...\n")
+            self.condition.notify_all()
+        pass
+
+    # wait until every job handed to the worker has been stored (or is waiting to be retried after a failure)
+    def flush(self):
+        self.queue.join()
+        with self.condition:
+            while (((len(self.spilled) > 0) or (self.spilled_in_progress > 0)) and (self.retry_time <= time.monotonic()) and (self.stopping == False)):
+                self.condition.wait(1)
+        pass
+
+    # let the worker store what is left with one attempt each (leaving it on disk once an attempt failed) and stop
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.queue.put(None)
+        pass
+
+    pass
+
+# class that lets the collection move on while the parsed rows are stored in the background
+class write_behind_queue:
+    def __init__(self, sinks, max_queue_size=100, batch_size=20, max_retries=5, retry_interval=60, spill_directory=None):
+        self.workers = [storage_sink_worker(name, sink, max_queue_size, batch_size, max_retries, retry_interval, spill_directory) for name, sink in sinks.items()]
+        self.closed = False
+        self.lock = threading.Lock()
+
+        # store whatever is still waiting when the program exits
+        atexit.register(self.shutdown)
+        pass
+
+    # hand a job to every sink (never waits, a sink that is too far behind holds the job itself, on disk once too many are waiting)
+    def submit(self, job):
+        if (self.closed):
+            raise RuntimeError("The write-behind queue has been shut down. Please create a new one to store more data.")
+        for worker in self.workers:
+            worker.submit(job)
+        pass
+
+    # wait until every submitted job has been stored (or is waiting to be retried after a failure)
+    def flush(self):
+        for worker in self.workers:
+            worker.flush()
+        pass
+
+    # wait until every job submitted to one sink has been stored, without waiting on the others
+    def flush_sink(self, name):
+        for worker in self.workers:
+            if (worker.name == name):
+                worker.flush()
+        pass
+
+    # store every waiting job and stop the workers
+    def shutdown(self):
+        with self.lock:
+            if (self.closed):
+                return
+            self.closed = True
+
+        print(f"Storing the remaining queued weather data before shutting down...\n")
+        for worker in self.workers:
+            worker.stop()
+        for worker in self.workers:
+            worker.thread.join()
+        pass
+
+    pass
\ No newline at end of file